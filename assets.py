@@ -0,0 +1,124 @@
+"""章节插图和封面的本地存储
+
+图片用有上限的线程池并发下载，按内容的SHA-256命名保存，不同章节、不同URL的同一张图只存一份。
+``index.json`` 记录URL到文件的映射，已下载过的URL不会再请求。markdown和HTML中的图片链接
+会被改写为本地路径，离线阅读和打包EPUB都不再依赖远程图片。
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from loguru import logger
+
+import client
+import state
+
+IMG_MD = re.compile(r'(!\[[^\]]*\]\()([^)\s]+)(\))')
+IMG_HTML = re.compile(r'(<img\b[^>]*?\bsrc=")([^"]+)(")')
+
+
+class AssetStore:
+    """内容寻址的图片存储
+
+    Args:
+        root: str 图片目录，markdown中的链接相对于当前目录
+        workers: int 并发下载图片的线程数
+    """
+
+    def __init__(self, root: str = 'assets', workers: int = 8):
+        self.root = root
+        self.workers = workers
+        self.index_path = os.path.join(root, 'index.json')
+        self.index = state.load(self.index_path, {})
+        self.downloaded = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        # 正在下载或已下载的URL，多个章节同时引用同一张图时只下载一次
+        self._pending: dict[str, Future] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(root="{self.root}", images={len(self.index)})'
+
+    @staticmethod
+    def _extension(url: str, content_type: str | None) -> str:
+        ext = os.path.splitext(urlsplit(url).path)[1].lower()
+        if ext in ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg'):
+            return ext
+        guessed = mimetypes.guess_extension((content_type or '').split(';')[0].strip())
+        return guessed or '.img'
+
+    def fetch(self, url: str) -> str | None:
+        """下载一张图片，返回本地路径；已下载过的URL直接返回，失败时返回None"""
+        with self._lock:
+            path = self.index.get(url)
+        if path is not None and os.path.exists(path):
+            with self._lock:
+                self.reused += 1
+            return path
+        try:
+            # 图片已按内容存到本地，不必再进HTTP缓存
+            response = client.get(url, use_cache=False)
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f'图片下载失败 {url} {e}')
+            return None
+        data = response.content
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.root, digest + self._extension(url, response.headers.get('Content-Type')))
+        if not os.path.exists(path):
+            tmp = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        with self._lock:
+            self.index[url] = path
+            self.downloaded += 1
+        return path
+
+    def fetch_all(self, urls) -> dict[str, str]:
+        """并发下载多张图片，返回 {URL: 本地路径}，失败的URL不在结果中"""
+        futures = {}
+        with self._lock:
+            for url in urls:
+                if url not in self._pending:
+                    self._pending[url] = self._executor.submit(self.fetch, url)
+                futures[url] = self._pending[url]
+        paths = {url: future.result() for url, future in futures.items()}
+        return {url: path for url, path in paths.items() if path is not None}
+
+    def _localize(self, text: str, pattern: re.Pattern, base_url: str) -> str:
+        sources = {src: urljoin(base_url, src) for src in (m.group(2) for m in pattern.finditer(text))}
+        if not sources:
+            return text
+        paths = self.fetch_all(sources.values())
+        local = {src: paths[url].replace(os.sep, '/') for src, url in sources.items() if url in paths}
+        return pattern.sub(lambda m: m.group(1) + local.get(m.group(2), m.group(2)) + m.group(3), text)
+
+    def localize_md(self, md: str, base_url: str) -> str:
+        """下载markdown中的图片并把链接改为本地路径"""
+        return self._localize(md, IMG_MD, base_url)
+
+    def localize_html(self, html: str, base_url: str) -> str:
+        """下载HTML中的图片并把src改为本地路径"""
+        return self._localize(html, IMG_HTML, base_url)
+
+    def local_images(self, html: str) -> list[str]:
+        """HTML中引用的本地图片路径"""
+        prefix = self.root.replace(os.sep, '/') + '/'
+        return [src for src in (m.group(2) for m in IMG_HTML.finditer(html)) if src.startswith(prefix)]
+
+    def save(self) -> None:
+        """保存URL索引"""
+        with self._lock:
+            state.save(self.index_path, self.index)
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self.save()
+        logger.info(f'图片: 新下载{self.downloaded}张, 已有{self.reused}张')
@@ -0,0 +1,49 @@
+"""比较串行与并发下载整本小说的耗时
+
+用法: python -m benchmarks.bench_concurrency [--volumes 4] [--chapters 25] [--latency 0.05] [--workers 1 4 16]
+"""
+import argparse
+import time
+from unittest import mock
+
+from loguru import logger
+
+import book
+import client
+from benchmarks.mock_server import MockSfacgServer
+
+
+def run(server: MockSfacgServer, workers: int) -> tuple[float, str]:
+    with mock.patch.object(book.Novel, 'base_url_index', server.base_url + '/b/'), \
+            mock.patch.object(book.Novel, 'base_url_menu', server.base_url + '/i/'), \
+            mock.patch.object(book.Volume, 'base_url', server.base_url):
+        novel = book.Novel(1, workers=workers)
+        start = time.perf_counter()
+        content = novel.get_novel_content()
+        return time.perf_counter() - start, content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--volumes', type=int, default=4)
+    parser.add_argument('--chapters', type=int, default=25)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--rate', type=float, default=0, help='限速，每秒请求数，0为不限速')
+    args = parser.parse_args()
+    client.configure(rate=args.rate, cache_dir=None)
+    logger.remove()
+
+    total = args.volumes * args.chapters
+    with MockSfacgServer(args.volumes, args.chapters, args.latency) as server:
+        baseline = None
+        for workers in args.workers:
+            elapsed, content = run(server, workers)
+            if baseline is None:
+                baseline = content
+            assert content == baseline, f'workers={workers} 的输出与串行下载不一致'
+            print(f'workers={workers:>3}  {elapsed:7.2f}s  {total / elapsed:8.1f} 章/秒')
+
+
+if __name__ == '__main__':
+    main()
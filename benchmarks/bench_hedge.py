@@ -0,0 +1,82 @@
+"""对冲请求对单章长尾耗时的效果
+
+两个模拟服务器分别充当移动端和PC端，都有一定比例的请求特别慢。用 ``ch.Chapter`` 按PC端地址并发下载，
+比较关闭和开启对冲请求时的总耗时、单章p50/p95/p99耗时和多发的请求数。
+
+用法: python -m benchmarks.bench_hedge [--chapters 400] [--workers 8] [--latency 0.02]
+                                       [--tail-rate 0.03] [--tail-latency 1.0] [--error-rate 0]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from loguru import logger
+
+import ch
+import client
+import hedge
+import metrics
+from benchmarks.mock_server import MockSfacgServer
+
+
+def fetch(chapter: ch.Chapter) -> float:
+    start = time.perf_counter()
+    chapter.get_chapter_content()
+    return time.perf_counter() - start
+
+
+def run(mobile: MockSfacgServer, pc: MockSfacgServer, args: argparse.Namespace, hedged: bool) -> dict:
+    hedge.reset()
+    metrics.reset()
+    requests = mobile.requests + pc.requests
+    with mock.patch.object(hedge, 'HEDGE', hedged), \
+            mock.patch.object(ch.PCChapter, 'url_prefixes', (pc.base_url + '/Novel/',)), \
+            mock.patch.object(ch.PCChapter, 'mobile_base_url', mobile.base_url + '/c/'), \
+            mock.patch.object(ch.MobileChapter, 'url_prefixes', (mobile.base_url + '/c/',)), \
+            mock.patch.object(ch.Chapter, 'url_prefixes', (mobile.base_url + '/c/', pc.base_url + '/Novel/')), \
+            ThreadPoolExecutor(max_workers=args.workers) as executor:
+        chapters = [ch.Chapter(f'第{cid}章', f'{pc.base_url}/Novel/1/1/{cid}/') for cid in range(1, args.chapters + 1)]
+        start = time.perf_counter()
+        latencies = sorted(executor.map(fetch, chapters))
+        elapsed = time.perf_counter() - start
+    counters = metrics.snapshot()['counters']
+    return {
+        'elapsed': elapsed,
+        'p50': metrics.percentile(latencies, 50),
+        'p95': metrics.percentile(latencies, 95),
+        'p99': metrics.percentile(latencies, 99),
+        'requests': mobile.requests + pc.requests - requests,
+        'hedged': counters.get('hedged', 0),
+        'wins': counters.get('hedge_wins', 0),
+        'failovers': counters.get('failovers', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chapters', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--tail-rate', type=float, default=0.03, help='特别慢的请求比例')
+    parser.add_argument('--tail-latency', type=float, default=1.0, help='慢请求额外的延迟秒数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='移动端返回503的请求比例')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    client.configure(rate=0, cache_dir=None, retries=0)
+    logger.remove()
+
+    options = {'latency': args.latency, 'jitter': args.jitter, 'tail_rate': args.tail_rate,
+               'tail_latency': args.tail_latency}
+    with MockSfacgServer(error_rate=args.error_rate, seed=args.seed, **options) as mobile, \
+            MockSfacgServer(seed=args.seed + 1, **options) as pc:
+        for hedged in (False, True):
+            r = run(mobile, pc, args, hedged)
+            print(f'{"对冲" if hedged else "不对冲"}  总耗时 {r["elapsed"]:6.2f}s  p50 {r["p50"] * 1000:7.1f}ms  '
+                  f'p95 {r["p95"] * 1000:7.1f}ms  p99 {r["p99"] * 1000:7.1f}ms  请求 {r["requests"]}  '
+                  f'对冲 {r["hedged"]} (胜出 {r["wins"]})  故障转移 {r["failovers"]}')
+
+
+if __name__ == '__main__':
+    main()
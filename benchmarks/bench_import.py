@@ -0,0 +1,79 @@
+"""各入口模块的导入耗时
+
+每个入口在新的解释器中用 ``python -X importtime -c "import 模块"`` 导入若干次，取累计耗时的最小值，
+与 ``BUDGETS`` 比较；同时检查 ``LAZY`` 中列出的重量级依赖没有在导入时被提前加载，例如GUI要在窗口
+显示之后才加载requests和bs4。加 ``--check`` 时超出预算或提前加载都以非零状态退出，可以放进CI。
+
+用法: python -m benchmarks.bench_import [--repeat 5] [--top 10] [--scale 1.0] [--check] [模块 ...]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 入口模块 -> 导入耗时上限（毫秒），留有余量，慢的机器可以用 --scale 放宽
+BUDGETS = {
+    'gui': 60,
+    'search': 40,
+    'cli': 300,
+    'watch': 400,
+}
+# 入口模块导入时不应加载的模块，它们在第一次用到时才导入
+LAZY = {
+    'gui': ('requests', 'bs4', 'loguru', 'book', 'review', 'cli'),
+    'search': ('requests', 'bs4', 'loguru'),
+    'cli': ('bs4', 'book', 'review', 'db', 'ebooklib'),
+    'watch': ('ebooklib', 'db', 'review'),
+}
+
+
+def import_time(module: str) -> tuple[float, list[tuple[float, str]]]:
+    """在新的解释器中导入一次，返回 (累计毫秒, [(自身毫秒, 模块名), ...])"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True,
+                            env={**os.environ, 'PYTHONPATH': ROOT})
+    total = 0.0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        modules.append((int(self_us) / 1000, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative_us) / 1000
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS), help='要测的入口模块，默认全部')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=0, help='列出每个入口自身耗时最多的若干个模块')
+    parser.add_argument('--scale', type=float, default=1.0, help='预算乘以该系数')
+    parser.add_argument('--check', action='store_true', help='超出预算或提前加载了重量级依赖时以非零状态退出')
+    args = parser.parse_args()
+
+    # 先导入一次，生成 .pyc，不计入结果
+    for module in args.modules:
+        import_time(module)
+    failed = []
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        best, modules = min(runs, key=lambda run: run[0])
+        budget = BUDGETS.get(module, float('inf')) * args.scale
+        eager = sorted({name for _, name in modules} & set(LAZY.get(module, ())))
+        ok = best <= budget and not eager
+        print(f'{module:<8} {best:7.1f}ms  预算 {budget:6.0f}ms  {"通过" if ok else "超出"}'
+              + (f'  提前加载了 {", ".join(eager)}' if eager else ''))
+        for self_ms, name in sorted(modules, reverse=True)[:args.top]:
+            print(f'    {self_ms:7.1f}ms  {name}')
+        if not ok:
+            failed.append(module)
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""比较一次性拼接整本小说与流式写入的内存峰值
+
+用法: python -m benchmarks.bench_memory [--chapters 100 400 1000] [--workers 8]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+from loguru import logger
+
+import book
+import client
+from benchmarks.mock_server import MockSfacgServer
+
+
+def measure(fn) -> tuple[float, float]:
+    """返回 (耗时秒数, 内存峰值MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def whole_string(novel: book.Novel):
+    content = novel.get_novel_content()
+    with open(f'{novel.title}-{novel.author}.md', 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chapters', type=int, nargs='+', default=[100, 400, 1000])
+    parser.add_argument('--paragraphs', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+    logger.remove()
+    client.configure(rate=0, cache_dir=None)
+
+    print(f'{"章节数":>6} {"一次性拼接":>16} {"流式写入":>16}')
+    with MockSfacgServer(volumes=1, latency=0, paragraphs=args.paragraphs) as server, \
+            tempfile.TemporaryDirectory() as tmp, \
+            mock.patch.object(book.Novel, 'base_url_index', server.base_url + '/b/'), \
+            mock.patch.object(book.Novel, 'base_url_menu', server.base_url + '/i/'), \
+            mock.patch.object(book.Volume, 'base_url', server.base_url):
+        os.chdir(tmp)
+        for chapters in args.chapters:
+            server.chapters = chapters
+            _, whole = measure(lambda: whole_string(book.Novel(1, workers=args.workers)))
+            _, stream = measure(lambda: book.Novel(1, workers=args.workers).download_novel())
+            size = os.path.getsize('测试小说1-测试作者.md') / 1024 / 1024
+            print(f'{chapters:>9} {whole:>13.1f}MB {stream:>13.1f}MB   (输出文件 {size:.1f}MB)')
+
+
+if __name__ == '__main__':
+    main()
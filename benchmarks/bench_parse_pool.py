@@ -0,0 +1,82 @@
+"""比较在下载线程中解析与交给进程池解析章节的吞吐量
+
+章节页较大、网络延迟较小时，下载线程的瓶颈是受GIL限制的BeautifulSoup解析和markdown渲染，
+交给 ``book.parse_pool`` 后每秒章节数应随进程数（不超过CPU核数）增长。模拟服务器运行在单独的进程里，
+不和解析争抢GIL。processes为0表示不使用进程池。
+
+用法: python -m benchmarks.bench_parse_pool [--volumes 4] [--chapters 50] [--paragraphs 400]
+                                            [--latency 0.005] [--workers 16] [--processes 0 1 2 4]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from unittest import mock
+
+from loguru import logger
+
+import book
+import client
+from benchmarks.mock_server import MockSfacgServer
+
+
+def serve(conn, options: dict) -> None:
+    with MockSfacgServer(**options) as server:
+        conn.send(server.base_url)
+        # 父进程关闭管道时退出
+        try:
+            conn.recv()
+        except EOFError:
+            pass
+
+
+def run(base_url: str, workers: int, processes: int) -> tuple[float, str]:
+    pool = book.parse_pool(processes) if processes > 0 else None
+    try:
+        with mock.patch.object(book.Novel, 'base_url_index', base_url + '/b/'), \
+                mock.patch.object(book.Novel, 'base_url_menu', base_url + '/i/'), \
+                mock.patch.object(book.Volume, 'base_url', base_url):
+            novel = book.Novel(1, workers=workers, parse_executor=pool)
+            start = time.perf_counter()
+            content = novel.get_novel_content()
+            return time.perf_counter() - start, content
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--volumes', type=int, default=4)
+    parser.add_argument('--chapters', type=int, default=50)
+    parser.add_argument('--paragraphs', type=int, default=400, help='每章的段落数，越大解析越重')
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--workers', type=int, default=16, help='下载线程数')
+    parser.add_argument('--processes', type=int, nargs='+', default=[0, 1, 2, 4])
+    args = parser.parse_args()
+    client.configure(rate=0, cache_dir=None)
+    logger.remove()
+
+    options = {'volumes': args.volumes, 'chapters': args.chapters, 'latency': args.latency,
+               'paragraphs': args.paragraphs}
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child, options), daemon=True)
+    server.start()
+    base_url = parent.recv()
+    total = args.volumes * args.chapters
+    print(f'CPU核数 {os.cpu_count()}，{total}章，每章{args.paragraphs}段，下载线程{args.workers}')
+    try:
+        baseline = None
+        for processes in args.processes:
+            elapsed, content = run(base_url, args.workers, processes)
+            if baseline is None:
+                baseline = content
+            assert content == baseline, f'processes={processes} 的输出与不用进程池时不一致'
+            print(f'processes={processes:>3}  {elapsed:7.2f}s  {total / elapsed:8.1f} 章/秒')
+    finally:
+        parent.close()
+        server.join(timeout=5)
+
+
+if __name__ == '__main__':
+    main()
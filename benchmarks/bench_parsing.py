@@ -0,0 +1,88 @@
+"""比较不同解析后端在固定页面上的解析耗时，并检查提取结果与 html.parser 整页解析一致
+
+默认的 ``fixtures/`` 是合成页面（见 ``mock_server``），只能比较各后端的相对快慢；
+要得到接近实际的耗时，用 ``--dir`` 指定保存了真实页面的目录，文件名同 ``fixtures/``。
+
+用法: python -m benchmarks.bench_parsing [--number 200] [--dir fixtures]
+"""
+import argparse
+import contextlib
+import os
+import timeit
+from unittest import mock
+
+import book
+import ch
+import parsing
+import review
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load(name: str, directory: str = FIXTURES) -> str:
+    with open(os.path.join(directory, f'{name}.html'), encoding='utf-8') as f:
+        return f.read()
+
+
+def novel_info(html: str) -> str:
+    novel = book.Novel(1)
+    novel.parse_novel_info(html)
+    return novel.render_info()
+
+
+def menu(html: str) -> list:
+    return [(volume.title, [(c.title, c.url) for c in volume.get_chapters()])
+            for volume in map(book.Volume, book.Novel._parse_volume_tags(html))]
+
+
+EXTRACTORS = {
+    'ch.MobileChapter.parse': ('chapter', lambda html: ch.MobileChapter('第一章').parse(html)),
+    'book.MobileChapter.parse': ('chapter', lambda html: book.MobileChapter('第一章', '').parse(html)),
+    'Novel.parse_novel_info': ('info', novel_info),
+    'Novel._parse_volume_tags': ('menu', menu),
+    'Review._parse_info': ('review', lambda html: review.Review(1, '')._parse_info(html)),
+    'BookReviews._parse_title': ('review_list', review.BookReviews._parse_title),
+}
+
+
+@contextlib.contextmanager
+def backend(features: str, strain: bool):
+    make_soup = parsing.make_soup
+
+    def patched(markup, parse_only=None, features=None):
+        return make_soup(markup, parse_only if strain else None, features)
+
+    with mock.patch.object(parsing, 'FEATURES', features), mock.patch.object(parsing, 'make_soup', patched):
+        yield
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=200, help='每项重复次数')
+    parser.add_argument('--dir', default=FIXTURES, help='页面目录，默认为合成的 fixtures/')
+    args = parser.parse_args()
+
+    backends = [('html.parser', False), ('html.parser', True)]
+    try:
+        import lxml  # noqa: F401
+        backends += [('lxml', False), ('lxml', True)]
+    except ImportError:
+        print('未安装lxml，只比较html.parser')
+
+    header = ''.join(f'{features + (" +strainer" if strain else ""):>22}' for features, strain in backends)
+    print(f'{"提取函数":<26}{header}')
+    for name, (fixture, extract) in EXTRACTORS.items():
+        html = load(fixture, args.dir)
+        with backend('html.parser', False):
+            expected = extract(html)
+        cells = []
+        for features, strain in backends:
+            with backend(features, strain):
+                assert extract(html) == expected, f'{name} 在 {features} strain={strain} 下结果不一致'
+                seconds = timeit.timeit(lambda: extract(html), number=args.number) / args.number
+            cells.append(f'{seconds * 1000:>20.3f}ms')
+        print(f'{name:<26}{"".join(cells)}')
+
+
+if __name__ == '__main__':
+    main()
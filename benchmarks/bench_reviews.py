@@ -0,0 +1,61 @@
+"""比较串行与asyncio并发下载书评的耗时，并检查两者输出的markdown完全一致
+
+用法: python -m benchmarks.bench_reviews [--reviews 30] [--replies 25] [--latency 0.05] [--concurrency 1 8 32]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from unittest import mock
+
+import client
+import review
+from benchmarks.mock_server import MockSfacgServer
+
+
+def run(server: MockSfacgServer, concurrency: int) -> tuple[float, str]:
+    with tempfile.TemporaryDirectory() as tmp, \
+            mock.patch.object(review.BookReviews, 'review_base_url', server.base_url + '/cmt/l/list/'), \
+            mock.patch.object(review.BookReviews, 'base_url', server.base_url + '/API/HTML5.ashx'), \
+            mock.patch.object(review.Review, 'base_url', server.base_url + '/cmt/l/'), \
+            mock.patch.object(review.Review, 'reply_base_url', server.base_url + '/API/HTML5.ashx'), \
+            contextlib.redirect_stdout(io.StringIO()):
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            start = time.perf_counter()
+            book = review.BookReviews(server.base_url + '/b/1/')
+            book.download_reviews(concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+            with open(f'{book.title}.md', encoding='utf-8') as f:
+                return elapsed, f.read()
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reviews', type=int, default=30)
+    parser.add_argument('--replies', type=int, default=25)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--rate', type=float, default=0, help='限速，每秒请求数，0为不限速')
+    args = parser.parse_args()
+    client.configure(rate=args.rate, cache_dir=None)
+
+    with MockSfacgServer(latency=args.latency, reviews=args.reviews, replies=args.replies) as server:
+        baseline = None
+        for concurrency in args.concurrency:
+            before = server.requests
+            elapsed, content = run(server, concurrency)
+            if baseline is None:
+                baseline = content
+            assert content == baseline, f'concurrency={concurrency} 的输出与串行下载不一致'
+            print(f'concurrency={concurrency:>3}  {elapsed:7.2f}s  {server.requests - before:>5}次请求  '
+                  f'{args.reviews / elapsed:7.1f} 篇/秒')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""本地模拟的sfacg移动端服务器，用于离线基准测试
+
+提供 /b/{nid} 小说信息页、/i/{nid} 目录页、/c/{cid} 章节页、PC端的 /Novel/{nid}/{vid}/{cid} 章节页、
+/cmt/l/list/{nid} 书评列表页、
+/cmt/l/{cid} 书评详情页以及 /API/HTML5.ashx 的 getcmtlist/getcmtreply 接口。
+页面默认按参数生成，规模可调；``fixtures=True`` 时改为返回 ``fixtures/`` 下的固定页面。这些页面也是合成的：
+标签结构仿照网站，``<head>`` 用占位脚本填充，正文是同一句话截成不同长度，并不是从网站保存下来的，
+大小和标签数与真实页面只是大致相当。需要真实数据时把保存的页面按 ``FIXTURES`` 的文件名放进一个目录，
+再传 ``fixtures=目录``。
+每个请求可附加延迟和随机抖动，并可按比例注入5xx错误、断开连接和特别慢的长尾请求，用来测重试、退避和对冲请求。
+"""
+import contextlib
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# 路由对应的固定页面文件名
+FIXTURES = {
+    'b': 'info.html',
+    'i': 'menu.html',
+    'c': 'chapter.html',
+    'cmt/l/list': 'review_list.html',
+    'cmt/l': 'review.html',
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有5，并发连接一多就会被丢弃并触发1秒的SYN重传
+    request_queue_size = 128
+
+
+def info_page(nid: str) -> str:
+    return f"""<html><body>
+<div class="book_info"><img src="/cover/{nid}.jpg"><span>测试小说{nid}</span>
+<div><span>奇幻</span> <span>冒险</span></div></div>
+<div class="book_info3">测试作者 / 100万字 / 12345 2024/1/1 12:00:00</div>
+<small> 100 </small><small> 200 </small><small> 0 </small>
+<div class="book_bk_qs1">这是一段简介</div>
+</body></html>"""
+
+
+def menu_page(volumes: int, chapters: int) -> str:
+    parts = ['<html><body>']
+    for v in range(volumes):
+        links = ''.join(
+            f'<li><a href="/c/{v * chapters + c + 1}/">第{v + 1}卷第{c + 1}章</a></li>'
+            for c in range(chapters)
+        )
+        parts.append(f'<div class="mulu">第{v + 1}卷</div>\n<div class="mulu_list"><ul>{links}</ul></div>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def chapter_page(cid: str, paragraphs: int = 40) -> str:
+    body = '<br>'.join(f'<p>第{cid}章的第{i}段正文内容。</p>' for i in range(paragraphs))
+    # 插图用相对路径，由本服务器的 /img/ 提供；banner.jpg 是各章共用的同一张图
+    images = f'<img src="/img/{cid}.jpg"><img src="/img/banner.jpg">'
+    return f'<html><body><div><div style="font-size:16px">{body}{images}</div></div></body></html>'
+
+
+def pc_chapter_page(cid: str, paragraphs: int = 40) -> str:
+    """与 ``chapter_page`` 内容相同的PC端章节页"""
+    body = ''.join(f'<p>　　第{cid}章的第{i}段正文内容。</p>' for i in range(paragraphs))
+    images = f'<p><img src="/img/{cid}.jpg"></p><p><img src="/img/banner.jpg"></p>'
+    return (f'<html><body><div class="article-hd"><h1 class="article-title">第{cid}章</h1></div>'
+            f'<div class="article-content font16" id="ChapterBody" data-class="font16">{body}{images}</div>'
+            f'</body></html>')
+
+
+def image(name: str) -> bytes:
+    """按文件名生成确定的假图片数据"""
+    return b'\xff\xd8\xff\xe0' + hashlib.sha256(name.encode('utf-8')).digest() * 64 + b'\xff\xd9'
+
+
+def review_list_page(nid: str) -> str:
+    return f'<html><head><title>测试小说{nid}小说书评列表-SF轻小说手机版</title></head><body></body></html>'
+
+
+def review_page(cid: str, replies: int) -> str:
+    return f"""<html><head><title>长评{cid}-书评详情-SF轻小说手机版</title></head><body>
+<div><span>读者{cid} 发表于 2024-01-02 03:04</span></div>
+<p>这是第{cid}篇长评的正文。</p>
+<div class="shuping_hudong book_bk_qs1">{replies} 7</div>
+</body></html>"""
+
+
+def review_list_json(reviews: int, page: int, size: int) -> dict:
+    # 按addtime倒序，CommentID越大越新
+    ids = list(range(reviews, 0, -1))[page * size:(page + 1) * size]
+    return {'Cmts': [{'CommentID': cid} for cid in ids]}
+
+
+def reply_json(cid: str, replies: int, page: int, size: int = 10) -> dict:
+    start = page * size
+    return {'Replys': [
+        {'DisplayName': f'用户{n}', 'Content': f' 对{cid}的第{n}条回复 ', 'CreateTime': '2024-01-02 03:04:05'}
+        for n in range(start, min(start + size, replies))
+    ]}
+
+
+def load_fixtures(path: str = FIXTURES_DIR) -> dict[str, str]:
+    """读入固定页面，键为路由前缀"""
+    pages = {}
+    for route, name in FIXTURES.items():
+        with open(os.path.join(path, name), encoding='utf-8') as f:
+            pages[route] = f.read()
+    return pages
+
+
+class MockSfacgServer:
+    """在后台线程运行的模拟服务器
+
+    Args:
+        volumes: int 卷数
+        chapters: int 每卷章节数
+        latency: float 每个请求的固定延迟秒数
+        reviews: int 长评数
+        replies: int 每篇长评的回复数，每页10条
+        paragraphs: int 每章的段落数
+        jitter: float 在固定延迟之外再随机增加的最大秒数
+        error_rate: float 返回 ``error_status`` 的请求比例
+        drop_rate: float 不返回任何内容直接断开连接的请求比例
+        error_status: int 注入错误时的状态码
+        tail_rate: float 额外延迟 ``tail_latency`` 秒的请求比例，模拟偶发的特别慢的请求
+        tail_latency: float 长尾请求额外的延迟秒数
+        fixtures: bool | str 为True时HTML页面使用 ``fixtures/`` 下合成的固定页面，也可以传入保存了真实页面的目录
+        seed: int 随机数种子，便于复现错误注入
+    """
+
+    def __init__(self, volumes: int = 4, chapters: int = 25, latency: float = 0.05,
+                 reviews: int = 30, replies: int = 25, paragraphs: int = 40,
+                 jitter: float = 0.0, error_rate: float = 0.0, drop_rate: float = 0.0, error_status: int = 503,
+                 tail_rate: float = 0.0, tail_latency: float = 1.0,
+                 fixtures: bool | str = False, seed: int | None = None):
+        self.volumes = volumes
+        self.chapters = chapters
+        self.latency = latency
+        self.reviews = reviews
+        self.replies = replies
+        self.paragraphs = paragraphs
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.error_status = error_status
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.pages = load_fixtures(FIXTURES_DIR if fixtures is True else fixtures) if fixtures else None
+        self.requests = 0
+        self.errors = 0
+        self.drops = 0
+        self.tails = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = _Server(('127.0.0.1', 0), self._handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def patch(self) -> contextlib.ExitStack:
+        """把 ``book`` 和 ``review`` 中各类的网站地址指向本服务器，返回的ExitStack退出时还原"""
+        import book
+        import review
+        stack = contextlib.ExitStack()
+        for target, name, path in (
+            (book.Novel, 'base_url_index', '/b/'),
+            (book.Novel, 'base_url_menu', '/i/'),
+            (book.Volume, 'base_url', ''),
+            (review.BookReviews, 'review_base_url', '/cmt/l/list/'),
+            (review.BookReviews, 'base_url', '/API/HTML5.ashx'),
+            (review.Review, 'base_url', '/cmt/l/'),
+            (review.Review, 'reply_base_url', '/API/HTML5.ashx'),
+        ):
+            stack.enter_context(mock.patch.object(target, name, self.base_url + path))
+        return stack
+
+    def _fault(self) -> str | None:
+        """按比例决定本次请求是否注入错误，返回 'drop'、'error' 或 None"""
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+            if roll < self.drop_rate:
+                self.drops += 1
+                fault = 'drop'
+            elif roll < self.drop_rate + self.error_rate:
+                self.errors += 1
+                fault = 'error'
+            else:
+                fault = None
+            if self.tail_rate and self._random.random() < self.tail_rate:
+                self.tails += 1
+                delay += self.tail_latency
+        time.sleep(delay)
+        return fault
+
+    def _page(self, route: str, generate) -> str:
+        # 没有固定页面的路由（如PC端章节页）仍按参数生成
+        if self.pages is not None and route in self.pages:
+            return self.pages[route]
+        return generate()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                fault = server._fault()
+                if fault == 'drop':
+                    # 不发送响应直接关闭，客户端会看到连接被重置
+                    self.close_connection = True
+                    return
+                if fault == 'error':
+                    self.send_response(server.error_status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                url = urlsplit(self.path)
+                parts = url.path.strip('/').split('/')
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                content_type = 'text/html; charset=utf-8'
+                if parts[0] == 'b':
+                    body = server._page('b', lambda: info_page(parts[1]))
+                elif parts[0] == 'i':
+                    body = server._page('i', lambda: menu_page(server.volumes, server.chapters))
+                elif parts[0] == 'c':
+                    body = server._page('c', lambda: chapter_page(parts[1], server.paragraphs))
+                elif parts[0] == 'Novel' and len(parts) == 4:
+                    body = server._page('Novel', lambda: pc_chapter_page(parts[3], server.paragraphs))
+                elif parts[0] in ('img', 'cover'):
+                    body = image(parts[1])
+                    content_type = 'image/jpeg'
+                elif parts[:3] == ['cmt', 'l', 'list']:
+                    body = server._page('cmt/l/list', lambda: review_list_page(parts[3]))
+                elif parts[:2] == ['cmt', 'l']:
+                    body = server._page('cmt/l', lambda: review_page(parts[2], server.replies))
+                elif parts == ['API', 'HTML5.ashx'] and query.get('op') == 'getcmtlist':
+                    body = json.dumps(review_list_json(server.reviews, int(query['pi']), int(query['len'])))
+                    content_type = 'application/json; charset=utf-8'
+                elif parts == ['API', 'HTML5.ashx'] and query.get('op') == 'getcmtreply':
+                    body = json.dumps(reply_json(query['cid'], server.replies, int(query['pi'])))
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+                data = body if isinstance(body, bytes) else body.encode('utf-8')
+                etag = '"' + hashlib.md5(data).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
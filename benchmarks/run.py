@@ -0,0 +1,137 @@
+"""基准测试入口：对模拟服务器运行整本下载、评论下载和单章请求，报告吞吐量、延迟和内存峰值
+
+用法:
+    python -m benchmarks.run [--scenarios novel reviews chapter] [--latency 0.05] [--jitter 0.02]
+                             [--error-rate 0.05] [--drop-rate 0.01] [--fixtures]
+                             [--save result.json] [--baseline result.json]
+
+``--save`` 保存本次结果，之后用 ``--baseline`` 与改动前的结果逐项比较。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from loguru import logger
+
+import book
+import client
+import metrics
+import review
+from benchmarks.mock_server import MockSfacgServer
+
+
+def novel(server: MockSfacgServer, args: argparse.Namespace) -> int:
+    book.Novel(1, workers=args.workers).download_novel()
+    return metrics.snapshot()['counters'].get('chapters', 0)
+
+
+def reviews(server: MockSfacgServer, args: argparse.Namespace) -> int:
+    review.BookReviews('1').download_reviews(concurrency=args.concurrency)
+    return server.reviews
+
+
+def chapter(server: MockSfacgServer, args: argparse.Namespace) -> int:
+    for cid in range(1, args.single + 1):
+        book.MobileChapter(f'第{cid}章', f'{server.base_url}/c/{cid}/').get_chapter_content()
+    return args.single
+
+
+SCENARIOS = {'novel': novel, 'reviews': reviews, 'chapter': chapter}
+
+
+def measure(name: str, server: MockSfacgServer, args: argparse.Namespace) -> dict:
+    metrics.reset()
+    requests, errors, drops = server.requests, server.errors, server.drops
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        items = SCENARIOS[name](server, args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    fetch = metrics.snapshot()['stages'].get('fetch', {})
+    return {
+        'scenario': name,
+        'items': items,
+        'seconds': elapsed,
+        'throughput': items / elapsed,
+        'p50_ms': fetch.get('p50', 0) * 1000,
+        'p95_ms': fetch.get('p95', 0) * 1000,
+        'requests': server.requests - requests,
+        'injected': server.errors - errors + server.drops - drops,
+        'retries': metrics.snapshot()['counters'].get('retries', 0),
+        'peak_mb': peak / 1024 / 1024,
+    }
+
+
+def change(new: float, old: float) -> str:
+    return f'{(new - old) / old:+.0%}' if old else ''
+
+
+def report(results: list[dict], baseline: dict[str, dict]) -> None:
+    print(f'{"场景":<8}{"数量":>6}{"用时":>9}{"吞吐量/秒":>12}{"p50":>10}{"p95":>10}'
+          f'{"请求":>7}{"注入错误":>9}{"重试":>6}{"内存峰值":>11}')
+    for r in results:
+        print(f'{r["scenario"]:<10}{r["items"]:>6}{r["seconds"]:>8.2f}s{r["throughput"]:>12.1f}'
+              f'{r["p50_ms"]:>8.1f}ms{r["p95_ms"]:>8.1f}ms{r["requests"]:>8}{r["injected"]:>11}'
+              f'{r["retries"]:>8}{r["peak_mb"]:>11.1f}MB')
+        old = baseline.get(r['scenario'])
+        if old:
+            print(f'{"  对比基线":<8}{"":>16}{change(r["throughput"], old["throughput"]):>14}'
+                  f'{change(r["p50_ms"], old["p50_ms"]):>10}{change(r["p95_ms"], old["p95_ms"]):>10}'
+                  f'{"":>32}{change(r["peak_mb"], old["peak_mb"]):>11}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--volumes', type=int, default=4)
+    parser.add_argument('--chapters', type=int, default=25)
+    parser.add_argument('--reviews', type=int, default=30)
+    parser.add_argument('--replies', type=int, default=25)
+    parser.add_argument('--single', type=int, default=50, help='chapter场景逐个请求的章节数')
+    parser.add_argument('--workers', type=int, default=8, help='novel场景的章节线程数')
+    parser.add_argument('--concurrency', type=int, default=8, help='reviews场景的并发数')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的请求比例')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='直接断开连接的请求比例')
+    parser.add_argument('--fixtures', action='store_true', help='使用fixtures/下合成的固定页面而不是按参数生成的页面')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate', type=float, default=0, help='限速，每秒请求数，0为不限速')
+    parser.add_argument('--save', metavar='PATH', help='把结果保存为JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='与之前保存的结果比较')
+    args = parser.parse_args()
+    logger.remove()
+    # 注入错误时重试等待不宜过长，否则测的是退避时间
+    client.configure(rate=args.rate, cache_dir=None, backoff=0.05)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {r['scenario']: r for r in json.load(f)}
+    results = []
+    cwd = os.getcwd()
+    with MockSfacgServer(args.volumes, args.chapters, args.latency, args.reviews, args.replies,
+                         jitter=args.jitter, error_rate=args.error_rate, drop_rate=args.drop_rate,
+                         fixtures=args.fixtures, seed=args.seed) as server, \
+            server.patch(), tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for name in args.scenarios:
+                results.append(measure(name, server, args))
+        finally:
+            os.chdir(cwd)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,188 @@
-import requests
-from bs4 import BeautifulSoup, Tag, NavigableString
+import hashlib
+import os
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin
+
+from bs4 import Tag, NavigableString
 from loguru import logger
+from requests import RequestException
+
+import client
+import hedge
+import metrics
+import parsing
+import render
+import state
+from client import HEADERS
+from journal import Journal
+from models import ChapterBody, ChapterRef, NovelInfo, VolumeRef
+
+# EPUB、插图、数据库和进程池只在用到时才导入，只下载markdown时不必加载
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from assets import AssetStore
+    from db import Store
+    from ebook import EpubBuilder
+
+# 下载失败的章节在整本下载完后重新排队的轮数
+REQUEUE_ROUNDS = 1
+# 同步到数据库时每批写入的章节数
+DB_BATCH = 50
+
+
+def ordered_map(fn: Callable, items: Iterable, workers: int, executor: Executor | None = None) -> Iterator:
+    """与 ``Executor.map`` 相同，按顺序逐个产出结果，但最多只有 ``2 * workers`` 个任务在途，
+    已完成但还没轮到的结果不会无限堆积在内存里
+
+    Args:
+        fn: 对每一项调用的函数
+        items: 输入，可以是惰性的迭代器
+        workers: int 线程数，为1时在当前线程串行执行
+        executor: Executor 共用的线程池，传入时不再新建线程池，workers只决定在途任务数
+    """
+    if executor is not None:
+        yield from _windowed_map(fn, items, workers, executor)
+        return
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from _windowed_map(fn, items, workers, executor)
+
+
+def _windowed_map(fn: Callable, items: Iterable, workers: int, executor: Executor) -> Iterator:
+    window = deque()
+    try:
+        for item in items:
+            window.append(executor.submit(fn, item))
+            if len(window) >= 2 * max(workers, 1):
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        # 提前退出时取消还没开始的任务，共用的线程池不会被关闭
+        for future in window:
+            future.cancel()
+
+
+def parse_pool(processes: int | None = None) -> 'ProcessPoolExecutor':
+    """解析章节用的进程池
+
+    BeautifulSoup解析和渲染markdown是纯Python代码，受GIL限制，并发下载时只能用满一个核。
+    把它传给 ``Novel(parse_executor=...)`` 后，下载线程只负责请求，拿到的页面交给子进程解析和渲染。
+
+    子进程用spawn方式启动：进程池在下载线程第一次提交任务时才创建子进程，fork会把其他线程正持有的锁
+    （如 ``metrics`` 的锁）原样复制进子进程，子进程再用到时就会死锁。spawn出的子进程重新导入模块，
+    也不会继承父进程的指标钩子，子进程里的耗时仍由父进程记录。
+
+    Args:
+        processes: int 进程数，为None时等于CPU核数
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def parse_chapter(title: str, url: str, html: str, format: str | None = None) -> tuple:
+    """在子进程中解析章节页，返回 (结果, 解析耗时, 渲染耗时)
+
+    Args:
+        format: str 同 ``MobileChapter.render``，为None时只解析，结果为 ``ChapterBody``
+    """
+    chapter = MobileChapter(title, url)
+    start = time.perf_counter()
+    body = chapter.parse_body(html)
+    parsed = time.perf_counter()
+    result = body if format is None else chapter.render(body, format)
+    return result, parsed - start, time.perf_counter() - parsed
 
-HEADERS = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
 
 class MobileChapter:
     """处理移动端章节
     Args:
         title: str 小说标题
         url: str 小说url
+        parse_executor: Executor 解析和渲染用的进程池，为None时在当前线程解析
+        max_age: float 缓存最多用多少秒，为None时按 ``cache.TTLS``，为0时每次都向网站确认
     """
 
-    def __init__(self, title: str, url: str):
+    def __init__(self, title: str, url: str, parse_executor: Executor | None = None,
+                 max_age: float | None = None):
         self.url = url
         self.title = title
         self.headers = HEADERS
+        self.parse_executor = parse_executor
+        self.max_age = max_age
 
     def __repr__(self):
         return f'{self.__class__.__name__}(title="{self.title}", url="{self.url}")'
 
-    def get_chapter_content(self):
-        """获取章节内容"""
+    def get_chapter_content(self, format: str = 'md') -> str | tuple[str, str]:
+        """获取章节内容
+
+        Args:
+            format: str 同 ``ch.MobileChapter.get_chapter_content``，'md'、'html' 或 'both'
+        """
+        if self.parse_executor is not None:
+            return self._offload(self.fetch_html(), format)
+        return self.render(self.fetch_body(), format)
+
+    def fetch_html(self) -> str:
+        """请求章节页"""
         logger.info(f'{self.title} {self.url}')
-        response = requests.get(self.url, headers=self.headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        content = f'### {self.title}\n\n'
-        children = [child.name for child in soup.div.div.children]
-        for child in soup.div.div.children:
-            if type(child) == NavigableString and str(child).strip() != '':
-                content += f"{str(child).strip()}\n\n"
-            elif child.name == "img":
-                content += f"![]({child['src']})\n\n"
-            elif child.name == "p":
-                content += f"{child.get_text()}\n\n"
-            elif child.name == "br":
-                continue
-        self.content = content.strip()
-        return content.strip()
+        # 超过p95耗时仍未返回时对同一地址发送对冲请求，砍掉个别慢章节拖长的整本下载时间
+        _, response = hedge.get([self.url], max_age=self.max_age)
+        return response.text
+
+    def fetch_body(self) -> ChapterBody:
+        """请求并解析章节页"""
+        if self.parse_executor is not None:
+            return self._offload(self.fetch_html())
+        return self.parse_body(self.fetch_html())
+
+    def _offload(self, html: str, format: str | None = None):
+        """交给进程池解析，等待期间释放GIL，其他下载线程照常请求"""
+        future = self.parse_executor.submit(parse_chapter, self.title, self.url, html, format)
+        result, parse_seconds, render_seconds = future.result()
+        metrics.record('parse', parse_seconds, url=self.url)
+        if format is not None:
+            metrics.record('render', render_seconds, name='parse_chapter')
+        return result
+
+    def parse_body(self, html: str) -> ChapterBody:
+        """解析章节页，按顺序提取段落和插图"""
+        with metrics.timer('parse', url=self.url):
+            soup = parsing.make_soup(html, parsing.CHAPTER)
+            if soup.div is None or soup.div.div is None:
+                raise parsing.MissingContent(f'章节页没有正文 {self.url}')
+            body = ChapterBody(self.title, self.url)
+            for child in soup.div.div.children:
+                if type(child) == NavigableString and str(child).strip() != '':
+                    body.blocks.append(('text', str(child).strip()))
+                elif child.name == "img":
+                    body.blocks.append(('img', child['src']))
+                elif child.name == "p":
+                    body.blocks.append(('text', child.get_text()))
+        return body
+
+    def parse(self, html: str, format: str = 'md') -> str | tuple[str, str]:
+        """解析章节页，format为 'both' 时返回 (markdown, html)"""
+        return self.render(self.parse_body(html), format)
+
+    @staticmethod
+    def render(body: ChapterBody, format: str = 'md') -> str | tuple[str, str]:
+        """把章节正文渲染为 'md'、'html' 或 'both'"""
+        if format == 'html':
+            return render.chapter_html(body)
+        if format == 'both':
+            return render.chapter_md(body), render.chapter_html(body)
+        return render.chapter_md(body)
 
 class Volume:
     """卷"""
@@ -48,18 +192,56 @@ class Volume:
         self.title = vol_tag.string
         self.vol_tag = vol_tag.next_sibling.next_sibling.ul
 
-    def get_volume_content(self):
-        """获取本卷内容"""
-        logger.info(f'{self.title}')
-        volume_content = f'## {self.title}\n\n'
+    def get_chapters(self) -> list[MobileChapter]:
+        """获取本卷的章节列表"""
+        return list(self.iter_chapters())
+
+    def ref(self) -> VolumeRef:
+        """本卷的目录记录"""
+        return VolumeRef(self.title, [ChapterRef(chapter.title, chapter.url) for chapter in self.iter_chapters()])
+
+    def iter_chapters(self) -> Iterator[MobileChapter]:
+        """逐个产出本卷的章节，下载完的章节对象可以及时释放"""
         chapters = {}
         for a_tag in self.vol_tag.find_all('a'):
             chapters[a_tag.get_text()] = self.base_url + a_tag['href']
         for chapter_title, chapter_url in chapters.items():
-            chapter = MobileChapter(chapter_title, chapter_url)
-            chapter_content = chapter.get_chapter_content()
-            volume_content += chapter_content + '\n\n'
-        return volume_content
+            yield MobileChapter(chapter_title, chapter_url)
+
+    def fetch_chapters(self, executor: Executor | None = None, fetch=MobileChapter.get_chapter_content):
+        """下载本卷所有章节，按章节顺序返回内容
+
+        Args:
+            executor: Executor 线程池，为None时逐章串行下载
+            fetch: 以章节为参数、返回章节内容的函数
+        """
+        chapters = self.get_chapters()
+        if executor is None:
+            return (fetch(chapter) for chapter in chapters)
+        # Executor.map会立即提交全部任务，结果仍按提交顺序返回
+        return executor.map(fetch, chapters)
+
+    def render(self, chapter_contents) -> str:
+        """将章节内容拼接为本卷内容"""
+        return ''.join(self.iter_render(chapter_contents))
+
+    def iter_render(self, chapter_contents) -> Iterator[str]:
+        """逐段产出本卷内容"""
+        yield f'## {self.title}\n\n'
+        for chapter_content in chapter_contents:
+            yield chapter_content + '\n\n'
+
+    def get_volume_content(self, workers: int = 1):
+        """获取本卷内容
+
+        Args:
+            workers: int 并发下载章节的线程数，为1时逐章串行下载
+        """
+        logger.info(f'{self.title}')
+        if workers <= 1:
+            return self.render(self.fetch_chapters())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return self.render(self.fetch_chapters(executor))
 
 class Novel:
     """小说内容"""
@@ -67,81 +249,471 @@ class Novel:
     base_url_index = 'https://m.sfacg.com/b/'
     base_url_menu = 'https://m.sfacg.com/i/'
 
-    def __init__(self, nid: int):
+    def __init__(self, nid: int, workers: int = 1, executor: Executor | None = None,
+                 progress: Callable[[int, int], None] | None = None, parse_executor: Executor | None = None,
+                 max_age: float | None = None):
         self.nid = str(nid)
-        self.index_url = ''
-        self.title = ''
-        self.label = ''
-        self.author = ''
-        self.word_num = ''
-        self.click_num = ''
-        self.date = ''
-        self.clock = ''
-        self.heart_num = ''
-        self.praise_num = ''
-        self.intro = '暂无简介'
-        self.cover_url = ''
+        self.workers = workers
+        self.executor = executor
+        # 章节页交给该进程池解析和渲染（见 ``parse_pool``），为None时在下载线程中解析
+        self.parse_executor = parse_executor
+        # 每处理完一章调用 progress(已完成章数, 总章数)，可在其中阻塞以暂停，或抛出异常以取消
+        self.progress = progress
+        # 信息页和目录页的缓存最多用多少秒，为None时按 ``cache.TTLS``，为0时每次都向网站确认
+        self.max_age = max_age
+        self.info = NovelInfo(self.nid, '', '', url=self.base_url_index + self.nid)
+        # 信息页是否已经取到并解析过
+        self.info_loaded = False
+        self.cover_path = ''
+        self.failures = []
+
+    @property
+    def title(self) -> str:
+        return self.info.title
+
+    @property
+    def author(self) -> str:
+        return self.info.author
 
     def get_novel_info(self) -> str:
-        """获取小说信息"""
-        self.index_url = self.base_url_index + self.nid
-        logger.info(self.index_url)
-        res = requests.get(url=self.index_url, headers=self.headers)
-        soup = BeautifulSoup(res.text, 'html.parser')
+        """获取小说信息，已经取到过（如 ``watch`` 检查更新时）则不再请求信息页"""
+        if not self.info_loaded:
+            self.fetch_info()
+        print(self.info.cover_url)
+        return self.render_info()
+
+    def fetch_info(self) -> NovelInfo:
+        """只请求信息页，其中的最近更新时间和字数足以判断小说有没有更新"""
+        index_url = self.base_url_index + self.nid
+        logger.info(index_url)
+        res = client.get(index_url, max_age=self.max_age)
+        return self.parse_novel_info(res.text)
+
+    @metrics.timed('parse')
+    def parse_novel_info(self, html: str) -> NovelInfo:
+        """解析小说信息页，结果保存在 ``info`` 中并返回"""
+        soup = parsing.make_soup(html, parsing.NOVEL_INFO)
         info_tag = soup.find(class_='book_info')
-        self.title = info_tag.span.string
-        self.cover_url = 'https:' + info_tag.img['src']
-        print(self.cover_url)
-        for part in info_tag.div.stripped_strings:
-            self.label += part + ' '
-        self.author, self.word_num, click_and_new = soup.find(class_='book_info3').get_text().split(' / ')
-        self.click_num, self.date, self.clock = click_and_new.split()
-        smalls = soup.find_all('small')
-        self.heart_num, self.praise_num, _ = [small.string.strip() for small in smalls]
-        self.intro = soup.find(class_='book_bk_qs1').string
-        return f"""
-# {self.title}-{self.author}
+        author, word_num, click_and_new = soup.find(class_='book_info3').get_text().split(' / ')
+        click_num, date, clock = click_and_new.split()
+        heart_num, praise_num, _ = [small.string.strip() for small in soup.find_all('small')]
+        self.info = NovelInfo(
+            nid=self.nid,
+            title=info_tag.span.string,
+            author=author,
+            url=self.base_url_index + self.nid,
+            label=''.join(part + ' ' for part in info_tag.div.stripped_strings),
+            word_num=word_num,
+            click_num=click_num,
+            date=date,
+            clock=clock,
+            heart_num=heart_num,
+            praise_num=praise_num,
+            intro=soup.find(class_='book_bk_qs1').string,
+            cover_url=urljoin(self.base_url_index, info_tag.img['src']),
+        )
+        self.info_loaded = True
+        return self.info
 
-## 小说信息
+    def render_info(self) -> str:
+        """小说信息的markdown"""
+        return render.novel_info_md(self.info, self.cover_path or None)
 
-![封面]({self.cover_url})
+    def get_volumes(self) -> list[VolumeRef]:
+        """获取目录，按顺序返回各卷及其章节"""
+        return [Volume(volume_tag).ref() for volume_tag in self._get_volume_tags()]
 
-原文地址：{self.base_url_index}{self.nid}
+    def _get_volume_tags(self) -> list[Tag]:
+        """获取卷列表"""
+        menu_url = self.base_url_menu + self.nid
+        res = client.get(menu_url, max_age=self.max_age)
+        return self._parse_volume_tags(res.text)
 
-作者：{self.author}\t字数：{self.word_num} 点击量：{self.click_num}
+    @staticmethod
+    def _parse_volume_tags(html: str) -> list[Tag]:
+        soup = parsing.make_soup(html, parsing.MENU)
+        menu_tags = soup.find_all(class_='mulu')
+        return menu_tags
 
-标签：{self.label}
+    def get_novel_content(self, journal: Journal | None = None) -> str:
+        """获取小说全部内容，整本书会一次性放在内存里，长篇请用 ``download_novel``
 
-最近更新时间：{self.date} {self.clock}
+        Args:
+            journal: Journal 检查点日志，已记录的章节不再下载，新下载的章节会被记录
+        """
+        return ''.join(self.iter_novel_content(journal))
 
-收藏量：{self.heart_num}\t点赞数：{self.praise_num}
+    def iter_novel_content(self, journal: Journal | None = None, epub_builder: 'EpubBuilder | None' = None,
+                           assets: 'AssetStore | None' = None, failures: list | None = None) -> Iterator[str]:
+        """按顺序逐段产出小说内容：简介、卷标题、章节
 
-{self.intro}
+        workers大于1时所有卷共用一个线程池并发下载章节，在途的章节数有上限，内存占用不随小说长度增长。
 
-{'='*20}
+        Args:
+            journal: Journal 检查点日志，已记录的章节不再下载，新下载的章节会被记录
+            epub_builder: EpubBuilder 不为None时每章按 'both' 格式只请求一次，HTML随之加入EPUB
+            assets: AssetStore 不为None时下载封面和插图，链接改为本地路径
+            failures: list 不为None时下载失败的章节记入其中并跳过，否则异常直接抛出
+        """
+        header = self.get_novel_info()
+        if assets is not None and (cover_path := assets.fetch(self.info.cover_url)):
+            self.cover_path = cover_path.replace(os.sep, '/')
+            header = self.render_info()
+        yield header
+        if epub_builder is not None:
+            epub_builder.set_metadata(f'sfacg-{self.nid}', self.title, self.author, self.info.intro)
+            if self.cover_path:
+                epub_builder.set_cover(self.cover_path)
+        volumes = self.get_volumes()
+        format = 'md' if epub_builder is None else 'both'
+        fetch = self._journaled_fetch(journal, format, assets, failures)
+        items = ((index, MobileChapter(ref.title, ref.url, self.parse_executor))
+                 for index, volume in enumerate(volumes) for ref in volume.chapters)
+        results = ordered_map(lambda item: (item[0], item[1].title, fetch(item[1])), items,
+                              self.workers, self.executor)
+        total = sum(len(volume.chapters) for volume in volumes)
+        current = -1
+        for done, (index, title, content) in enumerate(results, 1):
+            if self.progress is not None:
+                self.progress(done, total)
+            # 补上本章之前的卷标题，包括没有章节的空卷
+            while current < index:
+                current += 1
+                logger.info(f'{volumes[current].title}')
+                if epub_builder is not None:
+                    epub_builder.add_volume(volumes[current].title)
+                yield f'## {volumes[current].title}\n\n'
+            if content is None:
+                continue
+            metrics.count('chapters')
+            if epub_builder is not None:
+                content, html = content
+                images = assets.local_images(html) if assets is not None else ()
+                with metrics.timer('render', title=title):
+                    epub_builder.add_chapter(title, html, images)
+            yield content + '\n\n'
+        for volume in volumes[current + 1:]:
+            if epub_builder is not None:
+                epub_builder.add_volume(volume.title)
+            yield f'## {volume.title}\n\n'
 
-"""
+    @staticmethod
+    def _journaled_fetch(journal: Journal | None, format: str = 'md', assets: 'AssetStore | None' = None,
+                         failures: list | None = None):
+        def download(chapter: MobileChapter) -> str | tuple[str, str] | None:
+            try:
+                content = chapter.get_chapter_content(format)
+            # 只有请求失败和页面缺少正文算作章节下载失败，代码的错误直接抛出
+            except (RequestException, parsing.MissingContent) as e:
+                if failures is None:
+                    raise
+                # 失败的章节不写入输出，留给重新排队或下次续传
+                logger.error(f'下载失败 {chapter.title} {chapter.url} {e!r}')
+                failures.append({'title': chapter.title, 'url': chapter.url, 'error': repr(e)})
+                return None
+            if assets is None:
+                return content
+            if format == 'md':
+                return assets.localize_md(content, chapter.url)
+            md, html = content
+            return assets.localize_md(md, chapter.url), assets.localize_html(html, chapter.url)
 
-    def _get_volume_tags(self) -> list[Tag]:
-        """获取卷列表"""
-        menu_url = self.base_url_menu + self.nid
-        res = requests.get(url=menu_url, headers=self.headers)
-        soup = BeautifulSoup(res.text, 'html.parser')
-        menu_tags = soup.find_all(class_='mulu')
-        return menu_tags
+        def fetch(chapter: MobileChapter) -> str | tuple[str, str]:
+            if journal is None:
+                return download(chapter)
+            cached = journal.get(chapter.url)
+            # 只有markdown的旧记录不能用于EPUB，需要重新下载
+            if cached is not None and (format == 'md') == isinstance(cached, str):
+                return cached if format == 'md' else tuple(cached)
+            content = download(chapter)
+            if content is not None:
+                journal.record(chapter.url, content)
+            return content
+        return fetch
+
+    def _journal_path(self) -> str:
+        return state.path('journal', f'novel-{self.nid}.jsonl')
+
+    def download_novel(self, resume: bool = False, epub: bool = False, images: bool = False) -> str:
+        """下载整本小说
+
+        每下载完一章都会写入检查点日志，中断后以 ``resume=True`` 重新运行可跳过已下载的章节。
+        重试后仍失败的章节不会写入输出，整本下载完后重新排队 ``REQUEUE_ROUNDS`` 轮，
+        此时其余章节都从检查点读取；最终仍失败的章节记在 ``failures`` 和失败报告里，
+        检查点保留，之后以 ``resume=True`` 重新运行只会下载这些章节。
+
+        Args:
+            resume: bool 是否从上次中断处继续
+            epub: bool 是否同时导出EPUB，章节HTML与markdown来自同一次请求
+            images: bool 是否把封面和插图下载到 ``assets`` 目录并改写为本地链接，EPUB会包含这些图片
+
+        Returns:
+            str 输出文件路径
+        """
+        journal = Journal(self._journal_path(), resume=resume)
+        if journal.done:
+            logger.info(f'从检查点恢复{len(journal.done)}章')
+        if epub:
+            from ebook import EpubBuilder
+        if images:
+            from assets import AssetStore
+        assets = AssetStore() if images else None
+        try:
+            for attempt in range(REQUEUE_ROUNDS + 1):
+                self.failures = []
+                path = self._write_novel(journal, EpubBuilder() if epub else None, assets, self.failures)
+                if not self.failures:
+                    break
+                if attempt < REQUEUE_ROUNDS:
+                    # 已完成的章节按需从日志读出，下一轮只下载失败的章节
+                    logger.warning(f'{len(self.failures)}章下载失败，重新排队下载')
+        except BaseException:
+            journal.close()
+            raise
+        finally:
+            if assets is not None:
+                assets.close()
+        self._report_failures()
+        if self.failures:
+            journal.close()
+        else:
+            journal.finish()
+        if report := client.cache_report():
+            logger.info(report)
+        return path
+
+    def _write_novel(self, journal: Journal, epub_builder: 'EpubBuilder | None', assets: 'AssetStore | None',
+                     failures: list) -> str:
+        """完整写一遍输出文件，返回路径"""
+        fragments = self.iter_novel_content(journal, epub_builder, assets, failures)
+        try:
+            # 第一段是简介，取出后才知道标题和作者
+            header = next(fragments)
+            path = f'{self.title}-{self.author}.md'
+            # 边下载边写入临时文件，完成后再替换，中断时不会破坏上一次的结果
+            with open(path + '.part', 'w', encoding='utf-8') as f:
+                f.write(header)
+                for fragment in fragments:
+                    with metrics.timer('write'):
+                        f.write(fragment)
+        except BaseException:
+            fragments.close()
+            raise
+        os.replace(path + '.part', path)
+        if epub_builder is not None:
+            with metrics.timer('write', path=f'{self.title}-{self.author}.epub'):
+                epub_builder.write(f'{self.title}-{self.author}.epub')
+            logger.info(f'已导出 {self.title}-{self.author}.epub')
+        return path
+
+    def _failures_path(self) -> str:
+        return state.path('failures', f'novel-{self.nid}.json')
+
+    def _report_failures(self) -> None:
+        """把仍失败的章节写入失败报告，全部成功时删除旧报告"""
+        path = self._failures_path()
+        if not self.failures:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        state.save(path, {'nid': self.nid, 'title': self.title, 'chapters': self.failures})
+        logger.warning(f'{self.title} 有{len(self.failures)}章下载失败，详见 {path}，'
+                       f'以 resume=True 重新运行可只下载这些章节')
+
+    def _manifest_path(self) -> str:
+        return state.path('novels', f'{self.nid}.json')
+
+    def _fetch_chapters(self, chapters: list[MobileChapter]) -> list[str | None]:
+        """下载给定章节，按顺序返回内容
+
+        失败的章节在其余章节下载完后重新排队 ``REQUEUE_ROUNDS`` 轮，仍失败的内容为None并记在 ``failures`` 中
+        """
+        contents = [None] * len(chapters)
+        pending = list(range(len(chapters)))
+        for _ in range(REQUEUE_ROUNDS + 1):
+            self.failures = []
+            fetch = self._journaled_fetch(None, failures=self.failures)
+            results = ordered_map(fetch, [chapters[i] for i in pending], self.workers, self.executor)
+            for done, (i, content) in enumerate(zip(pending, results), 1):
+                contents[i] = content
+                if self.progress is not None:
+                    self.progress(done, len(pending))
+            pending = [i for i in pending if contents[i] is None]
+            if not pending:
+                break
+        return contents
+
+    def sync_novel(self, recheck: bool = False) -> str:
+        """增量同步小说，只下载上次运行之后新增或改名的章节
+
+        清单按nid保存在 ``state.STATE_DIR`` 中，记录输出文件里每一段（简介、卷标题、章节）的
+        字节偏移、长度和内容哈希。已下载的章节直接从旧文件拷贝字节，不重新请求也不重新渲染；
+        若简介未变且只在末尾新增了内容，则直接追加到旧文件末尾。下载失败的章节保留旧内容，
+        新章节则暂不写入，下次同步时再下载。
+
+        Args:
+            recheck: bool 为True时所有章节都向网站确认（未修改的章节只得到304），只替换内容有变化的章节
+
+        Returns:
+            str 输出文件路径
+        """
+        header = self.get_novel_info()
+        path = f'{self.title}-{self.author}.md'
+        manifest = state.load(self._manifest_path(), {})
+        if manifest.get('output') != path or not os.path.exists(path):
+            manifest = {}
+        old_segments = manifest.get('segments', [])
+        old_chapters = {seg['url']: seg for seg in old_segments if seg['kind'] == 'chapter'}
+
+        # (类型, 标题, url, 新内容或None)，None表示沿用旧文件中的字节
+        plan = [('header', self.title, None, header)]
+        to_fetch = []
+        for volume in self.get_volumes():
+            plan.append(('volume', volume.title, None, f'## {volume.title}\n\n'))
+            for ref in volume.chapters:
+                # 章节页缓存30天，重新检查时必须向网站确认才能发现修改过的章节
+                chapter = MobileChapter(ref.title, ref.url, self.parse_executor, 0 if recheck else None)
+                old = old_chapters.get(chapter.url)
+                if recheck or old is None or old['title'] != chapter.title:
+                    to_fetch.append((len(plan), chapter))
+                plan.append(('chapter', chapter.title, chapter.url, None))
+        logger.info(f'{self.title} 共{sum(seg[0] == "chapter" for seg in plan)}章，需要下载{len(to_fetch)}章')
+
+        contents = self._fetch_chapters([chapter for _, chapter in to_fetch])
+        metrics.count('chapters', sum(content is not None for content in contents))
+        for (index, chapter), content in zip(to_fetch, contents):
+            if content is not None:
+                plan[index] = ('chapter', chapter.title, chapter.url, content + '\n\n')
+            elif chapter.url not in old_chapters:
+                # 下载失败的新章节先不写入，清单里没有它，下次同步会再次下载
+                plan[index] = None
+        plan = [seg for seg in plan if seg is not None]
+
+        segments = []
+        for kind, title, url, content in plan:
+            if content is None:
+                segments.append((kind, title, url, None, old_chapters[url]))
+                continue
+            data = content.encode('utf-8')
+            digest = hashlib.sha1(data).hexdigest()
+            old = old_chapters.get(url)
+            if old is not None and old['hash'] == digest and old['title'] == title:
+                segments.append((kind, title, url, None, old))
+            else:
+                segments.append((kind, title, url, data, None))
+
+        with metrics.timer('write', path=path):
+            new_manifest = self._write_segments(path, segments, old_segments)
+        state.save(self._manifest_path(), new_manifest)
+        self._report_failures()
+        if report := client.cache_report():
+            logger.info(report)
+        return path
+
+    def sync_db(self, store: 'Store', recheck: bool = False) -> int:
+        """把小说增量同步到本地数据库
+
+        每次都更新小说信息和目录，章节正文只下载数据库里还没有的，每 ``DB_BATCH`` 章一个事务写入。
+        下载失败的章节记在 ``failures`` 和失败报告里，不写入数据库，下次同步时会重新下载。
+        之后用 ``Store.export_novel_md`` 或 ``Store.export_novel_epub`` 导出，不需要再请求网站。
+
+        Args:
+            store: Store 本地数据库
+            recheck: bool 为True时所有章节都向网站确认（未修改的章节只得到304）并覆盖数据库中的正文
+
+        Returns:
+            int 写入数据库的章节数
+        """
+        self.get_novel_info()
+        volumes = self.get_volumes()
+        store.save_novel(self.info)
+        store.save_volumes(self.nid, volumes)
+        known = set() if recheck else store.chapter_urls(self.nid)
+        chapters = [MobileChapter(ref.title, ref.url, self.parse_executor, 0 if recheck else None)
+                    for volume in volumes for ref in volume.chapters if ref.url not in known]
+        logger.info(f'{self.title} 数据库中已有{len(known)}章，需要下载{len(chapters)}章')
+        self.failures = []
+
+        def fetch(chapter: MobileChapter) -> ChapterBody | None:
+            try:
+                return chapter.fetch_body()
+            except (RequestException, parsing.MissingContent) as e:
+                logger.error(f'下载失败 {chapter.title} {chapter.url} {e!r}')
+                self.failures.append({'title': chapter.title, 'url': chapter.url, 'error': repr(e)})
+                return None
+
+        saved = 0
+        batch = []
+        for done, body in enumerate(ordered_map(fetch, chapters, self.workers, self.executor), 1):
+            if self.progress is not None:
+                self.progress(done, len(chapters))
+            if body is None:
+                continue
+            metrics.count('chapters')
+            batch.append(body)
+            if len(batch) >= DB_BATCH:
+                store.save_chapters(self.nid, batch)
+                saved += len(batch)
+                batch = []
+        if batch:
+            store.save_chapters(self.nid, batch)
+            saved += len(batch)
+        self._report_failures()
+        return saved
+
+    def _write_segments(self, path: str, segments: list, old_segments: list) -> dict:
+        """把分段写入输出文件，返回新的清单"""
+        def same(seg, old):
+            kind, title, url, data, ref = seg
+            if ref is not None:
+                return ref is old
+            return (kind, title) == (old['kind'], old['title']) and hashlib.sha1(data).hexdigest() == old['hash']
+
+        prefix = len(old_segments) <= len(segments) and all(
+            same(seg, old) for seg, old in zip(segments, old_segments))
+        records = []
+        if prefix and old_segments and len(segments) == len(old_segments):
+            logger.info(f'{path} 没有更新')
+            return {'nid': self.nid, 'output': path, 'segments': old_segments}
+        if prefix and old_segments:
+            # 旧文件是新内容的前缀，直接追加
+            records = [dict(old) for old in old_segments]
+            offset = old_segments[-1]['offset'] + old_segments[-1]['length']
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+                f.seek(offset)
+                for kind, title, url, data, ref in segments[len(old_segments):]:
+                    records.append(self._record(kind, title, url, data, offset))
+                    f.write(data)
+                    offset += len(data)
+            logger.info(f'追加{len(segments) - len(old_segments)}段到 {path}')
+            return {'nid': self.nid, 'output': path, 'segments': records}
+
+        tmp = path + '.tmp'
+        offset = 0
+        old_file = open(path, 'rb') if old_segments else None
+        try:
+            with open(tmp, 'wb') as f:
+                for kind, title, url, data, ref in segments:
+                    if ref is not None:
+                        old_file.seek(ref['offset'])
+                        data = old_file.read(ref['length'])
+                        records.append(dict(ref, offset=offset))
+                    else:
+                        records.append(self._record(kind, title, url, data, offset))
+                    f.write(data)
+                    offset += len(data)
+        finally:
+            if old_file is not None:
+                old_file.close()
+        os.replace(tmp, path)
+        logger.info(f'已写入 {path}')
+        return {'nid': self.nid, 'output': path, 'segments': records}
 
-    def get_novel_content(self) -> str:
-        novel_content = self.get_novel_info()
-        volume_tags = self._get_volume_tags()
-        for volume_tag in volume_tags:
-            volume = Volume(volume_tag)
-            novel_content += volume.get_volume_content()
-        return novel_content
-
-    def download_novel(self):
-        novel_content = self.get_novel_content()
-        with open(f'{self.title}-{self.author}.md', 'w', encoding='utf-8') as f:
-            f.write(novel_content)
+    @staticmethod
+    def _record(kind: str, title: str, url: str | None, data: bytes, offset: int) -> dict:
+        return {'kind': kind, 'title': title, 'url': url,
+                'hash': hashlib.sha1(data).hexdigest(), 'offset': offset, 'length': len(data)}
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+"""持久化的HTTP响应磁盘缓存
+
+以URL和查询参数（去掉时间戳参数 ``_``）的哈希为键，响应正文按键名存成文件，
+元数据放在同目录的SQLite索引里。不同接口的过期时间不同：章节正文很少变化，
+书评列表变化较快。过期后若有ETag/Last-Modified则发条件请求重新验证，
+总大小超过上限时按最近访问时间淘汰（LRU）。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+DAY = 24 * 60 * 60
+
+# (URL正则, getcmtlist等接口的op参数, 过期秒数)，按顺序匹配第一条
+TTLS = [
+    (r'/c/\d+', None, 30 * DAY),
+    (r'/HTML5\.ashx', 'getcmtlist', 10 * 60),
+    (r'/HTML5\.ashx', 'getcmtreply', 60 * 60),
+    (r'/cmt/l/', None, 60 * 60),
+    (r'/i/\d+', None, 60 * 60),
+    (r'/b/\d+', None, 60 * 60),
+]
+DEFAULT_TTL = 60 * 60
+# 不参与缓存键的查询参数
+IGNORED_PARAMS = ('_',)
+# 缓存在响应头中保留的字段
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def ttl_for(url: str, params: dict | None = None) -> int:
+    """返回该请求的缓存过期秒数"""
+    op = (params or {}).get('op')
+    for pattern, want_op, ttl in TTLS:
+        if re.search(pattern, url) and (want_op is None or want_op == op):
+            return ttl
+    return DEFAULT_TTL
+
+
+def cache_key(url: str, params: dict | None = None) -> str:
+    """计算缓存键，忽略时间戳参数并对参数排序"""
+    items = sorted((k, str(v)) for k, v in (params or {}).items() if k not in IGNORED_PARAMS)
+    canonical = url + ('?' + urlencode(items) if items else '')
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """磁盘缓存
+
+    Args:
+        path: str 缓存目录
+        max_size: int 正文文件总大小上限，单位字节
+    """
+
+    def __init__(self, path: str, max_size: int = 512 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, 'index.db'), check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            headers TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )""")
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        self._db.commit()
+        self.size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(path="{self.path}", size={self.size})'
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def lookup(self, key: str) -> tuple[dict, bytes, float] | None:
+        """查找缓存，返回 (响应头, 正文, 存入时间)，不存在时返回None"""
+        with self._lock:
+            row = self._db.execute('SELECT headers, stored_at FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._file(key), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            self.delete(key)
+            return None
+        return json.loads(row[0]), body, row[1]
+
+    def touch(self, key: str, revalidated: bool = False) -> None:
+        """记录一次访问；revalidated为True时同时刷新存入时间"""
+        now = time.time()
+        with self._lock:
+            if revalidated:
+                self._db.execute('UPDATE entries SET accessed_at = ?, stored_at = ? WHERE key = ?', (now, now, key))
+            else:
+                self._db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self._db.commit()
+
+    def store(self, key: str, url: str, response: requests.Response) -> None:
+        """保存一个200响应"""
+        headers = {k: response.headers[k] for k in KEPT_HEADERS if k in response.headers}
+        body = response.content
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f'{file}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, file)
+        now = time.time()
+        with self._lock:
+            old = self._db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, url, json.dumps(headers), len(body), now, now))
+            self._db.commit()
+            self.size += len(body) - (old[0] if old else 0)
+        if self.size > self.max_size:
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            row = self._db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return
+            self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._db.commit()
+            self.size -= row[0]
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> None:
+        """按最近访问时间淘汰，直到总大小降到上限的90%以下"""
+        target = self.max_size * 0.9
+        with self._lock:
+            rows = self._db.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if self.size <= target:
+                break
+            self.delete(key)
+
+    def record(self, outcome: str) -> None:
+        """统计一次查询结果，outcome为 'hits'、'revalidated' 或 'misses'"""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def clear(self) -> None:
+        with self._lock:
+            keys = [row[0] for row in self._db.execute('SELECT key FROM entries')]
+        for key in keys:
+            self.delete(key)
+
+    def report(self) -> str:
+        """缓存命中情况，重新验证后未变化的响应也算命中"""
+        total = self.hits + self.revalidated + self.misses
+        rate = (self.hits + self.revalidated) / total if total else 0
+        return (f'缓存命中率 {rate:.1%} (命中{self.hits}, 重新验证{self.revalidated}, 未命中{self.misses}), '
+                f'缓存大小 {self.size / 1024 / 1024:.1f}MB')
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def cached_response(url: str, headers: dict, body: bytes) -> requests.Response:
+    """用缓存内容构造一个 ``requests.Response``"""
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+def conditional_headers(headers: dict) -> dict:
+    """根据缓存的ETag/Last-Modified生成条件请求头"""
+    conditional = {}
+    if 'ETag' in headers:
+        conditional['If-None-Match'] = headers['ETag']
+    if 'Last-Modified' in headers:
+        conditional['If-Modified-Since'] = headers['Last-Modified']
+    return conditional
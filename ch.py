@@ -1,13 +1,14 @@
-import requests
-from requests.exceptions import HTTPError
-from bs4 import BeautifulSoup, NavigableString, Tag
+from requests.exceptions import RequestException
+from bs4 import NavigableString, Tag
 from loguru import logger
 from abc import ABC, abstractmethod
 import os.path
 
-HEADERS = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+import client
+import hedge
+import metrics
+import parsing
+from client import HEADERS
 
 class Ch(ABC):
     """处理章节
@@ -26,7 +27,7 @@ class Ch(ABC):
         return f'{self.__class__.__name__}(title="{self.title}", url="{self.url}")'
 
     def _check_url(self):
-        """检查URL是否为有效的移动端章节URL"""
+        """检查URL是否为有效的章节URL，前缀见各子类的 ``url_prefixes``"""
         # 如果URL为空，或者不以下列任一前缀开头，则视为无效
         if not self.url:
             return True  # URL为空，视为无效
@@ -35,8 +36,12 @@ class Ch(ABC):
         return not self.url.startswith(self.url_prefixes)
 
     def _download(self, path):
+        # 先下载再打开文件，下载失败时不会留下空文件或把错误信息写进文件
+        content = self.get_chapter_content()
+        if content is None:
+            return
         with open(path, 'w', encoding='utf-8') as f:
-            f.write(self.get_chapter_content())
+            f.write(content)
             logger.info(f'下载完成 {self.title} {self.url}')
 
     def download_md(self, path: str='./', force: bool=True) -> None:
@@ -53,25 +58,6 @@ class Ch(ABC):
             else:
                 self._download(md_path)
 
-    @abstractmethod
-    def get_chapter_content(self):
-        pass
-
-
-class MobileChapter(Ch):
-    """处理移动端章节
-    Args:
-        title: str 小说标题
-        url: str 小说url
-    """
-
-    def __init__(self, title: str='未命名章节', url: str=''):
-        super().__init__(title, url)
-        self.url_prefixes = (
-            'https://m.sfacg.com/c/',
-            'http://m.sfacg.com/c/'
-        )
-
     def get_chapter_content(self, format: str='md') -> str | tuple[str] | None:
         """获取章节内容
 
@@ -80,7 +66,11 @@ class MobileChapter(Ch):
 
                 - 'md' 返回markdown格式的字符串
                 - 'html' 返回html格式的字符串，便于ebooklib解析
-                - 'both' 返回元组
+                - 'both' 返回 (markdown, html) 元组
+
+        Raises:
+            requests.RequestException: ``client`` 重试用尽后仍然失败，或返回了4xx
+            parsing.MissingContent: 章节页里找不到正文
         """
         if self._check_url():
             logger.error('URL无效')
@@ -89,41 +79,131 @@ class MobileChapter(Ch):
             logger.error('format无效')
             return
         try:
-            response = requests.get(self.url, headers=self.headers)
-            response.raise_for_status()
+            html = self._fetch_html()
             logger.info(f'{self.title} {self.url}')
-        except HTTPError as e:
+        except RequestException as e:
             self.failed = True
-            logger.error(f'{self.title} {self.url}')
-            return str(e)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        content_html = soup.div.div
+            logger.error(f'{self.title} {self.url} {e!r}')
+            raise
+        return self.parse(html, format)
+
+    def _fetch_html(self) -> str:
+        response = client.get(self.url)
+        response.raise_for_status()
+        return response.text
+
+    @abstractmethod
+    def parse(self, html: str, format: str='md') -> str | tuple[str] | None:
+        """解析章节页，format同 ``get_chapter_content``"""
+
+    def _render(self, content_html: Tag, format: str) -> str | tuple[str] | None:
+        """把正文所在的标签转为 ``format`` 格式"""
         if format == 'html':
-            del content_html['style']
             return f'<h3>{self.title}</h3>' + str(content_html)
-        content_md = f'### {self.title}\n\n'
+        parts = [f'### {self.title}\n\n']
         for child in content_html.children:
             if type(child) == NavigableString and str(child).strip() != '':
-                content_md += f"{str(child).strip()}\n\n"
+                parts.append(f"{str(child).strip()}\n\n")
             elif type(child) == Tag and child.name == "img":
-                content_md += f"![]({child['src']})\n\n"
+                parts.append(f"![]({child['src']})\n\n")
             elif type(child) == Tag and child.name == "p":
-                content_md += f"{child.get_text().strip()}\n\n"
+                # PC端的插图放在单独的 <p> 里
+                img = child.find('img')
+                if img is not None and not child.get_text().strip():
+                    parts.append(f"![]({img['src']})\n\n")
+                else:
+                    parts.append(f"{child.get_text().strip()}\n\n")
             elif type(child) == Tag and child.name == "br":
                 continue
-        content_md = content_md.lstrip()
+        content_md = ''.join(parts).lstrip()
         if format == 'md':
             return content_md
         if format == 'both':
-            return content_md, content_html
+            return content_md, f'<h3>{self.title}</h3>' + str(content_html)
         return
 
 
+class MobileChapter(Ch):
+    """处理移动端章节
+    Args:
+        title: str 小说标题
+        url: str 小说url
+    """
+    url_prefixes = (
+        'https://m.sfacg.com/c/',
+        'http://m.sfacg.com/c/'
+    )
+
+    def parse(self, html: str, format: str='md') -> str | tuple[str] | None:
+        """解析章节页，format同 ``get_chapter_content``"""
+        with metrics.timer('parse', url=self.url):
+            soup = parsing.make_soup(html, parsing.CHAPTER)
+            if soup.div is None or soup.div.div is None:
+                raise parsing.MissingContent(f'章节页没有正文 {self.url}')
+            content_html = soup.div.div
+        del content_html['style']
+        return self._render(content_html, format)
+
+
 class PCChapter(Ch):
-    pass
+    """处理PC端章节，地址形如 https://book.sfacg.com/Novel/{nid}/{vid}/{cid}/
+    Args:
+        title: str 小说标题
+        url: str 小说url
+    """
+    url_prefixes = (
+        'https://book.sfacg.com/Novel/',
+        'http://book.sfacg.com/Novel/'
+    )
+    mobile_base_url = 'https://m.sfacg.com/c/'
+
+    @property
+    def cid(self) -> str:
+        return self.url.strip('/').split('/')[-1]
+
+    @property
+    def mobile_url(self) -> str:
+        """同一章节的移动端地址"""
+        return f'{self.mobile_base_url}{self.cid}/'
+
+    def parse(self, html: str, format: str='md') -> str | tuple[str] | None:
+        """解析章节页，format同 ``get_chapter_content``"""
+        with metrics.timer('parse', url=self.url):
+            soup = parsing.make_soup(html, parsing.PC_CHAPTER)
+            content_html = soup.find(id='ChapterBody')
+            if content_html is None:
+                raise parsing.MissingContent(f'章节页没有正文 {self.url}')
+        return self._render(content_html, format)
+
 
 class Chapter(Ch):
-    pass
+    """处理章节，在移动端和PC端之间自动选择
+
+    给出PC端地址时可以推出移动端地址，两端互为备用：请求超过该主机的p95耗时仍未返回时向另一端发送对冲请求，
+    先返回的为准；一端连续出错时改用另一端，详见 ``hedge``。只给出移动端地址时推不出PC端地址
+    （缺少小说和卷的ID），对冲请求发往同一地址。
+    Args:
+        title: str 小说标题
+        url: str 移动端或PC端的章节url
+    """
+    url_prefixes = MobileChapter.url_prefixes + PCChapter.url_prefixes
+
+    def __init__(self, title: str='未命名章节', url: str=''):
+        super().__init__(title, url)
+        self.pc = PCChapter(title, url) if url.startswith(PCChapter.url_prefixes) else None
+        self.mobile = MobileChapter(title, self.pc.mobile_url if self.pc else url)
+        # 最近一次实际取到内容的一端
+        self.source: Ch = self.mobile
+
+    def _fetch_html(self) -> str:
+        urls = [self.mobile.url] + ([self.pc.url] if self.pc else [])
+        url, response = hedge.get(urls)
+        self.source = self.pc if self.pc is not None and url == self.pc.url else self.mobile
+        return response.text
+
+    def parse(self, html: str, format: str='md') -> str | tuple[str] | None:
+        """用取到内容的一端的解析方式解析章节页"""
+        return self.source.parse(html, format)
 
 
 if __name__ == '__main__':
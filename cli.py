@@ -0,0 +1,224 @@
+"""批量下载的命令行入口
+
+从参数或文件读入小说ID/链接，把每本书的小说下载和评论下载作为独立任务放进同一个任务线程池。
+所有小说的章节共用一个章节线程池，所有请求共用 ``client`` 的连接池、限速器和全局在途请求上限，
+同时处理的书再多，对网站的压力也不会超过设定值。结束时打印吞吐量、失败列表和各阶段耗时，
+指标可以另外导出为JSON lines和Prometheus文本格式。
+
+    python cli.py 49038 https://m.sfacg.com/b/689388/ -f novels.txt --sync
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+import client
+import metrics
+
+# https://m.sfacg.com/b/49038/ https://book.sfacg.com/Novel/49038/ 或直接写nid
+NID_PATTERN = re.compile(r'(?:/b/|/Novel/|/i/|/cmt/l/list/|^)(\d+)/?(?:[?#].*)?$')
+
+
+@dataclass
+class JobResult:
+    """一个任务的结果"""
+    kind: str
+    nid: str
+    ok: bool
+    seconds: float
+    output: str = ''
+    size: int = 0
+    error: str = ''
+    # 重试和重新排队后仍下载失败的章节
+    failures: list = field(default_factory=list)
+
+
+def parse_nid(target: str) -> str:
+    """从小说ID或链接中取出nid
+
+    Raises:
+        ValueError: 无法识别的输入
+    """
+    match = NID_PATTERN.search(target.strip())
+    if match is None:
+        raise ValueError(f'无法识别的小说ID或链接: {target}')
+    return match.group(1)
+
+
+def read_targets(targets: list[str], files: list[str]) -> list[str]:
+    """合并命令行和文件中的小说，去掉空行、#注释和重复的nid，保持原有顺序"""
+    lines = list(targets)
+    for file in files:
+        with open(file, encoding='utf-8') as f:
+            lines.extend(line.split('#', 1)[0].strip() for line in f)
+    return list(dict.fromkeys(parse_nid(line) for line in lines if line))
+
+
+def run_novel(nid: str, args: argparse.Namespace, executor: ThreadPoolExecutor) -> tuple[str, list]:
+    from book import Novel
+    novel = Novel(nid, workers=args.workers, executor=executor, parse_executor=args.parse_pool)
+    if args.store is not None:
+        if not args.offline:
+            novel.sync_db(args.store)
+        if args.epub:
+            args.store.export_novel_epub(nid)
+        return args.store.export_novel_md(nid), novel.failures
+    if args.sync:
+        return novel.sync_novel(), novel.failures
+    return novel.download_novel(resume=args.resume, epub=args.epub, images=args.images), novel.failures
+
+
+def run_reviews(nid: str, args: argparse.Namespace, executor: ThreadPoolExecutor) -> tuple[str, list]:
+    from review import BookReviews
+    if args.store is not None:
+        if not args.offline:
+            BookReviews(nid).sync_db(args.store, concurrency=args.review_concurrency)
+        return args.store.export_reviews_md(nid), []
+    book = BookReviews(nid)
+    if args.sync:
+        return book.sync_reviews(concurrency=args.review_concurrency), []
+    return book.download_reviews(concurrency=args.review_concurrency, resume=args.resume), []
+
+
+RUNNERS = {'novel': run_novel, 'reviews': run_reviews}
+
+
+def run_job(kind: str, nid: str, args: argparse.Namespace, executor: ThreadPoolExecutor) -> JobResult:
+    start = time.perf_counter()
+    try:
+        output, failures = RUNNERS[kind](nid, args, executor)
+    except Exception as e:
+        logger.error(f'{kind} {nid} 失败: {e!r}')
+        logger.debug(traceback.format_exc())
+        return JobResult(kind, nid, False, time.perf_counter() - start, error=repr(e))
+    size = os.path.getsize(output) if output and os.path.exists(output) else 0
+    return JobResult(kind, nid, True, time.perf_counter() - start, output, size, failures=failures)
+
+
+def run_batch(nids: list[str], args: argparse.Namespace) -> list[JobResult]:
+    """并发执行所有任务，按完成顺序返回结果"""
+    kinds = ['novel', 'reviews'] if args.only is None else [args.only]
+    results = []
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='chapter') as chapter_pool, \
+            ThreadPoolExecutor(max_workers=args.jobs, thread_name_prefix='job') as job_pool:
+        futures = [job_pool.submit(run_job, kind, nid, args, chapter_pool) for nid in nids for kind in kinds]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            logger.info(f'[{len(results)}/{len(futures)}] {result.kind} {result.nid} '
+                        f'{"完成" if result.ok else "失败"} {result.seconds:.1f}s')
+    return results
+
+
+def summarize(results: list[JobResult], elapsed: float, requests: int) -> str:
+    """吞吐量和失败列表"""
+    ok = [result for result in results if result.ok]
+    failed = [result for result in results if not result.ok]
+    size = sum(result.size for result in ok)
+    lines = [
+        f'共{len(results)}个任务，成功{len(ok)}个，失败{len(failed)}个，用时{elapsed:.1f}s',
+        f'吞吐量: {len(ok) / elapsed * 60:.1f} 任务/分钟, {requests / elapsed:.1f} 请求/秒 (共{requests}次), '
+        f'{size / 1024 / 1024 / elapsed:.2f} MB/秒 (共{size / 1024 / 1024:.1f}MB)',
+    ]
+    if ok:
+        slowest = max(ok, key=lambda result: result.seconds)
+        lines.append(f'最慢: {slowest.kind} {slowest.nid} {slowest.seconds:.1f}s')
+    for result in failed:
+        lines.append(f'失败: {result.kind} {result.nid} {result.error}')
+    for result in ok:
+        if result.failures:
+            lines.append(f'部分失败: {result.kind} {result.nid} {len(result.failures)}章未下载，可加 --resume 重新运行')
+    budget = client.get_budget()
+    lines.append(f'重试{budget.retries}次，因重试预算不足放弃{budget.rejected}次')
+    if report := client.cache_report():
+        lines.append(report)
+    return '\n'.join(lines)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='sfacg', description='批量下载SF轻小说的小说和评论')
+    parser.add_argument('targets', nargs='*', help='小说ID或链接')
+    parser.add_argument('-f', '--file', action='append', default=[],
+                        help='每行一个小说ID或链接的文件，#后为注释，可重复指定')
+    parser.add_argument('--only', choices=RUNNERS, help='只下载小说或只下载评论，默认两者都下载')
+    parser.add_argument('--sync', action='store_true', help='增量同步，只下载新章节、新评论')
+    parser.add_argument('--resume', action='store_true', help='从上次中断处继续')
+    parser.add_argument('--epub', action='store_true', help='同时导出EPUB')
+    parser.add_argument('--images', action='store_true', help='下载封面和插图')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='同时处理的任务数 (默认4)')
+    parser.add_argument('-w', '--workers', type=int, default=16, help='所有小说共用的章节下载线程数 (默认16)')
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help='解析和渲染章节的进程数，0为在下载线程中解析 (默认0)')
+    parser.add_argument('--review-concurrency', type=int, default=4, help='每本书评论下载的并发数 (默认4)')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='全局同时在途的请求数上限 (默认与--workers相同)')
+    parser.add_argument('--rate', type=float, default=None, help=f'每秒请求数，0为不限速 (默认{client.RATE})')
+    parser.add_argument('--no-cache', action='store_true', help='不使用磁盘缓存')
+    parser.add_argument('--db', metavar='PATH', help='把小说和评论增量同步到SQLite数据库，再从数据库导出')
+    parser.add_argument('--offline', action='store_true', help='与--db一起使用，不请求网站，只从数据库重新导出')
+    parser.add_argument('--metrics-jsonl', metavar='PATH', help='把每个请求和处理阶段的记录追加写入JSON lines文件')
+    parser.add_argument('--metrics-prom', metavar='PATH', help='结束时把汇总指标写成Prometheus文本格式')
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_intermixed_args(argv)
+    try:
+        nids = read_targets(args.targets, args.file)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    if not nids:
+        build_parser().print_usage(sys.stderr)
+        return 2
+    if args.offline and not args.db:
+        print('--offline 需要与 --db 一起使用', file=sys.stderr)
+        return 2
+    max_in_flight = args.max_in_flight if args.max_in_flight is not None else args.workers
+    # 同时使用的连接数不会超过在途请求上限，连接池不小于它即可全部复用
+    pool_size = max(client.POOL_SIZE, max_in_flight)
+    options = {'pool_size': pool_size, 'max_in_flight': max_in_flight, 'rate': args.rate}
+    if args.no_cache:
+        options['cache_dir'] = None
+    client.configure(**options)
+
+    logger.info(f'{len(nids)}本小说，{args.jobs}个任务并行，章节线程{args.workers}，在途请求上限{max_in_flight}')
+    exporter = metrics.JsonLinesExporter(args.metrics_jsonl) if args.metrics_jsonl else None
+    if exporter is not None:
+        metrics.add_hook(exporter)
+    # 小说和评论的爬虫（bs4、asyncio等）在第一个任务开始时才导入，参数有误时可以立即退出
+    if args.db:
+        from db import Store
+    if args.parse_processes > 0:
+        from book import parse_pool
+    args.store = Store(args.db) if args.db else None
+    args.parse_pool = parse_pool(args.parse_processes) if args.parse_processes > 0 else None
+    metrics.reset()
+    start = time.perf_counter()
+    requests = client.request_count()
+    try:
+        results = run_batch(nids, args)
+    finally:
+        if exporter is not None:
+            metrics.remove_hook(exporter)
+            exporter.close()
+        if args.store is not None:
+            args.store.close()
+        if args.parse_pool is not None:
+            args.parse_pool.shutdown()
+    print(summarize(results, time.perf_counter() - start, client.request_count() - requests))
+    print(metrics.summary())
+    if args.metrics_prom:
+        metrics.export_prometheus(args.metrics_prom)
+    client.close()
+    return 0 if all(result.ok and not result.failures for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
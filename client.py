@@ -0,0 +1,289 @@
+"""共享的HTTP客户端
+
+所有模块都通过这里发送请求，复用同一个带连接池的 ``requests.Session``，
+避免每个页面、每页回复都重新建立TCP+TLS连接。所有请求还共用一个令牌桶限速器，
+遇到429/5xx自动降速，并可设置全局的在途请求数上限。连接错误、超时、429和5xx按 ``retry``
+的策略退避重试。响应默认缓存在磁盘上，未过期的页面不再请求。每次请求的耗时、字节数、状态码、
+重试和缓存命中都记录到 ``metrics``。
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cache
+import metrics
+from ratelimit import TokenBucket
+from retry import RETRY_EXCEPTIONS, RetryBudget, RetryPolicy, retryable_status
+
+HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+
+# 连接池大小，应不小于并发下载的线程数
+POOL_SIZE = 16
+# (连接超时, 读取超时)，单位秒
+TIMEOUT = (5, 15)
+# 每秒请求数和允许的突发请求数，RATE不大于0时不限速
+RATE = 8.0
+BURST = 16
+# 响应缓存目录和大小上限，CACHE_DIR为None时不缓存
+CACHE_DIR: str | None = os.path.join(os.path.expanduser('~'), '.cache', 'sfacg')
+CACHE_SIZE = 512 * 1024 * 1024
+# 所有线程合计同时在途的请求数上限，不大于0时不限制
+MAX_IN_FLIGHT = 0
+# 每个请求最多重试的次数，第一次重试最长等待的秒数，以及重试次数占请求数的比例上限
+RETRIES = 3
+BACKOFF = 0.5
+RETRY_RATIO = 0.2
+
+_session: requests.Session | None = None
+_limiter: TokenBucket | None = None
+_cache: cache.DiskCache | None = None
+_in_flight: threading.BoundedSemaphore | None = None
+_budget: RetryBudget | None = None
+_sent = 0
+_lock = threading.Lock()
+
+
+def _new_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_UNSET = object()
+
+
+def configure(pool_size: int | None = None, timeout: float | tuple[float, float] | None = None,
+              rate: float | None = None, burst: int | None = None,
+              cache_dir: str | None = _UNSET, cache_size: int | None = None,
+              max_in_flight: int | None = None, retries: int | None = None,
+              backoff: float | None = None, retry_ratio: float | None = None) -> None:
+    """调整连接池大小、默认超时、限速、缓存、并发上限和重试，已有的连接会被关闭
+
+    Args:
+        pool_size: int 每个主机保持的最大连接数
+        timeout: float | tuple 默认超时，可以是 (连接超时, 读取超时)
+        rate: float 每秒请求数，不大于0时不限速
+        burst: int 允许的突发请求数
+        cache_dir: str 缓存目录，传入None关闭缓存
+        cache_size: int 缓存大小上限，单位字节
+        max_in_flight: int 全局同时在途的请求数上限，不大于0时不限制
+        retries: int 每个请求最多重试的次数，0为不重试
+        backoff: float 第一次重试最长等待的秒数，之后每次翻倍
+        retry_ratio: float 重试次数占请求数的比例上限
+    """
+    global _session, _limiter, _cache, _in_flight, _budget
+    global POOL_SIZE, TIMEOUT, RATE, BURST, CACHE_DIR, CACHE_SIZE, MAX_IN_FLIGHT, RETRIES, BACKOFF, RETRY_RATIO
+    with _lock:
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if timeout is not None:
+            TIMEOUT = timeout
+        if rate is not None:
+            RATE = rate
+        if burst is not None:
+            BURST = burst
+        if cache_dir is not _UNSET:
+            CACHE_DIR = cache_dir
+        if cache_size is not None:
+            CACHE_SIZE = cache_size
+        if max_in_flight is not None:
+            MAX_IN_FLIGHT = max_in_flight
+        if retries is not None:
+            RETRIES = retries
+        if backoff is not None:
+            BACKOFF = backoff
+        if retry_ratio is not None:
+            RETRY_RATIO = retry_ratio
+        if _session is not None:
+            _session.close()
+            _session = None
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+        _limiter = None
+        _in_flight = None
+        _budget = None
+
+
+def get_session() -> requests.Session:
+    """获取共享的Session，第一次调用时创建"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _new_session(POOL_SIZE)
+    return _session
+
+
+def get_limiter() -> TokenBucket | None:
+    """获取共享的限速器，不限速时返回None"""
+    global _limiter
+    if _limiter is None and RATE > 0:
+        with _lock:
+            if _limiter is None:
+                _limiter = TokenBucket(RATE, BURST)
+    return _limiter
+
+
+def get_cache() -> cache.DiskCache | None:
+    """获取共享的磁盘缓存，关闭缓存时返回None"""
+    global _cache
+    if _cache is None and CACHE_DIR is not None:
+        with _lock:
+            if _cache is None:
+                _cache = cache.DiskCache(CACHE_DIR, CACHE_SIZE)
+    return _cache
+
+
+def _get_in_flight() -> threading.BoundedSemaphore | None:
+    global _in_flight
+    if _in_flight is None and MAX_IN_FLIGHT > 0:
+        with _lock:
+            if _in_flight is None:
+                _in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+    return _in_flight
+
+
+def get_budget() -> RetryBudget:
+    """获取共享的重试预算"""
+    global _budget
+    if _budget is None:
+        with _lock:
+            if _budget is None:
+                _budget = RetryBudget(RETRY_RATIO)
+    return _budget
+
+
+def request_count() -> int:
+    """本进程实际发出的请求数，不含缓存命中"""
+    return _sent
+
+
+def cache_report() -> str | None:
+    """本次运行的缓存命中情况，未启用缓存时返回None"""
+    return _cache.report() if _cache is not None else None
+
+
+def _retry_after(response: requests.Response) -> float | None:
+    try:
+        return float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+
+def _send(url: str, params: dict | None = None, **kwargs) -> requests.Response:
+    """发送请求，失败时按 ``RETRIES`` 和重试预算退避重试
+
+    Raises:
+        requests.RequestException: 重试用尽后仍是连接错误、超时，或仍返回429/5xx
+    """
+    policy = RetryPolicy(RETRIES, BACKOFF)
+    budget = get_budget()
+    budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            response = _attempt(url, params, attempt, **kwargs)
+        except RETRY_EXCEPTIONS:
+            if attempt >= policy.retries or not budget.withdraw():
+                raise
+            delay = policy.delay(attempt)
+        else:
+            if not retryable_status(response.status_code):
+                return response
+            if attempt >= policy.retries or not budget.withdraw():
+                response.raise_for_status()
+            delay = policy.delay(attempt, _retry_after(response))
+        metrics.count('retries')
+        time.sleep(delay)
+        attempt += 1
+
+
+def _attempt(url: str, params: dict | None = None, attempt: int = 0, **kwargs) -> requests.Response:
+    limiter = get_limiter()
+    global _sent
+    queued = time.perf_counter()
+    if limiter is not None:
+        limiter.acquire()
+    in_flight = _get_in_flight()
+    if in_flight is not None:
+        in_flight.acquire()
+    # wait是等待限速器和并发上限的时间，不计入请求耗时
+    start = time.perf_counter()
+    fields = {'url': url, 'attempt': attempt, 'wait': start - queued}
+    try:
+        response = get_session().get(url, params=params, **kwargs)
+    except requests.RequestException as e:
+        metrics.record('fetch', time.perf_counter() - start, **fields, error=repr(e))
+        raise
+    finally:
+        if in_flight is not None:
+            in_flight.release()
+    metrics.record('fetch', time.perf_counter() - start, **fields,
+                   status=response.status_code, bytes=len(response.content))
+    with _lock:
+        _sent += 1
+    if limiter is not None:
+        if response.status_code == 429 or response.status_code >= 500:
+            limiter.backoff(_retry_after(response))
+        else:
+            limiter.recover()
+    return response
+
+
+def get(url: str, params: dict | None = None, use_cache: bool = True, max_age: float | None = None,
+        **kwargs) -> requests.Response:
+    """发送GET请求，默认带上 ``HEADERS`` 和 ``TIMEOUT``，并经过缓存和限速器
+
+    Args:
+        url: str 请求地址
+        params: dict 查询参数
+        use_cache: bool 为False时跳过缓存直接请求
+        max_age: float 缓存超过该秒数即向网站确认，为None时按 ``cache.TTLS``，为0时每次都确认（仍可能得到304）
+
+    Raises:
+        requests.RequestException: 重试用尽后仍然失败
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
+    disk_cache = get_cache() if use_cache else None
+    if disk_cache is None:
+        return _send(url, params, **kwargs)
+
+    def record(outcome: str):
+        disk_cache.record(outcome)
+        metrics.count(f'cache_{outcome}')
+
+    key = cache.cache_key(url, params)
+    entry = disk_cache.lookup(key)
+    if entry is not None:
+        headers, body, stored_at = entry
+        ttl = cache.ttl_for(url, params) if max_age is None else max_age
+        if time.time() - stored_at < ttl:
+            disk_cache.touch(key)
+            record('hits')
+            return cache.cached_response(url, headers, body)
+        conditional = cache.conditional_headers(headers)
+        if conditional:
+            kwargs['headers'] = {**kwargs.get('headers', {}), **conditional}
+    response = _send(url, params, **kwargs)
+    if entry is not None and response.status_code == 304:
+        disk_cache.touch(key, revalidated=True)
+        record('revalidated')
+        return cache.cached_response(url, entry[0], entry[1])
+    record('misses')
+    if response.status_code == 200:
+        disk_cache.store(key, url, response)
+    return response
+
+
+def close() -> None:
+    """关闭共享Session及其连接"""
+    configure()
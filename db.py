@@ -0,0 +1,287 @@
+"""本地SQLite存储
+
+把小说信息、目录、章节正文、长评和回复保存到一个SQLite数据库，markdown和EPUB都从数据库渲染。
+已下载的章节、评论只需本地查询，重新导出不再请求网站，增量同步也只请求数据库里没有的内容。
+数据库使用WAL模式，读写互不阻塞；章节和回复成批写入，一批一个事务。
+默认同时维护 ``search`` 的全文索引，写入的内容随即可以检索。
+
+    store = Store('sfacg.db')
+    Novel(nid, workers=8).sync_db(store)
+    store.export_novel_md(nid, 'novel.md')
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+import metrics
+import render
+import search
+from models import ChapterBody, ChapterRef, NovelInfo, Reply, Review, VolumeRef
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS novels (
+    nid TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    url TEXT NOT NULL,
+    label TEXT NOT NULL,
+    word_num TEXT NOT NULL,
+    click_num TEXT NOT NULL,
+    date TEXT NOT NULL,
+    clock TEXT NOT NULL,
+    heart_num TEXT NOT NULL,
+    praise_num TEXT NOT NULL,
+    intro TEXT NOT NULL,
+    cover_url TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS volumes (
+    nid TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    PRIMARY KEY (nid, position)
+);
+CREATE TABLE IF NOT EXISTS toc (
+    nid TEXT NOT NULL,
+    volume INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (nid, volume, position)
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    url TEXT PRIMARY KEY,
+    nid TEXT NOT NULL,
+    title TEXT NOT NULL,
+    blocks TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chapters_nid ON chapters (nid);
+CREATE TABLE IF NOT EXISTS review_lists (
+    nid TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    comment_id INTEGER PRIMARY KEY,
+    nid TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    date TEXT NOT NULL,
+    replies_num INTEGER NOT NULL,
+    praise_num INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_nid ON reviews (nid, comment_id);
+CREATE TABLE IF NOT EXISTS replies (
+    comment_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    user_name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    create_time TEXT NOT NULL,
+    PRIMARY KEY (comment_id, position)
+);
+CREATE INDEX IF NOT EXISTS replies_create_time ON replies (create_time);
+"""
+
+NOVEL_FIELDS = ('nid', 'title', 'author', 'url', 'label', 'word_num', 'click_num', 'date', 'clock',
+                'heart_num', 'praise_num', 'intro', 'cover_url')
+
+
+class Store:
+    """小说和评论的本地数据库，可在多个线程间共用
+
+    Args:
+        path: str 数据库文件路径
+        index: bool 是否建立全文索引，已建立的索引不受影响，总会随写入更新
+    """
+
+    def __init__(self, path: str = 'sfacg.db', index: bool = True):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # WAL模式下NORMAL已能保证崩溃后数据库一致，只可能丢最后几个事务
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        # 别的连接可能已经建了索引，触发器要用到索引的SQL函数，不建索引时也要注册
+        search.register(self._db)
+        if index:
+            search.install(self._db)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(path="{self.path}")'
+
+    def _write(self, sql_and_rows: Iterable[tuple[str, Iterable]]) -> None:
+        """在一个事务中执行多条批量写入"""
+        with metrics.timer('write'), self._lock, self._db:
+            for sql, rows in sql_and_rows:
+                self._db.executemany(sql, rows)
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    # 小说
+
+    def save_novel(self, info: NovelInfo) -> None:
+        row = tuple(getattr(info, name) for name in NOVEL_FIELDS) + (time.time(),)
+        self._write([(f'INSERT OR REPLACE INTO novels VALUES ({", ".join("?" * len(row))})', [row])])
+
+    def load_novel(self, nid: str) -> NovelInfo | None:
+        rows = self._query(f'SELECT {", ".join(NOVEL_FIELDS)} FROM novels WHERE nid = ?', (str(nid),))
+        return NovelInfo(*rows[0]) if rows else None
+
+    def save_volumes(self, nid: str, volumes: list[VolumeRef]) -> None:
+        """用最新的目录替换旧目录，已下载的章节正文保留"""
+        nid = str(nid)
+        self._write([
+            ('DELETE FROM volumes WHERE nid = ?', [(nid,)]),
+            ('DELETE FROM toc WHERE nid = ?', [(nid,)]),
+            ('INSERT INTO volumes VALUES (?, ?, ?)',
+             [(nid, v, volume.title) for v, volume in enumerate(volumes)]),
+            ('INSERT INTO toc VALUES (?, ?, ?, ?, ?)',
+             [(nid, v, c, ref.title, ref.url)
+              for v, volume in enumerate(volumes) for c, ref in enumerate(volume.chapters)]),
+        ])
+
+    def load_volumes(self, nid: str) -> list[VolumeRef]:
+        nid = str(nid)
+        volumes = [VolumeRef(title) for (title,) in
+                   self._query('SELECT title FROM volumes WHERE nid = ? ORDER BY position', (nid,))]
+        for v, title, url in self._query('SELECT volume, title, url FROM toc WHERE nid = ? ORDER BY volume, position',
+                                         (nid,)):
+            volumes[v].chapters.append(ChapterRef(title, url))
+        return volumes
+
+    def save_chapters(self, nid: str, bodies: Iterable[ChapterBody]) -> None:
+        now = time.time()
+        # 用upsert而不是REPLACE，行号不变，全文索引的触发器按更新处理
+        self._write([('INSERT INTO chapters VALUES (?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET '
+                      'nid = excluded.nid, title = excluded.title, blocks = excluded.blocks, '
+                      'fetched_at = excluded.fetched_at',
+                      [(body.url, str(nid), body.title, json.dumps(body.blocks, ensure_ascii=False), now)
+                       for body in bodies])])
+
+    def chapter_urls(self, nid: str) -> set[str]:
+        """已保存正文的章节地址"""
+        return {url for (url,) in self._query('SELECT url FROM chapters WHERE nid = ?', (str(nid),))}
+
+    def iter_chapters(self, nid: str) -> Iterator[tuple[int, ChapterBody]]:
+        """按目录顺序逐章产出 (卷序号, 正文)，没有正文的章节跳过
+
+        分批查询，整本书不会一次读进内存
+        """
+        sql = ('SELECT toc.volume, toc.position, toc.title, toc.url, chapters.blocks FROM toc '
+               'JOIN chapters ON chapters.url = toc.url WHERE toc.nid = ? AND (toc.volume, toc.position) > (?, ?) '
+               'ORDER BY toc.volume, toc.position LIMIT 200')
+        last = (-1, -1)
+        while rows := self._query(sql, (str(nid), *last)):
+            for volume, position, title, url, blocks in rows:
+                yield volume, ChapterBody(title, url, [tuple(block) for block in json.loads(blocks)])
+            last = rows[-1][:2]
+
+    def iter_novel_md(self, nid: str) -> Iterator[str]:
+        """逐段产出与 ``Novel.download_novel`` 相同的markdown"""
+        info = self.load_novel(nid)
+        if info is None:
+            raise KeyError(f'数据库中没有小说 {nid}')
+        volumes = self.load_volumes(nid)
+        yield render.novel_info_md(info)
+        current = -1
+        for volume, body in self.iter_chapters(nid):
+            while current < volume:
+                current += 1
+                yield f'## {volumes[current].title}\n\n'
+            yield render.chapter_md(body) + '\n\n'
+        for volume in volumes[current + 1:]:
+            yield f'## {volume.title}\n\n'
+
+    def export_novel_md(self, nid: str, path: str | None = None) -> str:
+        """从数据库导出小说的markdown，返回文件路径"""
+        info = self.load_novel(nid)
+        if info is None:
+            raise KeyError(f'数据库中没有小说 {nid}')
+        path = path or f'{info.title}-{info.author}.md'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(self.iter_novel_md(nid))
+        return path
+
+    def export_novel_epub(self, nid: str, path: str | None = None) -> str:
+        """从数据库导出小说的EPUB，返回文件路径"""
+        info = self.load_novel(nid)
+        if info is None:
+            raise KeyError(f'数据库中没有小说 {nid}')
+        path = path or f'{info.title}-{info.author}.epub'
+        volumes = self.load_volumes(nid)
+        from ebook import EpubBuilder
+        builder = EpubBuilder()
+        builder.set_metadata(f'sfacg-{info.nid}', info.title, info.author, info.intro)
+        current = -1
+        for volume, body in self.iter_chapters(nid):
+            while current < volume:
+                current += 1
+                builder.add_volume(volumes[current].title)
+            builder.add_chapter(body.title, render.chapter_html(body))
+        for volume in volumes[current + 1:]:
+            builder.add_volume(volume.title)
+        builder.write(path)
+        return path
+
+    # 评论
+
+    def save_reviews(self, nid: str, title: str, reviews: Iterable[Review]) -> None:
+        """保存长评及其全部回复，已有的评论整条替换"""
+        nid = str(nid)
+        reviews = list(reviews)
+        now = time.time()
+        self._write([
+            ('INSERT OR REPLACE INTO review_lists VALUES (?, ?, ?)', [(nid, title, now)]),
+            ('INSERT INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (comment_id) DO UPDATE SET '
+             'nid = excluded.nid, title = excluded.title, content = excluded.content, date = excluded.date, '
+             'replies_num = excluded.replies_num, praise_num = excluded.praise_num, fetched_at = excluded.fetched_at',
+             [(int(r.cid), nid, r.title, r.content, r.date, r.replies_num, r.praise_num, now) for r in reviews]),
+            ('DELETE FROM replies WHERE comment_id = ?', [(int(r.cid),) for r in reviews]),
+            ('INSERT INTO replies VALUES (?, ?, ?, ?, ?)',
+             [(int(r.cid), i, reply.user_name, reply.content, reply.date)
+              for r in reviews for i, reply in enumerate(r.replies)]),
+        ])
+
+    def review_counts(self, nid: str) -> dict[str, int]:
+        """已保存的评论，{CommentID: 回复数}"""
+        return {str(cid): n for cid, n in
+                self._query('SELECT comment_id, replies_num FROM reviews WHERE nid = ?', (str(nid),))}
+
+    def review_list_title(self, nid: str) -> str | None:
+        rows = self._query('SELECT title FROM review_lists WHERE nid = ?', (str(nid),))
+        return rows[0][0] if rows else None
+
+    def iter_reviews(self, nid: str) -> Iterator[Review]:
+        """按发表顺序（从旧到新）逐篇产出评论和回复"""
+        rows = self._query('SELECT comment_id, title, content, date, replies_num, praise_num FROM reviews '
+                           'WHERE nid = ? ORDER BY comment_id', (str(nid),))
+        for cid, *fields in rows:
+            review = Review(str(cid), *fields)
+            review.replies = [Reply(*reply) for reply in self._query(
+                'SELECT user_name, content, create_time FROM replies WHERE comment_id = ? ORDER BY position', (cid,))]
+            yield review
+
+    def export_reviews_md(self, nid: str, path: str | None = None) -> str:
+        """从数据库导出长评的markdown，格式与 ``BookReviews.download_reviews`` 相同，返回文件路径"""
+        title = self.review_list_title(nid)
+        if title is None:
+            raise KeyError(f'数据库中没有小说 {nid} 的评论')
+        path = path or f'{title}.md'
+        total = self._query('SELECT COUNT(*) FROM reviews WHERE nid = ?', (str(nid),))[0][0]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'# {title} 长评 共{total}条评论\n\n')
+            for review in self.iter_reviews(nid):
+                f.write(render.review_md(review))
+        return path
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
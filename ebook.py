@@ -0,0 +1,83 @@
+"""EPUB导出
+
+``EpubBuilder`` 随下载进度逐章加入章节，卷作为目录中的分组，最后一次性写出EPUB文件。
+章节HTML来自 ``MobileChapter.get_chapter_content(format='both')``，与markdown共用同一次请求。
+"""
+import os
+
+from ebooklib import epub
+
+
+class EpubBuilder:
+    """逐章构建EPUB
+
+    Args:
+        language: str 书籍语言
+    """
+
+    def __init__(self, language: str = 'zh'):
+        self.book = epub.EpubBook()
+        self.book.set_language(language)
+        self.language = language
+        # 目录：卷为 (Section, [章节])，卷之前的章节直接放在顶层
+        self.toc = []
+        self.chapters = 0
+        self.images = set()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(chapters={self.chapters})'
+
+    def set_metadata(self, identifier: str, title: str, author: str, intro: str | None = None) -> None:
+        """设置书籍信息"""
+        self.book.set_identifier(identifier)
+        self.book.set_title(title)
+        self.book.add_author(author)
+        if intro:
+            self.book.add_metadata('DC', 'description', intro)
+
+    def add_volume(self, title: str) -> None:
+        """开始新的一卷，之后加入的章节都归入这一卷"""
+        self.toc.append((epub.Section(title), []))
+
+    def set_cover(self, path: str) -> None:
+        """用本地图片作封面"""
+        with open(path, 'rb') as f:
+            self.book.set_cover('cover' + os.path.splitext(path)[1], f.read())
+
+    def add_image(self, path: str) -> None:
+        """加入一张本地图片，在EPUB中的路径与本地相对路径相同，同一路径只加入一次"""
+        path = path.replace(os.sep, '/')
+        if path in self.images:
+            return
+        self.images.add(path)
+        with open(path, 'rb') as f:
+            self.book.add_item(epub.EpubImage(uid=f'image_{len(self.images)}', file_name=path, content=f.read()))
+
+    def add_chapter(self, title: str, html: str, images=()) -> epub.EpubHtml:
+        """加入一章
+
+        Args:
+            title: str 章节标题
+            html: str 章节的HTML片段
+            images: 章节引用的本地图片路径
+        """
+        for path in images:
+            self.add_image(path)
+        self.chapters += 1
+        chapter = epub.EpubHtml(title=title, file_name=f'chapter_{self.chapters:05d}.xhtml', lang=self.language)
+        chapter.content = html
+        self.book.add_item(chapter)
+        self.book.spine.append(chapter)
+        if self.toc and isinstance(self.toc[-1], tuple):
+            self.toc[-1][1].append(chapter)
+        else:
+            self.toc.append(chapter)
+        return chapter
+
+    def write(self, path: str) -> None:
+        """写出EPUB文件"""
+        self.book.toc = self.toc
+        self.book.add_item(epub.EpubNcx())
+        self.book.add_item(epub.EpubNav())
+        self.book.spine.insert(0, 'nav')
+        epub.write_epub(path, self.book)
@@ -1,262 +1,227 @@
-import requests
-from bs4 import BeautifulSoup
-import re
+import queue
 import time
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 import threading
 import sys
-from io import StringIO
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+# 下载相关的模块（requests、bs4、loguru和爬虫本身）在窗口显示后才在后台线程中导入，见 ``load_engine``
+ENGINE_MODULES = ('loguru', 'cli', 'book', 'review')
 
-class RedirectText:
-    """用于将控制台输出重定向到Tkinter文本框"""
-
-    def __init__(self, text_widget):
-        self.text_widget = text_widget
-        self.buffer = StringIO()
+# 输出区域最多保留的行数，超出后删除最早的行，长时间下载内存也不会增长
+LOG_MAX_LINES = 2000
+# 主线程处理事件队列的间隔（毫秒）和每次最多处理的事件数
+PUMP_INTERVAL = 100
+PUMP_BATCH = 1000
+# 所有小说共用的章节下载线程数，每本书的评论并发数
+CHAPTER_WORKERS = 16
+REVIEW_CONCURRENCY = 4
 
-    def write(self, string):
-        self.buffer.write(string)
-        self.text_widget.configure(state="normal")
-        self.text_widget.insert(tk.END, string)
-        self.text_widget.see(tk.END)  # 滚动到最后
-        self.text_widget.configure(state="disabled")
 
-    def flush(self):
-        self.buffer.flush()
+class RedirectText:
+    """用于将控制台输出重定向到Tkinter文本框
 
+    Tk只能在主线程中操作，下载线程的输出先放进事件队列，由主线程定时批量写入文本框
+    """
 
-class Review:
-    """小说一篇评论的类"""
+    def __init__(self, events: queue.Queue):
+        self.events = events
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    base_url = 'https://m.sfacg.com/cmt/l/'
+    def write(self, string):
+        if string:
+            self.events.put(('log', string))
 
-    def __init__(self, url, title, save_dir):
-        self.cid = str(url).strip('/').split('/')[-1]
-        self.url = self.base_url + self.cid + '/'
-        self.title = title
-        self.save_dir = save_dir  # 保存目录
+    def flush(self):
+        pass
+
+
+class JobCancelled(Exception):
+    """任务被用户取消"""
+
+
+class Job:
+    """下载队列中的一个任务：一本小说的正文或长评
+
+    下载由 ``book.Novel`` 和 ``review.BookReviews`` 完成，它们每完成一章或一篇评论都会调用 ``progress``，
+    暂停时在其中阻塞，取消时在其中抛出 ``JobCancelled``，已下载的部分记在检查点日志里，之后可以续传。
+
+    Args:
+        nid: str 小说ID
+        kind: str 'novel' 下载正文，'reviews' 下载长评
+        resume: bool 是否从上次中断处继续
+    """
+    KINDS = {'novel': '正文', 'reviews': '长评'}
+    STATES = {'queued': '排队中', 'running': '下载中', 'paused': '已暂停', 'done': '完成',
+              'failed': '失败', 'cancelled': '已取消'}
+
+    def __init__(self, nid: str, kind: str, resume: bool = True):
+        self.nid = nid
+        self.kind = kind
+        self.resume = resume
+        self.state = 'queued'
+        self.started = False
+        self.engine = None
+        self.done = 0
+        self.total = 0
+        self.error = ''
+        self.output = ''
+        self.events = None
+        self._unpaused = threading.Event()
+        self._unpaused.set()
+        self._cancelled = False
+        # 累计的下载时间，不含暂停，只在主线程中修改
+        self._active = 0.0
+        self._since = None
 
     def __repr__(self):
-        return f'<Review {self.url}>'
-
-    def get_info(self):
-        """获取评论的信息"""
-        msg = ''
-        try:
-            res = requests.get(url=self.url, headers=self.headers, timeout=10)
-            res.encoding = 'utf-8'
-            soup = BeautifulSoup(res.text, 'html.parser')
-            title = soup.title.string.rstrip('-书评详情-SF轻小说手机版')
-            content = soup.p.get_text().strip()
-            pattern = r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}$'
-            date = soup.div.span.get_text()
-            date = re.search(pattern, date).group()
-            hudong = soup.find(class_='shuping_hudong book_bk_qs1')
-            if hudong:
-                replies_num, praise_num = hudong.get_text().split()
-            else:
-                replies_num, praise_num = "0", "0"
-
-            review_info = {
-                'title': title,
-                'content': content,
-                'date': date,
-                'replies_num': replies_num,
-                'praise_num': praise_num,
-                'replys': self.get_replies(),
-            }
-            msg += f"## {review_info['title']} - 评论时间{review_info['date']} 评论数{review_info['replies_num']}, 点赞数{review_info['praise_num']}\n\n"
-            msg += f'{review_info["content"]}\n\n'
-            msg += f'{review_info["replys"]}\n\n'
-            return msg
-        except Exception as e:
-            print(f"获取评论信息出错: {str(e)}")
-            return f"获取评论信息出错: {str(e)}\n\n"
-
-    def get_replies(self) -> str:
-        """获取评论的回复"""
-        i = 0
-        reply_base_url = 'https://m.sfacg.com/API/HTML5.ashx'
-        replies = []
-        try:
-            while True:
-                params = {
-                    'op': 'getcmtreply',
-                    'cid': self.cid,
-                    'pi': i,
-                    'withcmt': 'false',
-                    '_': int(time.time() * 1000),
-                }
-                json_data = requests.get(
-                    url=reply_base_url,
-                    headers=self.headers,
-                    params=params,
-                    timeout=10
-                ).json()
-
-                if not json_data.get('Replys', []):
-                    break
-
-                reply_info = self.__json_info(json_data)
-                replies.append(reply_info)
-                i += 1
-                time.sleep(0.5)  # 降低请求频率
-        except Exception as e:
-            print(f"获取评论回复出错: {str(e)}")
-            replies.append(f"获取评论回复出错: {str(e)}")
-
-        reply_msg = '\n'.join(replies)
-        return reply_msg
+        return f'<Job {self.kind} {self.nid} {self.state}>'
 
-    def __json_info(self, data) -> str:
-        """解析回复的JSON数据"""
-        replys = []
-        for item in data['Replys']:
-            user_name = item.get('DisplayName', '匿名用户')
-            content = item.get('Content', '').strip()
-            date = item.get('CreateTime', '未知时间')
-            replys.append(f"- {user_name} ({date}): {content}")
+    @property
+    def title(self) -> str:
+        return getattr(self.engine, 'title', '') or ''
 
-        return '\n'.join(replys)
+    @property
+    def finished(self) -> bool:
+        return self.state in ('done', 'failed', 'cancelled')
 
-    def down_one_review(self):
-        """下载一篇评论"""
-        try:
-            review_info = self.get_info()
-            print(review_info)
-
-            # 确保保存目录存在
-            if not os.path.exists(self.save_dir):
-                os.makedirs(self.save_dir)
-
-            # 构建完整文件路径
-            file_path = os.path.join(self.save_dir, f'{self.title}.md')
-            with open(file_path, 'a+', encoding='utf-8') as f:
-                f.write(review_info)
-            time.sleep(1)  # 降低请求频率，避免被反爬
-        except Exception as e:
-            print(f"下载评论出错: {str(e)}")
-
-
-class BookReviews:
-    """小说的评论类"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    review_base_url = 'https://m.sfacg.com/cmt/l/list/'
-    base_url = 'https://m.sfacg.com/API/HTML5.ashx'
+    def elapsed(self) -> float:
+        return self._active + (time.perf_counter() - self._since if self._since is not None else 0)
 
-    def __init__(self, url, save_dir, progress_callback=None):
-        self.nid = url.strip('/').split('/')[-1]
-        self.url = self.review_base_url + self.nid + '/'
-        self.title = self.__get_title()
-        self.save_dir = save_dir  # 保存目录
-        self.progress_callback = progress_callback  # 用于更新进度条的回调函数
+    def speed(self) -> float:
+        """每秒完成的章节或评论数"""
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
 
-    def __repr__(self):
-        return f'<BookReviews {self.url}>'
-
-    def __get_title(self):
-        """获取小说的标题"""
-        try:
-            res = requests.get(url=self.url, headers=self.headers, timeout=10)
-            res.encoding = 'utf-8'
-            soup = BeautifulSoup(res.text, 'html.parser')
-            title = soup.title.string.rstrip('小说书评列表-SF轻小说手机版')
-            return title
-        except Exception as e:
-            print(f"获取小说标题出错: {str(e)}")
-            return f"未知小说_{int(time.time())}"
+    def start(self, executor: ThreadPoolExecutor, events: queue.Queue) -> None:
+        """在新线程中开始下载，在主线程中调用"""
+        self.started = True
+        self.state = 'running'
+        self.events = events
+        self._since = time.perf_counter()
+        threading.Thread(target=self.run, args=(executor,), daemon=True).start()
 
-    def download_reviews(self):
-        """获取并下载小说的所有评论"""
+    def run(self, executor: ThreadPoolExecutor) -> None:
         try:
-            i = 0
-            review_ids = []
-            msg = f'# {self.title} 长评'
-
-            print("正在获取评论列表...")
-            while True:
-                params = {
-                    'op': 'getcmtlist',
-                    'nid': self.nid,
-                    'so': 'addtime',
-                    'pi': i,
-                    'ctype': 'long',
-                    'len': 60,
-                    '_': int(time.time() * 1000),
-                }
-                json_data = requests.get(
-                    url=self.base_url,
-                    headers=self.headers,
-                    params=params,
-                    timeout=10
-                ).json()
-
-                if not json_data.get('Cmts', []):
-                    break
-
-                cids = [item['CommentID'] for item in json_data['Cmts']]
-                review_ids.extend(cids)
-                print(f"已获取第{i + 1}页评论，共{len(review_ids)}条")
-                i += 1
-                time.sleep(1)  # 降低请求频率
-
-            total = len(review_ids)
-            msg += f' 共{total}条评论\n\n'
-            print(msg)
-
-            # 确保保存目录存在
-            if not os.path.exists(self.save_dir):
-                os.makedirs(self.save_dir)
-
-            # 构建完整文件路径
-            file_path = os.path.join(self.save_dir, f'{self.title}.md')
-
-            # 写入标题信息
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(msg)
-
-            # 下载每条评论
-            print(f"开始下载{total}条评论...")
-            for idx, cid in enumerate(review_ids[::-1]):
-                # 检查是否已被用户终止
-                if hasattr(self, 'is_running') and not self.is_running:
-                    break
-
-                print(f"正在下载第{idx + 1}/{total}条评论")
-                review = Review(cid, self.title, self.save_dir)
-                review.down_one_review()
-
-                # 更新进度条
-                if self.progress_callback:
-                    self.progress_callback(int((idx + 1) / total * 100))
-
-            if hasattr(self, 'is_running') and self.is_running:
-                print('所有评论下载完毕！')
-                print(f'文件已保存为: {file_path}')
-                return True
+            if self.kind == 'novel':
+                from book import Novel
+                self.engine = Novel(self.nid, workers=CHAPTER_WORKERS, executor=executor, progress=self.progress)
+                self.output = self.engine.download_novel(resume=self.resume)
+                if self.engine.failures:
+                    self.error = f'{len(self.engine.failures)}章下载失败'
             else:
-                print('下载已终止')
-                return False
+                from review import BookReviews
+                self.engine = BookReviews(self.nid, progress=self.progress)
+                self.output = self.engine.download_reviews(concurrency=REVIEW_CONCURRENCY, resume=self.resume)
+            self.state = 'done'
+        except JobCancelled:
+            self.state = 'cancelled'
+            print(f'已取消 {self.KINDS[self.kind]} {self.nid}，勾选“断点续传”后重新加入可从中断处继续')
         except Exception as e:
-            print(f"下载评论时出错: {str(e)}")
-            return False
+            self.state = 'failed'
+            self.error = str(e)
+            print(f'{self.KINDS[self.kind]} {self.nid} 下载出错: {e!r}')
+        finally:
+            self.events.put(('job_done', self))
+
+    def progress(self, done: int, total: int) -> None:
+        """下载线程中每完成一章或一篇评论调用一次"""
+        self.done, self.total = done, total
+        self.events.put(('job', self))
+        self._unpaused.wait()
+        if self._cancelled:
+            raise JobCancelled
+
+    def pause(self) -> None:
+        if self.finished or self.state == 'paused':
+            return
+        self._unpaused.clear()
+        if self._since is not None:
+            self._active += time.perf_counter() - self._since
+            self._since = None
+        self.state = 'paused'
+
+    def unpause(self) -> None:
+        if self.state != 'paused':
+            return
+        self.state = 'running' if self.started else 'queued'
+        if self.started:
+            self._since = time.perf_counter()
+        self._unpaused.set()
+
+    def cancel(self) -> None:
+        if self.finished:
+            return
+        self._cancelled = True
+        self._unpaused.set()
+        if not self.started:
+            self.state = 'cancelled'
+
+    def stop_timer(self) -> None:
+        if self._since is not None:
+            self._active += time.perf_counter() - self._since
+            self._since = None
+
+
+class JobRow:
+    """任务列表中的一行：名称、进度条、速度和控制按钮"""
+
+    def __init__(self, parent, job: Job, on_change):
+        self.job = job
+        self.on_change = on_change
+        self.frame = ttk.Frame(parent, padding=(0, 2))
+        self.frame.pack(fill=tk.X)
+        self.name_var = tk.StringVar()
+        ttk.Label(self.frame, textvariable=self.name_var, width=28).pack(side=tk.LEFT, padx=5)
+        self.progress_var = tk.DoubleVar()
+        ttk.Progressbar(self.frame, variable=self.progress_var, maximum=100, length=200).pack(
+            side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.info_var = tk.StringVar()
+        ttk.Label(self.frame, textvariable=self.info_var, width=30).pack(side=tk.LEFT, padx=5)
+        self.pause_btn = ttk.Button(self.frame, text="暂停", width=6, command=self.toggle_pause)
+        self.pause_btn.pack(side=tk.LEFT, padx=2)
+        self.cancel_btn = ttk.Button(self.frame, text="取消", width=6, command=self.cancel)
+        self.cancel_btn.pack(side=tk.LEFT, padx=2)
+        self.refresh()
+
+    def toggle_pause(self):
+        if self.job.state == 'paused':
+            self.job.unpause()
+        else:
+            self.job.pause()
+        self.on_change()
+
+    def cancel(self):
+        self.job.cancel()
+        self.on_change()
+
+    def refresh(self):
+        job = self.job
+        self.name_var.set(f'{job.KINDS[job.kind]} {job.nid} {job.title}')
+        if job.total:
+            self.progress_var.set(job.done / job.total * 100)
+        info = job.STATES[job.state]
+        if job.total:
+            info += f' {job.done}/{job.total} {job.speed():.1f}/秒'
+        if job.error:
+            info += f' {job.error}'
+        self.info_var.set(info)
+        self.pause_btn.config(text="继续" if job.state == 'paused' else "暂停",
+                              state=tk.DISABLED if job.finished else tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED if job.finished else tk.NORMAL)
 
 
 class NovelReviewCrawlerGUI:
-    """GUI界面"""
+    """GUI界面
+
+    可以同时把多本小说的正文和长评加入下载队列，按设定的任务数并发下载，每个任务可以单独暂停、继续或取消。
+    """
 
     def __init__(self, root: tk.Tk):
         self.root = root
-        self.root.title("SF轻小说长评下载器")
-        self.root.geometry("800x600")
+        self.root.title("SF轻小说下载器")
+        self.root.geometry("900x700")
         self.root.resizable(True, True)
 
         # 设置中文字体
@@ -265,19 +230,42 @@ class NovelReviewCrawlerGUI:
         # 默认保存目录为用户文档
         self.save_dir = os.path.join(os.path.expanduser('~'), 'Documents', '小说评论')
 
+        self.jobs: list[Job] = []
+        self.rows: dict[Job, JobRow] = {}
+        # 所有小说共用一个章节线程池
+        self.executor = ThreadPoolExecutor(max_workers=CHAPTER_WORKERS, thread_name_prefix='chapter')
+
         # 创建界面组件
         self.create_widgets()
 
-        # 标志位，用于控制线程
-        self.is_running = False
-        self.book_reviews = None
-
         # 添加状态栏
         self.status_var = tk.StringVar()
-        self.status_var.set("就绪")
+        self.status_var.set("正在加载...")
         self.status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
+        # 下载线程的print和日志都显示在输出区域
+        self.original_stdout = sys.stdout
+        sys.stdout = self.redirect
+        self.log_handler = None
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # 主线程定时处理下载线程发来的事件
+        self.root.after(PUMP_INTERVAL, self.pump_events)
+        # 窗口画出来之后再加载下载模块
+        self.root.after_idle(self.load_engine)
+
+    def load_engine(self):
+        """在后台线程中导入下载相关的模块，导入期间窗口照常响应"""
+        def load():
+            import importlib
+            for name in ENGINE_MODULES:
+                importlib.import_module(name)
+            from loguru import logger
+            self.log_handler = logger.add(self.redirect, format='{time:HH:mm:ss} {level} {message}', level='INFO')
+            self.set_status("就绪")
+        threading.Thread(target=load, daemon=True).start()
+
     def setup_fonts(self):
         """设置支持中文的字体"""
         default_font = ('SimHei', 10)
@@ -290,14 +278,31 @@ class NovelReviewCrawlerGUI:
         main_frame.pack(fill=tk.BOTH, expand=True)
 
         # URL输入区域
-        url_frame = ttk.LabelFrame(main_frame, text="小说URL", padding="5")
+        url_frame = ttk.LabelFrame(main_frame, text="小说URL或ID，每行一个", padding="5")
         url_frame.pack(fill=tk.X, pady=5)
 
-        ttk.Label(url_frame, text="请输入小说详情页URL:").pack(side=tk.LEFT, padx=5)
+        self.url_text = tk.Text(url_frame, height=3)
+        self.url_text.pack(fill=tk.X, padx=5)
+        self.url_text.insert(tk.END, "https://m.sfacg.com/b/43708/")  # 默认URL
+
+        option_frame = ttk.Frame(url_frame)
+        option_frame.pack(fill=tk.X, pady=(5, 0))
+
+        self.novel_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="正文", variable=self.novel_var).pack(side=tk.LEFT, padx=5)
+        self.reviews_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(option_frame, text="长评", variable=self.reviews_var).pack(side=tk.LEFT, padx=5)
+        self.resume_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(option_frame, text="断点续传", variable=self.resume_var).pack(side=tk.LEFT, padx=5)
 
-        self.url_entry = ttk.Entry(url_frame)
-        self.url_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
-        self.url_entry.insert(0, "https://m.sfacg.com/b/43708/")  # 默认URL
+        ttk.Label(option_frame, text="同时下载:").pack(side=tk.LEFT, padx=(15, 2))
+        self.workers_var = tk.IntVar(value=2)
+        ttk.Spinbox(option_frame, from_=1, to=8, width=4, textvariable=self.workers_var,
+                    command=self.schedule_jobs).pack(side=tk.LEFT)
+
+        self.add_btn = ttk.Button(option_frame, text="加入队列", command=self.add_jobs)
+        self.add_btn.pack(side=tk.LEFT, padx=10)
+        ttk.Button(option_frame, text="清除已结束", command=self.clear_finished).pack(side=tk.LEFT, padx=5)
 
         # 保存目录选择区域
         dir_frame = ttk.LabelFrame(main_frame, text="保存文件夹", padding="5")
@@ -310,17 +315,20 @@ class NovelReviewCrawlerGUI:
         self.browse_btn = ttk.Button(dir_frame, text="浏览...", command=self.browse_directory)
         self.browse_btn.pack(side=tk.LEFT, padx=5)
 
-        # 按钮区域
-        button_frame = ttk.Frame(main_frame, padding="5")
-        button_frame.pack(fill=tk.X, pady=5)
-
-        self.start_btn = ttk.Button(button_frame, text="开始下载", command=self.start_download)
-        self.start_btn.pack(side=tk.LEFT, padx=5)
-
-        self.stop_btn = ttk.Button(button_frame, text="停止", command=self.stop_download, state=tk.DISABLED)
-        self.stop_btn.pack(side=tk.LEFT, padx=5)
-
-        # 进度条
+        # 任务列表，任务多时可以滚动
+        jobs_frame = ttk.LabelFrame(main_frame, text="下载任务", padding="5")
+        jobs_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        canvas = tk.Canvas(jobs_frame, height=160, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(jobs_frame, orient=tk.VERTICAL, command=canvas.yview)
+        self.jobs_inner = ttk.Frame(canvas)
+        self.jobs_inner.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+        window = canvas.create_window((0, 0), window=self.jobs_inner, anchor=tk.NW)
+        canvas.bind("<Configure>", lambda e: canvas.itemconfigure(window, width=e.width))
+        canvas.configure(yscrollcommand=scrollbar.set)
+        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # 总进度：已结束的任务占全部任务的比例
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(main_frame, variable=self.progress_var, maximum=100)
         self.progress_bar.pack(fill=tk.X, pady=5)
@@ -329,17 +337,19 @@ class NovelReviewCrawlerGUI:
         output_frame = ttk.LabelFrame(main_frame, text="输出信息", padding="5")
         output_frame.pack(fill=tk.BOTH, expand=True, pady=5)
 
-        self.output_text = scrolledtext.ScrolledText(output_frame, wrap=tk.WORD, state=tk.DISABLED)
+        self.output_text = scrolledtext.ScrolledText(output_frame, wrap=tk.WORD, state=tk.DISABLED, height=10)
         self.output_text.pack(fill=tk.BOTH, expand=True)
 
+        # 下载线程发往主线程的事件：('log', 文本)、('status', 文本)、('job', 任务)、('job_done', 任务)
+        self.events = queue.Queue()
         # 重定向标准输出
-        self.redirect = RedirectText(self.output_text)
+        self.redirect = RedirectText(self.events)
 
     def browse_directory(self):
         """浏览并选择保存目录"""
         directory = filedialog.askdirectory(
             initialdir=self.save_dir,
-            title="选择保存评论的目录"
+            title="选择保存目录"
         )
         if directory:
             self.save_dir = directory
@@ -347,98 +357,147 @@ class NovelReviewCrawlerGUI:
             self.dir_entry.insert(0, directory)
             self.status_var.set(f"保存目录: {directory}")
 
-    def update_progress(self, value):
-        """更新进度条和状态栏"""
-        self.progress_var.set(value)
-        self.status_var.set(f"正在下载... 进度: {value}%")
-        self.root.update_idletasks()
+    def set_status(self, text):
+        """更新状态栏，可在任意线程调用"""
+        self.events.put(('status', text))
+
+    def pump_events(self):
+        """在主线程中批量处理事件队列，日志合并后一次写入，每个任务每批只刷新一次"""
+        logs = []
+        changed = set()
+        status = None
+        finished = False
+        for _ in range(PUMP_BATCH):
+            try:
+                kind, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'log':
+                logs.append(value)
+            elif kind == 'status':
+                status = value
+            elif kind == 'job':
+                changed.add(value)
+            elif kind == 'job_done':
+                value.stop_timer()
+                changed.add(value)
+                finished = True
+        if logs:
+            self.append_log(''.join(logs))
+        for job in changed:
+            if job in self.rows:
+                self.rows[job].refresh()
+        if finished:
+            self.schedule_jobs()
+        elif changed:
+            self.update_summary()
+        if status is not None:
+            self.status_var.set(status)
+        # 队列里还有事件时尽快继续处理，否则按间隔等待
+        self.root.after(1 if not self.events.empty() else PUMP_INTERVAL, self.pump_events)
+
+    def append_log(self, text):
+        """在输出区域末尾追加文本，只保留最后 ``LOG_MAX_LINES`` 行"""
+        self.output_text.configure(state="normal")
+        self.output_text.insert(tk.END, text)
+        lines = int(self.output_text.index('end-1c').split('.')[0])
+        if lines > LOG_MAX_LINES:
+            self.output_text.delete('1.0', f'{lines - LOG_MAX_LINES + 1}.0')
+        self.output_text.see(tk.END)  # 滚动到最后
+        self.output_text.configure(state="disabled")
 
-    def start_download(self):
-        """开始下载评论"""
-        url = self.url_entry.get().strip()
-        if not url:
+    def add_jobs(self):
+        """把输入的小说加入下载队列"""
+        kinds = [kind for kind, var in (('novel', self.novel_var), ('reviews', self.reviews_var)) if var.get()]
+        if not kinds:
+            messagebox.showerror("错误", "请至少勾选正文或长评")
+            return
+        lines = [line.strip() for line in self.url_text.get('1.0', tk.END).splitlines() if line.strip()]
+        if not lines:
             messagebox.showerror("错误", "请输入小说URL")
             return
-
-        # 支持的网址前缀列表，可以根据实际情况添加或修改
-        valid_prefixes = [
-            "https://m.sfacg.com/b/",
-            "https://www.sfacg.com/b/",
-            "https://sfacg.com/b/",
-            "https://book.sfacg.com/Novel/",
-            # 可以继续添加其他有效的网址前缀
-        ]
-
-        # 检查URL是否以任何有效前缀开头
-        if not any(url.startswith(prefix) for prefix in valid_prefixes):
-            messagebox.showerror(
-                "错误", 
-                f"请输入正确的小说详情页URL，支持的格式包括:\n{', '.join(valid_prefixes)}"
-            )
+        # 模块还在后台加载时会等它加载完
+        from cli import parse_nid
+        try:
+            nids = list(dict.fromkeys(parse_nid(line) for line in lines))
+        except ValueError as e:
+            messagebox.showerror("错误", f"{e}\n支持小说详情页URL，如 https://m.sfacg.com/b/43708/，或直接输入小说ID")
             return
 
-        # 获取保存目录
-        self.save_dir = self.dir_entry.get().strip()
-        if not self.save_dir:
-            messagebox.showerror("错误", "请选择保存目录")
+        if not self.active_jobs():
+            # 下载结果写在当前目录，没有进行中的任务时才能切换保存目录
+            save_dir = self.dir_entry.get().strip()
+            if not save_dir:
+                messagebox.showerror("错误", "请选择保存目录")
+                return
+            os.makedirs(save_dir, exist_ok=True)
+            os.chdir(save_dir)
+            self.save_dir = save_dir
+
+        active = {(job.nid, job.kind) for job in self.jobs if not job.finished}
+        for nid in nids:
+            for kind in kinds:
+                if (nid, kind) in active:
+                    continue
+                job = Job(nid, kind, resume=self.resume_var.get())
+                self.jobs.append(job)
+                self.rows[job] = JobRow(self.jobs_inner, job, self.schedule_jobs)
+        self.url_text.delete('1.0', tk.END)
+        self.schedule_jobs()
+
+    def active_jobs(self) -> list[Job]:
+        return [job for job in self.jobs if job.started and not job.finished]
+
+    def schedule_jobs(self):
+        """在主线程中启动排队的任务，同时下载的任务不超过设定的数量
+
+        暂停的任务仍占用一个名额，取消或完成后才会启动下一个
+        """
+        try:
+            workers = max(1, int(self.workers_var.get()))
+        except (tk.TclError, ValueError):
+            workers = 1
+        running = len(self.active_jobs())
+        for job in self.jobs:
+            if running >= workers:
+                break
+            if job.state == 'queued':
+                job.start(self.executor, self.events)
+                running += 1
+        for row in self.rows.values():
+            row.refresh()
+        self.update_summary()
+
+    def update_summary(self):
+        """更新总进度和状态栏"""
+        counts = {state: 0 for state in Job.STATES}
+        for job in self.jobs:
+            counts[job.state] += 1
+        ended = counts['done'] + counts['failed'] + counts['cancelled']
+        self.progress_var.set(ended / len(self.jobs) * 100 if self.jobs else 0)
+        self.browse_btn.config(state=tk.DISABLED if self.active_jobs() else tk.NORMAL)
+        self.status_var.set(f"共{len(self.jobs)}个任务: " +
+                            ', '.join(f'{Job.STATES[state]}{n}' for state, n in counts.items() if n))
+
+    def clear_finished(self):
+        """从列表中移除已结束的任务"""
+        for job in [job for job in self.jobs if job.finished]:
+            self.jobs.remove(job)
+            self.rows.pop(job).frame.destroy()
+        self.update_summary()
+
+    def on_close(self):
+        """关闭窗口时取消所有任务"""
+        if self.active_jobs() and not messagebox.askyesno("确认", "还有任务在下载，确定要退出吗？"):
             return
-
-        # 禁用开始按钮和浏览按钮，启用停止按钮
-        self.start_btn.config(state=tk.DISABLED)
-        self.browse_btn.config(state=tk.DISABLED)
-        self.stop_btn.config(state=tk.NORMAL)
-        self.is_running = True
-        self.status_var.set("开始获取评论列表...")
-
-        # 清空输出区域
-        self.output_text.configure(state="normal")
-        self.output_text.delete(1.0, tk.END)
-        self.output_text.configure(state="disabled")
-
-        # 重置进度条
-        self.progress_var.set(0)
-
-        # 保存原始的stdout
-        self.original_stdout = sys.stdout
-        # 重定向stdout到文本框
-        sys.stdout = self.redirect
-
-        # 在新线程中执行下载任务，避免UI卡顿
-        def download_task():
-            try:
-                self.book_reviews = BookReviews(url, self.save_dir, self.update_progress)
-                self.book_reviews.is_running = True  # 添加运行状态标志
-                success = self.book_reviews.download_reviews()
-                if success:
-                    self.status_var.set("下载完成")
-                else:
-                    self.status_var.set("下载已终止")
-            except Exception as e:
-                error_msg = f"发生错误: {str(e)}"
-                print(error_msg)
-                self.status_var.set(error_msg)
-            finally:
-                # 恢复stdout
-                sys.stdout = self.original_stdout
-                # 恢复按钮状态
-                self.root.after(0, lambda: self.start_btn.config(state=tk.NORMAL))
-                self.root.after(0, lambda: self.browse_btn.config(state=tk.NORMAL))
-                self.root.after(0, lambda: self.stop_btn.config(state=tk.DISABLED))
-                self.is_running = False
-                self.book_reviews = None
-
-        self.download_thread = threading.Thread(target=download_task)
-        self.download_thread.start()
-
-    def stop_download(self):
-        """停止下载"""
-        if messagebox.askyesno("确认", "确定要停止下载吗？"):
-            self.is_running = False
-            if self.book_reviews:
-                self.book_reviews.is_running = False
-            self.stop_btn.config(state=tk.DISABLED)
-            self.status_var.set("正在停止下载...")
-            print("正在停止下载...")
+        for job in self.jobs:
+            job.cancel()
+        sys.stdout = self.original_stdout
+        if self.log_handler is not None:
+            from loguru import logger
+            logger.remove(self.log_handler)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
 
 
 if __name__ == '__main__':
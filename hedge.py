@@ -0,0 +1,205 @@
+"""对冲请求和主机故障转移
+
+同一章节在移动端 ``m.sfacg.com/c/`` 和PC端 ``book.sfacg.com/Novel/`` 都能取到。按主机记录最近的请求耗时，
+请求超过该主机的p95耗时仍未返回时，向备用地址（没有备用地址时是同一地址）再发一个对冲请求，
+先成功返回的为准，慢的那个结果丢弃。整本下载的总时长往往被少数特别慢的章节拖长，对冲只多发约5%的请求，
+就能把这些长尾砍掉。某个主机连续出错时暂时停用，请求直接发往另一个主机，出错的请求也会立即改发备用地址。
+
+    url, response = hedge.get([mobile_url, pc_url])
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+
+import client
+import metrics
+
+# 是否发送对冲请求，为False时只做故障转移
+HEDGE = True
+# 超过该百分位的耗时即发送对冲请求；样本不足时使用DEFAULT_DELAY，耗时阈值不低于MIN_DELAY
+PERCENTILE = 95
+MIN_SAMPLES = 20
+DEFAULT_DELAY = 2.0
+MIN_DELAY = 0.05
+# 每个主机保留的最近耗时样本数
+WINDOW = 200
+# 对冲请求占全部请求的比例上限，整体变慢时不会把请求量翻倍
+MAX_HEDGE_RATIO = 0.1
+# 连续出错多少次后停用主机，停用多少秒
+FAILURE_THRESHOLD = 3
+COOLDOWN = 30.0
+# 对冲和故障转移请求单独使用的线程数，不和首发请求排队
+HEDGE_WORKERS = 8
+
+# 首发请求的线程池，大小随 ``client`` 的并发设置变化，发起请求的线程只等待结果
+_executor: ThreadPoolExecutor | None = None
+_executor_size = 0
+_hedge_executor: ThreadPoolExecutor | None = None
+_hosts: dict[str, 'HostStats'] = {}
+_requests = 0
+_hedges = 0
+_lock = threading.Lock()
+
+
+class HostStats:
+    """一个主机最近的请求耗时和连续出错次数"""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.latencies = deque(maxlen=WINDOW)
+        self.failures = 0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(host="{self.host}", samples={len(self.latencies)}, failures={self.failures})'
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            self.failures = 0
+            self.down_until = 0.0
+
+    def fail(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= FAILURE_THRESHOLD:
+                self.down_until = time.monotonic() + COOLDOWN
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def hedge_delay(self) -> float:
+        """发送对冲请求前等待的秒数"""
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return DEFAULT_DELAY
+            samples = sorted(self.latencies)
+        return max(MIN_DELAY, metrics.percentile(samples, PERCENTILE))
+
+
+def host_stats(url: str) -> HostStats:
+    host = urlsplit(url).netloc
+    with _lock:
+        if host not in _hosts:
+            _hosts[host] = HostStats(host)
+        return _hosts[host]
+
+
+def reset() -> None:
+    """清空各主机的统计"""
+    global _requests, _hedges
+    with _lock:
+        _hosts.clear()
+        _requests = _hedges = 0
+
+
+def _pool_size() -> int:
+    """首发请求的线程数：有在途请求上限时与之相同，否则与连接池相同（连接池应不小于下载线程数）"""
+    return client.MAX_IN_FLIGHT if client.MAX_IN_FLIGHT > 0 else client.POOL_SIZE
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """首发请求的线程池，线程数不另设上限，``client.configure`` 改了并发设置时按新的大小重建"""
+    global _executor, _executor_size
+    size = _pool_size()
+    with _lock:
+        if _executor is None or _executor_size != size:
+            if _executor is not None:
+                # 已提交的请求继续执行完，之后的请求交给新线程池
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='hedge')
+            _executor_size = size
+        return _executor
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    """对冲和故障转移请求的线程池，首发请求占满线程时它们也不必排队"""
+    global _hedge_executor
+    with _lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge-backup')
+        return _hedge_executor
+
+
+def _allow_hedge() -> bool:
+    global _hedges
+    with _lock:
+        if _hedges >= MAX_HEDGE_RATIO * _requests:
+            return False
+        _hedges += 1
+        return True
+
+
+def _fetch(url: str, **kwargs) -> requests.Response:
+    """请求一个地址并记录该主机的耗时，4xx/5xx也算出错"""
+    stats = host_stats(url)
+    start = time.perf_counter()
+    try:
+        response = client.get(url, **kwargs)
+        response.raise_for_status()
+    except requests.RequestException:
+        stats.fail()
+        raise
+    # 缓存命中不反映主机的快慢
+    if not getattr(response, 'from_cache', False):
+        stats.record(time.perf_counter() - start)
+    return response
+
+
+def _order(urls: list[str]) -> list[str]:
+    """可用的主机排在前面，其余保持原顺序"""
+    return sorted(urls, key=lambda url: not host_stats(url).healthy())
+
+
+def get(urls: list[str], **kwargs) -> tuple[str, requests.Response]:
+    """请求同一内容的若干个地址之一，返回 (实际使用的地址, 响应)
+
+    先请求第一个可用的地址，超过其主机的p95耗时仍未返回时向下一个地址发送对冲请求，
+    只有一个地址时对冲请求发往同一地址。请求出错时立即改发下一个地址。
+
+    Args:
+        urls: list[str] 内容相同的地址，按优先顺序排列
+        kwargs: 传给 ``client.get``
+
+    Raises:
+        requests.RequestException: 所有地址都失败
+    """
+    global _requests
+    with _lock:
+        _requests += 1
+    candidates = _order(urls)
+    # 备用地址只用一次；只有一个地址时对冲请求发往同一地址，但出错时不再重发
+    backup = candidates[1] if len(candidates) > 1 else candidates[0]
+    primary = _get_executor().submit(_fetch, candidates[0], **kwargs)
+    futures = {primary: candidates[0]}
+    hedged = False
+    if HEDGE:
+        wait([primary], timeout=host_stats(candidates[0]).hedge_delay())
+        if not primary.done() and _allow_hedge():
+            metrics.count('hedged')
+            hedged = True
+            futures[_get_hedge_executor().submit(_fetch, backup, **kwargs)] = backup
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except requests.RequestException as e:
+                error = e
+                if len(futures) == 1 and len(candidates) > 1:
+                    metrics.count('failovers')
+                    failover = _get_hedge_executor().submit(_fetch, backup, **kwargs)
+                    futures[failover] = backup
+                    pending.add(failover)
+                continue
+            if hedged and future is not primary:
+                metrics.count('hedge_wins')
+            return futures[future], response
+    raise error
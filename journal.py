@@ -0,0 +1,91 @@
+"""检查点日志
+
+下载过程中每完成一个章节或一篇评论就往日志末尾追加一行JSON，进程崩溃、Ctrl-C
+或在GUI中停止后，下次以 ``resume=True`` 运行即可跳过已完成的部分。
+全部完成并写出结果后日志会被删除。
+"""
+import json
+import os
+import threading
+
+
+class Journal:
+    """追加写入的检查点日志，每行一条 ``{"key": ..., "value": ...}``
+
+    内存中只保存每条记录在文件中的偏移，内容在 ``get`` 时才从文件读出，日志再大也不占内存。
+
+    Args:
+        path: str 日志文件路径
+        resume: bool 为True时读取已有记录，否则清空旧日志重新开始
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # 键 -> 该行在文件中的字节偏移，包括恢复时读到的和本次运行新记录的
+        self._offsets = self._load() if resume else {}
+        # 恢复时读到的键
+        self.done = set(self._offsets)
+        self._file = open(path, 'ab' if resume else 'wb')
+        self._size = self._file.tell()
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(path="{self.path}", done={len(self.done)})'
+
+    def __contains__(self, key) -> bool:
+        return str(key) in self._offsets
+
+    def get(self, key, default=None):
+        """从文件中读出一项已完成工作的内容"""
+        offset = self._offsets.get(str(key))
+        if offset is None:
+            return default
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.path, 'rb')
+            self._reader.seek(offset)
+            line = self._reader.readline()
+        return json.loads(line)['value']
+
+    def _load(self) -> dict:
+        offsets = {}
+        end = 0
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    # 崩溃时最后一行可能只写了一半
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    offsets[entry['key']] = end
+                    end += len(line)
+        except FileNotFoundError:
+            return offsets
+        # 截掉写了一半的行，之后追加的记录才不会接在它后面
+        os.truncate(self.path, end)
+        return offsets
+
+    def record(self, key, value) -> None:
+        """记录一项已完成的工作并立即刷到磁盘"""
+        key = str(key)
+        line = (json.dumps({'key': key, 'value': value}, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._offsets[key] = self._size
+            self._size += len(line)
+
+    def close(self) -> None:
+        self._file.close()
+        if self._reader is not None:
+            self._reader.close()
+
+    def finish(self) -> None:
+        """全部完成后删除日志"""
+        self.close()
+        os.remove(self.path)
@@ -0,0 +1,237 @@
+"""请求和各处理阶段的指标
+
+``client`` 记录每次HTTP请求的耗时、字节数、状态码、重试和缓存命中，章节的解析、渲染和写盘也各自计时。
+每条记录会交给注册的钩子（例如 ``JsonLinesExporter`` 逐行写成JSON），同时按阶段汇总，
+结束时可以导出Prometheus文本格式，或用 ``summary`` 打印各阶段的p50/p95耗时和每秒章节数，
+判断慢是慢在网络、解析还是磁盘。
+
+    with metrics.timer('parse', url=url):
+        ...
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Callable
+from contextlib import contextmanager
+from functools import wraps
+
+# fetch: 一次HTTP请求（不含缓存命中），parse: 解析HTML，render: 生成markdown/HTML/EPUB，write: 写文件
+STAGES = ('fetch', 'parse', 'render', 'write')
+# 每个阶段最多保留的耗时样本数，超过后按蓄水池抽样替换，长时间运行的进程内存不会增长
+RESERVOIR = 4096
+
+
+class _Stage:
+    """一个阶段的次数、合计、最大值，以及计算百分位数用的均匀抽样"""
+    __slots__ = ('count', 'sum', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples: list[float] = []
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < RESERVOIR:
+            self.samples.append(seconds)
+        else:
+            index = _random.randrange(self.count)
+            if index < RESERVOIR:
+                self.samples[index] = seconds
+
+
+_lock = threading.Lock()
+_hooks: list[Callable[[dict], None]] = []
+_random = random.Random()
+_stages: dict[str, _Stage] = defaultdict(_Stage)
+_counters: Counter = Counter()
+_statuses: Counter = Counter()
+_started = time.time()
+
+
+def add_hook(hook: Callable[[dict], None]) -> None:
+    """注册钩子，每条记录都会以dict传给它"""
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[dict], None]) -> None:
+    with _lock:
+        _hooks.remove(hook)
+
+
+def clear_hooks() -> None:
+    """移除所有钩子"""
+    with _lock:
+        _hooks.clear()
+
+
+def reset() -> None:
+    """清空汇总数据并重新开始计时，钩子保留"""
+    global _started
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _statuses.clear()
+        _started = time.time()
+
+
+def record(stage: str, seconds: float, **fields) -> None:
+    """记录一个阶段的一次耗时
+
+    Args:
+        stage: str 阶段名，见 ``STAGES``
+        seconds: float 耗时
+        fields: 附加字段，``bytes`` 计入字节总数，``status`` 计入状态码分布
+    """
+    with _lock:
+        _stages[stage].add(seconds)
+        if 'bytes' in fields:
+            _counters[f'{stage}_bytes'] += fields['bytes']
+        if 'status' in fields:
+            _statuses[fields['status']] += 1
+        hooks = list(_hooks)
+    if hooks:
+        event = {'ts': time.time(), 'stage': stage, 'seconds': seconds, **fields}
+        for hook in hooks:
+            hook(event)
+
+
+def count(name: str, n: int = 1) -> None:
+    """计数，例如 ``cache_hits``、``retries``、``chapters``"""
+    with _lock:
+        _counters[name] += n
+
+
+@contextmanager
+def timer(stage: str, **fields):
+    """给一段代码计时，产出的dict中可以补充字段，例如 ``bytes``"""
+    extra = {}
+    start = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        record(stage, time.perf_counter() - start, **fields, **extra)
+
+
+def timed(stage: str):
+    """装饰器，给每次调用计时"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start, name=fn.__qualname__)
+        return wrapper
+    return decorator
+
+
+def percentile(samples: list[float], p: float) -> float:
+    """最近秩法求百分位数，samples需已排序"""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, math.ceil(p / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+def snapshot() -> dict:
+    """当前的汇总数据"""
+    with _lock:
+        totals = {stage: (s.count, s.sum, s.max, sorted(s.samples)) for stage, s in _stages.items()}
+        counters = dict(_counters)
+        statuses = dict(_statuses)
+        elapsed = time.time() - _started
+    stages = {
+        stage: {
+            'count': count,
+            'sum': total,
+            'p50': percentile(samples, 50),
+            'p95': percentile(samples, 95),
+            'max': longest,
+        }
+        for stage, (count, total, longest, samples) in totals.items()
+    }
+    return {'elapsed': elapsed, 'stages': stages, 'counters': counters, 'statuses': statuses}
+
+
+def summary() -> str:
+    """本次运行的汇总，包括各阶段的p50/p95耗时和每秒章节数"""
+    data = snapshot()
+    elapsed = data['elapsed'] or 1e-9
+    counters = data['counters']
+    lines = []
+    for stage in STAGES + tuple(sorted(set(data['stages']) - set(STAGES))):
+        if stage not in data['stages']:
+            continue
+        s = data['stages'][stage]
+        lines.append(f'{stage:<6} {s["count"]:>7}次  p50 {s["p50"] * 1000:8.1f}ms  p95 {s["p95"] * 1000:8.1f}ms  '
+                     f'合计 {s["sum"]:7.1f}s')
+    chapters = counters.get('chapters', 0)
+    fetched = counters.get('fetch_bytes', 0)
+    lines.append(f'章节 {chapters}章, {chapters / elapsed:.1f} 章/秒; 下载 {fetched / 1024 / 1024:.1f}MB; '
+                 f'用时 {elapsed:.1f}s')
+    lines.append(f'缓存命中 {counters.get("cache_hits", 0)}, 重新验证 {counters.get("cache_revalidated", 0)}, '
+                 f'未命中 {counters.get("cache_misses", 0)}; 重试 {counters.get("retries", 0)}; '
+                 f'状态码 {dict(sorted(data["statuses"].items()))}')
+    return '\n'.join(lines)
+
+
+def export_prometheus(path: str, prefix: str = 'sfacg') -> None:
+    """以Prometheus文本格式写出汇总，可交给node_exporter的textfile收集器"""
+    data = snapshot()
+    lines = [
+        f'# HELP {prefix}_stage_seconds Time spent in each stage.',
+        f'# TYPE {prefix}_stage_seconds summary',
+    ]
+    for stage, s in sorted(data['stages'].items()):
+        lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50"]}')
+        lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95"]}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {s["sum"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+    lines.append(f'# TYPE {prefix}_http_responses_total counter')
+    for status, n in sorted(data['statuses'].items()):
+        lines.append(f'{prefix}_http_responses_total{{status="{status}"}} {n}')
+    for name, n in sorted(data['counters'].items()):
+        lines.append(f'# TYPE {prefix}_{name}_total counter')
+        lines.append(f'{prefix}_{name}_total {n}')
+    lines.append(f'# TYPE {prefix}_elapsed_seconds gauge')
+    lines.append(f'{prefix}_elapsed_seconds {data["elapsed"]}')
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    # 原子替换，收集器不会读到写了一半的文件
+    os.replace(tmp, path)
+
+
+class JsonLinesExporter:
+    """把每条记录写成一行JSON的钩子
+
+    Args:
+        path: str 输出文件，追加写入
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(path="{self.path}")'
+
+    def __call__(self, event: dict) -> None:
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,74 @@
+"""下载得到的数据记录
+
+抓取代码只负责把页面解析成这些记录，markdown、HTML、EPUB等格式由 ``render`` 中的函数生成，
+同一份数据可以输出多种格式，也可以不重新请求就重新渲染。记录都使用 ``__slots__``，
+回复多达几万条的书也不会因为每条一个dict而占用大量内存。
+"""
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class NovelInfo:
+    """小说信息页"""
+    nid: str
+    title: str
+    author: str
+    url: str = ''
+    label: str = ''
+    word_num: str = ''
+    click_num: str = ''
+    date: str = ''
+    clock: str = ''
+    heart_num: str = ''
+    praise_num: str = ''
+    intro: str = '暂无简介'
+    cover_url: str = ''
+
+
+@dataclass(slots=True, frozen=True)
+class ChapterRef:
+    """目录中的一章"""
+    title: str
+    url: str
+
+
+@dataclass(slots=True)
+class VolumeRef:
+    """目录中的一卷"""
+    title: str
+    chapters: list[ChapterRef] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class ChapterBody:
+    """章节正文
+
+    blocks按顺序保存正文的段落和插图，每项为 ``('text', 文字)`` 或 ``('img', 图片地址)``
+    """
+    title: str
+    url: str
+    blocks: list[tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def images(self) -> list[str]:
+        return [value for kind, value in self.blocks if kind == 'img']
+
+
+@dataclass(slots=True)
+class Reply:
+    """评论的一条回复"""
+    user_name: str
+    content: str
+    date: str
+
+
+@dataclass(slots=True)
+class Review:
+    """一篇长评及其回复"""
+    cid: str
+    title: str
+    content: str
+    date: str
+    replies_num: int
+    praise_num: int
+    replies: list[Reply] = field(default_factory=list)
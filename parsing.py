@@ -0,0 +1,41 @@
+"""HTML解析后端
+
+安装了lxml时用lxml解析，否则退回标准库的 ``html.parser``。每种页面只解析提取时
+真正用到的标签（``SoupStrainer``），跳过 ``<head>`` 里的脚本样式、页脚等无关内容。
+"""
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    FEATURES = 'lxml'
+except ImportError:
+    FEATURES = 'html.parser'
+
+# 章节页：正文在 soup.div.div 中
+CHAPTER = SoupStrainer('div')
+# PC端章节页：正文在 #ChapterBody 中
+PC_CHAPTER = SoupStrainer(id='ChapterBody')
+# 小说信息页：.book_info、.book_info3、.book_bk_qs1 和收藏/点赞数所在的 <small>
+NOVEL_INFO = SoupStrainer(['div', 'small'])
+# 目录页：.mulu 要靠 next_sibling 找到章节列表，保留整个 <body>
+MENU = SoupStrainer('body')
+# 书评详情页：标题、正文 soup.p、日期 soup.div.span 和 .shuping_hudong
+REVIEW = SoupStrainer(['title', 'div', 'p'])
+# 只需要 <title> 的页面，如书评列表页
+TITLE = SoupStrainer('title')
+
+
+class MissingContent(ValueError):
+    """章节页里找不到正文，如未购买的VIP章节或网站返回的错误页"""
+
+
+def make_soup(markup: str | bytes, parse_only: SoupStrainer | None = None,
+              features: str | None = None) -> BeautifulSoup:
+    """解析HTML
+
+    Args:
+        markup: str 页面内容
+        parse_only: SoupStrainer 只解析匹配的标签，为None时解析整页
+        features: str 解析器，默认为 ``FEATURES``
+    """
+    return BeautifulSoup(markup, features or FEATURES, parse_only=parse_only)
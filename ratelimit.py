@@ -0,0 +1,64 @@
+"""令牌桶限速器
+
+所有请求发出前先从桶里取一个令牌。服务器返回429或5xx时速率减半，
+之后每个成功的请求让速率逐步恢复到设定值（AIMD）。
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """线程安全的令牌桶
+
+    Args:
+        rate: float 每秒补充的令牌数，即稳定状态下的每秒请求数
+        burst: int 桶容量，允许的瞬时突发请求数
+        min_rate: float 退避时速率的下限
+        recover_step: float 每个成功请求恢复的速率，占设定速率的比例
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.5, recover_step: float = 0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.recover_step = recover_step
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(rate={self.rate:.2f}/{self.max_rate}, burst={self.burst})'
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """取一个令牌，桶空时阻塞等待"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, retry_after: float | None = None):
+        """服务器拒绝或出错时调用：速率减半，清空桶；给出Retry-After时暂停相应时长"""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            # 负的令牌数相当于欠账，需要等补足后才能继续发请求
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.tokens = min(self.tokens, -retry_after * self.rate)
+
+    def recover(self):
+        """请求成功时调用：速率线性恢复到设定值"""
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.recover_step)
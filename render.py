@@ -0,0 +1,72 @@
+"""把 ``models`` 中的记录渲染成markdown和HTML
+
+渲染与抓取分开，已下载的记录可以直接重新渲染成别的格式，不必重新请求。
+"""
+from html import escape
+
+import metrics
+from models import ChapterBody, NovelInfo, Reply, Review
+
+
+@metrics.timed('render')
+def novel_info_md(info: NovelInfo, cover: str | None = None) -> str:
+    """小说信息的markdown
+
+    Args:
+        info: NovelInfo 小说信息
+        cover: str 本地封面路径，为None时使用封面的原始地址
+    """
+    return f"""
+# {info.title}-{info.author}
+
+## 小说信息
+
+![封面]({cover or info.cover_url})
+
+原文地址：{info.url}
+
+作者：{info.author}\t字数：{info.word_num} 点击量：{info.click_num}
+
+标签：{info.label}
+
+最近更新时间：{info.date} {info.clock}
+
+收藏量：{info.heart_num}\t点赞数：{info.praise_num}
+
+{info.intro}
+
+{'='*20}
+
+"""
+
+
+@metrics.timed('render')
+def chapter_md(body: ChapterBody) -> str:
+    """章节的markdown，以三级标题开头"""
+    parts = [f'### {body.title}']
+    for kind, value in body.blocks:
+        parts.append(f'![]({value})' if kind == 'img' else value)
+    return '\n\n'.join(parts).strip()
+
+
+@metrics.timed('render')
+def chapter_html(body: ChapterBody) -> str:
+    """章节的HTML片段，便于ebooklib解析"""
+    parts = [f'<h3>{escape(body.title)}</h3><div>']
+    for kind, value in body.blocks:
+        parts.append(f'<img src="{escape(value)}"/>' if kind == 'img' else f'<p>{escape(value)}</p>')
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+def replies_md(replies: list[Reply]) -> str:
+    """回复列表的markdown，每条一行"""
+    return '\n'.join(f'- {reply.user_name} ({reply.date}): {reply.content})' for reply in replies)
+
+
+@metrics.timed('render')
+def review_md(review: Review) -> str:
+    """一篇长评及其回复的markdown"""
+    return (f'## {review.title} - 评论时间{review.date} 评论数{review.replies_num}, 点赞数{review.praise_num}\n\n'
+            f'{review.content}\n\n'
+            f'{replies_md(review.replies)}\n\n')
@@ -0,0 +1,83 @@
+"""请求重试策略
+
+连接错误、超时、429和5xx按带抖动的指数退避重试（full jitter），避免大量线程在同一时刻重试。
+所有请求共用一个重试预算：每个新请求存入一定比例的额度，每次重试消耗一个，
+网站持续出错时重试次数被限制在总请求数的一定比例内，不会把故障放大成重试风暴。
+"""
+import random
+import threading
+
+import requests
+
+# 可以重试的异常，HTTP状态码另由 ``retryable_status`` 判断
+RETRY_EXCEPTIONS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def retryable_status(status_code: int) -> bool:
+    """429和5xx可以重试"""
+    return status_code == 429 or status_code >= 500
+
+
+class RetryPolicy:
+    """带抖动的指数退避
+
+    Args:
+        retries: int 最多重试的次数，不含第一次请求
+        base: float 第一次重试的最长等待秒数，之后每次翻倍
+        cap: float 单次等待的上限秒数
+    """
+
+    def __init__(self, retries: int = 3, base: float = 0.5, cap: float = 30.0):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(retries={self.retries}, base={self.base}, cap={self.cap})'
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """第attempt次重试（从0开始）前的等待秒数，服务器给出Retry-After时不少于它"""
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.cap))
+        return delay
+
+
+class RetryBudget:
+    """线程安全的重试预算
+
+    Args:
+        ratio: float 每个新请求存入的额度，即稳定状态下重试次数占请求数的比例上限
+        reserve: float 初始额度，程序刚启动、请求还不多时也能重试
+        cap: float 额度上限，长时间顺利运行后不会攒下过多额度
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 10.0, cap: float = 100.0):
+        self.ratio = ratio
+        self.cap = max(cap, reserve)
+        self.balance = reserve
+        self.retries = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(ratio={self.ratio}, balance={self.balance:.1f})'
+
+    def deposit(self) -> None:
+        """发出一个新请求时调用"""
+        with self._lock:
+            self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        """准备重试时调用，额度不足时返回False，此时不应重试"""
+        with self._lock:
+            if self.balance < 1:
+                self.rejected += 1
+                return False
+            self.balance -= 1
+            self.retries += 1
+            return True
@@ -1,7 +1,23 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import itertools
+import os
 import re
 import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import client
+import metrics
+import models
+import parsing
+import render
+import state
+from client import HEADERS
+from journal import Journal
+
+if TYPE_CHECKING:
+    from db import Store
 
 # 小说详情页 https://m.sfacg.com/b/49038/
 # 评论列表 https://m.sfacg.com/cmt/l/list/49038/
@@ -10,10 +26,9 @@ import time
 class Review:
     """小说一篇评论的类"""
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    headers = HEADERS
     base_url = 'https://m.sfacg.com/cmt/l/'
+    reply_base_url = 'https://m.sfacg.com/API/HTML5.ashx'
 
     def __init__(self, url, title):
         self.cid = str(url).strip('/').split('/')[-1]
@@ -25,68 +40,54 @@ class Review:
 
     def get_info(self):
         """获取评论的信息"""
-        msg = ''
-        res = requests.get(url=self.url, headers=self.headers)
+        return render.review_md(self.get_review())
+
+    def get_review(self) -> models.Review:
+        """获取评论的信息和回复，未格式化"""
+        res = client.get(self.url)
         res.encoding = 'utf-8'
-        soup = BeautifulSoup(res.text, 'html.parser')
+        review = self._parse_info(res.text)
+        review.replies = self.get_replies()
+        return review
+
+    @metrics.timed('parse')
+    def _parse_info(self, html: str) -> models.Review:
+        """解析评论详情页"""
+        soup = parsing.make_soup(html, parsing.REVIEW)
         title = soup.title.string.rstrip('-书评详情-SF轻小说手机版')
         content = soup.p.get_text().strip()
         pattern = r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}$'
         date = soup.div.span.get_text()
         date = re.search(pattern, date).group()
         replies_num, praise_num = soup.find(class_='shuping_hudong book_bk_qs1').get_text().split()
-        review_info = {
-            'title': title,
-            'content': content,
-            'date': date,
-            'replies_num': replies_num,
-            'praise_num': praise_num,
-            'replys': self.get_replies(),
+        return models.Review(self.cid, title, content, date, int(replies_num), int(praise_num))
+
+    def _reply_params(self, i: int) -> dict:
+        return {
+            'op': 'getcmtreply',
+            'cid': self.cid,
+            'pi': i,
+            'withcmt': 'false',
+            '_': int(time.time() * 1000),
         }
-        msg += f"## {review_info['title']} - 评论时间{review_info['date']} 评论数{review_info['replies_num']}, 点赞数{review_info['praise_num']}\n\n"
-        msg += f'{review_info['content']}\n\n'
-        msg += f'{review_info['replys']}\n\n'
-        return msg
 
-    def get_replies(self) -> str:
+    def get_replies(self) -> list[models.Reply]:
         """获取评论的回复"""
         i = 0
-        reply_base_url = 'https://m.sfacg.com/API/HTML5.ashx'
         replies = []
         while True:
-            params = {
-                'op': 'getcmtreply',
-                'cid': self.cid,
-                'pi': i,
-                'withcmt': 'false',
-                '_': int(time.time() * 1000),
-            }
-            json_data = requests.get(url=reply_base_url, headers=self.headers, params=params).json()
+            json_data = client.get(self.reply_base_url, params=self._reply_params(i)).json()
             # print(json_data)
             if json_data['Replys'] == []:
                 break
-            reply_info = self.__json_info(json_data)
-            replies.append(reply_info)
+            replies.extend(self._json_info(json_data))
             i += 1
-        reply_msg = '\n'.join(replies)
-        return reply_msg
+        return replies
 
-    def __json_info(self, data) -> str:
-        """获取评论的回复"""
-        replys = []
-        for item in data['Replys']:
-            user_name = item['DisplayName']
-            content = item['Content'].strip()
-            date = item['CreateTime']
-            reply_info =  {
-                'user_name': user_name,
-                'content': content,
-                'date': date
-            }
-            replys.append(reply_info)
-        reply_msg = '\n'.join([f"- {item['user_name']} ({item['date']}): {item['content']})" for item in replys])
-
-        return reply_msg
+    def _json_info(self, data) -> list[models.Reply]:
+        """解析一页回复"""
+        return [models.Reply(item['DisplayName'], item['Content'].strip(), item['CreateTime'])
+                for item in data['Replys']]
 
     def down_one_review(self):
         """下载一篇评论"""
@@ -95,44 +96,191 @@ class Review:
         with open(f'{self.title}.md', 'a+', encoding='utf-8') as f:
             f.write(review_info)
 
+class ReviewCrawler:
+    """基于asyncio的评论爬虫，多篇评论同时下载，并预取回复的后续页
+
+    所有请求共用一个并发上限，请求本身仍通过 ``client`` 的连接池在线程中发送。
+
+    Args:
+        concurrency: int 同时进行的请求数上限
+        prefetch: int 每轮并发请求的分页数，遇到空页即停止
+    """
+
+    def __init__(self, concurrency: int = 8, prefetch: int = 4):
+        self.concurrency = concurrency
+        self.prefetch = prefetch
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._executor.shutdown()
+
+    async def _get(self, url: str, params: dict | None = None, max_age: float | None = None):
+        """max_age同 ``client.get``"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor,
+                                              lambda: client.get(url, params=params, max_age=max_age))
+
+    async def _get_json(self, url: str, params: dict | None = None, max_age: float | None = None) -> dict:
+        res = await self._get(url, params, max_age)
+        return res.json()
+
+    async def _pages(self, url: str, make_params, key: str, max_age: float | None = None) -> list[dict]:
+        """按页预取，返回第一个空页之前的所有页"""
+        pages = []
+        i = 0
+        while True:
+            batch = await asyncio.gather(*(
+                self._get_json(url, make_params(i + k), max_age) for k in range(self.prefetch)
+            ))
+            for json_data in batch:
+                if json_data[key] == []:
+                    return pages
+                pages.append(json_data)
+            i += self.prefetch
+
+    async def get_replies(self, review: Review, max_age: float | None = None) -> list[models.Reply]:
+        """获取评论的回复，max_age同 ``client.get``"""
+        pages = await self._pages(review.reply_base_url, review._reply_params, 'Replys', max_age)
+        return [reply for json_data in pages for reply in review._json_info(json_data)]
+
+    async def get_review(self, review: Review, max_age: float | None = None) -> models.Review:
+        """获取评论的信息和回复，详情页与回复同时请求
+
+        Args:
+            max_age: float 同 ``client.get``，详情页和回复页使用同一个值，回复数与回复内容不会一新一旧
+        """
+        res, replies = await asyncio.gather(self._get(review.url, max_age=max_age),
+                                            self.get_replies(review, max_age))
+        res.encoding = 'utf-8'
+        info = review._parse_info(res.text)
+        info.replies = replies
+        return info
+
+    async def get_info(self, review: Review) -> str:
+        """获取评论的信息"""
+        return render.review_md(await self.get_review(review))
+
+    async def get_detail(self, review: Review, max_age: float | None = None) -> models.Review:
+        """只请求详情页，不获取回复，max_age同 ``client.get``"""
+        res = await self._get(review.url, max_age=max_age)
+        res.encoding = 'utf-8'
+        return review._parse_info(res.text)
+
+    async def get_review_ids(self, book: 'BookReviews') -> list:
+        """获取小说所有长评的CommentID"""
+        pages = await self._pages(book.base_url, book._list_params, 'Cmts')
+        return [item['CommentID'] for json_data in pages for item in json_data['Cmts']]
+
+    async def _checkpointed_info(self, review: Review, journal: Journal | None) -> str:
+        if journal is None:
+            return await self.get_info(review)
+        if review.cid in journal:
+            return journal.get(review.cid)
+        info = await self.get_info(review)
+        journal.record(review.cid, info)
+        return info
+
+    async def crawl(self, book: 'BookReviews', journal: Journal | None = None) -> tuple[list, list[str]]:
+        """下载小说的全部评论，按写入顺序返回 (CommentID列表, 每篇评论的markdown)
+
+        Args:
+            book: BookReviews 要下载的小说
+            journal: Journal 检查点日志，已记录的评论不再下载，每篇评论完成时立即记录
+        """
+        async with self:
+            review_ids = await self.get_review_ids(book)
+            reviews = [Review(cid, book.title) for cid in review_ids[::-1]]
+            done = 0
+
+            async def fetch(review: Review) -> str:
+                nonlocal done
+                info = await self._checkpointed_info(review, journal)
+                done += 1
+                if book.progress is not None:
+                    book.progress(done, len(reviews))
+                return info
+            infos = await asyncio.gather(*(fetch(review) for review in reviews))
+        return review_ids, infos
+
 class BookReviews:
     """小说的评论类"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    headers = HEADERS
     review_base_url = 'https://m.sfacg.com/cmt/l/list/'
     base_url = 'https://m.sfacg.com/API/HTML5.ashx'
-    def __init__(self, url):
-        self.nid = url.strip('/').split('/')[-1]
+    def __init__(self, url, progress: Callable[[int, int], None] | None = None):
+        self.nid = str(url).strip('/').split('/')[-1]
         self.url = self.review_base_url + self.nid + '/'
         self.title = self.__get_title()
+        # 每下载完一篇评论调用 progress(已完成篇数, 总篇数)，可在其中阻塞以暂停，或抛出异常以取消
+        self.progress = progress
     def __repr__(self):
         return f'<BookReviews {self.url}>'
 
     def __get_title(self):
         """获取小说的评论"""
-        res = requests.get(url=self.url, headers=self.headers)
+        res = client.get(self.url)
         res.encoding = 'utf-8'
-        soup = BeautifulSoup(res.text, 'html.parser')
+        return self._parse_title(res.text)
+
+    @staticmethod
+    def _parse_title(html: str) -> str:
+        soup = parsing.make_soup(html, parsing.TITLE)
         return soup.title.string.rstrip('小说书评列表-SF轻小说手机版')
 
-    def download_reviews(self):
-        """获取小说的评论"""
+    def _list_params(self, i: int) -> dict:
+        return {
+            'op': 'getcmtlist',
+            'nid': self.nid,
+            'so': 'addtime',
+            'pi': i,
+            'ctype': 'long',
+            'len': 60,
+            '_': int(time.time() * 1000),
+        }
+
+    def _journal_path(self) -> str:
+        return state.path('journal', f'reviews-{self.nid}.jsonl')
+
+    def download_reviews(self, concurrency: int = 1, resume: bool = False) -> str:
+        """获取小说的评论
+
+        每下载完一篇评论都会写入检查点日志，中断后以 ``resume=True`` 重新运行可跳过已下载的评论。
+
+        Args:
+            concurrency: int 大于1时使用 ``ReviewCrawler`` 并发下载，输出文件与串行下载相同
+            resume: bool 是否从上次中断处继续
+
+        Returns:
+            str 输出文件路径
+        """
+        journal = Journal(self._journal_path(), resume=resume)
+        if journal.done:
+            print(f'从检查点恢复{len(journal.done)}条评论')
+        try:
+            if concurrency > 1:
+                self._download_reviews_async(concurrency, journal)
+            else:
+                self._download_reviews(journal)
+        except BaseException:
+            journal.close()
+            raise
+        journal.finish()
+        print('下载完毕')
+        if report := client.cache_report():
+            print(report)
+        return f'{self.title}.md'
+
+    def _download_reviews(self, journal: Journal):
         i = 0
         review_ids = []
-        reviews = []
         msg = f'# {self.title} 长评'
         while True:
-            params = {
-                'op': 'getcmtlist',
-                'nid': self.nid,
-                'so': 'addtime',
-                'pi': i,
-                'ctype': 'long',
-                'len': 60,
-                '_': int(time.time() * 1000),
-            }
-            json_data = requests.get(url=self.base_url, headers=self.headers, params=params).json()
+            json_data = client.get(self.base_url, params=self._list_params(i)).json()
             # print(json_data)
             if json_data['Cmts'] == []:
                 break
@@ -142,12 +290,121 @@ class BookReviews:
         print(review_ids)
         msg += f' 共{len(review_ids)}条评论\n\n'
         print(msg)
-        with open(f'{self.title}.md', 'a+', encoding='utf-8') as f:
+        with open(f'{self.title}.md', 'w', encoding='utf-8') as f:
             f.write(msg)
-        for cid in review_ids[::-1]:
-            review = Review(cid, self.title)
-            review.down_one_review()
-        print('下载完毕')
+        for done, cid in enumerate(review_ids[::-1], 1):
+            review_info = journal.get(cid)
+            if review_info is None:
+                review_info = Review(cid, self.title).get_info()
+                journal.record(cid, review_info)
+            print(review_info)
+            with metrics.timer('write'), open(f'{self.title}.md', 'a+', encoding='utf-8') as f:
+                f.write(review_info)
+            if self.progress is not None:
+                self.progress(done, len(review_ids))
+
+    def _download_reviews_async(self, concurrency: int, journal: Journal):
+        crawler = ReviewCrawler(concurrency=concurrency)
+        review_ids, infos = asyncio.run(crawler.crawl(self, journal))
+        print(review_ids)
+        msg = f'# {self.title} 长评 共{len(review_ids)}条评论\n\n'
+        print(msg)
+        with metrics.timer('write'), open(f'{self.title}.md', 'w', encoding='utf-8') as f:
+            f.write(msg)
+            f.writelines(infos)
+
+    def _state_path(self) -> str:
+        return state.path('reviews', f'{self.nid}.json')
+
+    def sync_reviews(self, check_replies: bool = True, concurrency: int = 1) -> str:
+        """增量同步小说的评论
+
+        已下载评论的CommentID、回复数和markdown按nid保存在 ``state.STATE_DIR`` 中。
+        评论列表按发表时间倒序，翻页时遇到已下载的评论即停止；只下载新评论，
+        以及回复数增加了的旧评论，然后重写输出文件，不会产生重复内容。
+
+        Args:
+            check_replies: bool 是否请求旧评论的详情页检查回复数
+            concurrency: int 同时进行的请求数
+
+        Returns:
+            str 输出文件路径
+        """
+        saved = state.load(self._state_path(), {})
+        crawler = ReviewCrawler(concurrency=concurrency, prefetch=min(concurrency, 4))
+        reviews = saved.get('reviews', {})
+        seen = {cid: int(review['replies_num']) for cid, review in reviews.items()}
+        new_ids, updated = asyncio.run(self._sync(crawler, seen, check_replies))
+        reviews.update({cid: {'replies_num': info.replies_num, 'md': render.review_md(info)}
+                        for cid, info in updated.items()})
+        order = new_ids + [cid for cid in saved.get('order', []) if cid not in new_ids]
+        print(f'新评论{len(new_ids)}条，回复有更新{len(updated) - len(new_ids)}条')
+
+        path = f'{self.title}.md'
+        tmp = path + '.tmp'
+        with metrics.timer('write'), open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f'# {self.title} 长评 共{len(order)}条评论\n\n')
+            for cid in order[::-1]:
+                f.write(reviews[cid]['md'])
+        os.replace(tmp, path)
+        state.save(self._state_path(), {'nid': self.nid, 'title': self.title, 'order': order, 'reviews': reviews})
+        print('同步完毕')
+        if report := client.cache_report():
+            print(report)
+        return path
+
+    def sync_db(self, store: 'Store', check_replies: bool = True, concurrency: int = 1) -> int:
+        """把评论增量同步到本地数据库
+
+        与 ``sync_reviews`` 相同，只是已下载的CommentID和回复数从数据库查询，
+        新评论和回复有更新的评论成批写入数据库，之后用 ``Store.export_reviews_md`` 导出。
+
+        Args:
+            store: Store 本地数据库
+            check_replies: bool 是否请求旧评论的详情页检查回复数
+            concurrency: int 同时进行的请求数
+
+        Returns:
+            int 写入数据库的评论数
+        """
+        crawler = ReviewCrawler(concurrency=concurrency, prefetch=min(concurrency, 4))
+        new_ids, updated = asyncio.run(self._sync(crawler, store.review_counts(self.nid), check_replies))
+        store.save_reviews(self.nid, self.title, updated.values())
+        print(f'新评论{len(new_ids)}条，回复有更新{len(updated) - len(new_ids)}条')
+        return len(updated)
+
+    async def _sync(self, crawler: ReviewCrawler, seen: dict[str, int],
+                    check_replies: bool) -> tuple[list[str], dict[str, models.Review]]:
+        """返回 (新评论的CommentID列表，从新到旧, 需要更新的评论)
+
+        同步是为了取到网站上的变化，评论列表、详情页和回复页都不用缓存的内容，每次向网站确认（未修改的只得到304）。
+
+        Args:
+            seen: dict 已下载的评论，{CommentID: 回复数}
+        """
+        async with crawler:
+            new_ids = []
+            i = 0
+            while True:
+                json_data = await crawler._get_json(self.base_url, self._list_params(i), max_age=0)
+                cids = [str(item['CommentID']) for item in json_data['Cmts']]
+                fresh = list(itertools.takewhile(lambda cid: cid not in seen, cids))
+                new_ids.extend(fresh)
+                if not cids or len(fresh) < len(cids):
+                    break
+                i += 1
+
+            stale = []
+            if check_replies:
+                old = [Review(cid, self.title) for cid in seen]
+                details = await asyncio.gather(*(crawler.get_detail(review, max_age=0) for review in old))
+                stale = [review.cid for review, detail in zip(old, details)
+                         if detail.replies_num > seen[review.cid]]
+
+            cids = new_ids + stale
+            infos = await asyncio.gather(*(crawler.get_review(Review(cid, self.title), max_age=0)
+                                           for cid in cids))
+        return new_ids, dict(zip(cids, infos))
 
 
 if __name__ == '__main__':
@@ -155,4 +412,4 @@ if __name__ == '__main__':
     # url = 'https://m.sfacg.com/b/689388/'
     url = 'https://m.sfacg.com/b/43708/'
     b = BookReviews(url)
-    b.download_reviews()
\ No newline at end of file
+    b.download_reviews()
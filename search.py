@@ -0,0 +1,345 @@
+"""本地数据库的全文检索
+
+在 ``db.Store`` 的数据库里为章节正文、长评和回复建立SQLite FTS5倒排索引，使用trigram分词，
+中文不需要分词词典也能按任意片段检索。索引由触发器维护，``Store`` 每写入、更新或删除一章、一篇评论、
+一条回复，索引都在同一个事务里随之更新，同步多少就索引多少，不需要重建。
+索引只保存倒排表，正文仍从原表读取，数据库不会因此多存一份文本。
+
+trigram索引只能检索3个字以上的词，而中文最常见的检索词是两个字，所以另有一组bigram索引：
+文字按两个字一组拆开（"魔法少女" -> "魔法 法少 少女"）后交给unicode61分词，同样按bm25排序。
+拆分用的SQL函数 ``bigrams`` 由 ``register`` 注册，写入数据库的连接都要先注册。
+单个字或带标点的短词两种索引都用不上，才退化为逐行匹配。
+
+    python search.py sfacg.db 魔法少女 --kind chapter --nid 49038
+"""
+import argparse
+import re
+import sqlite3
+import sys
+from dataclasses import dataclass
+
+# 章节正文保存为blocks的JSON，只取其中的文字段落
+_CHAPTER_TEXT = ("(SELECT group_concat(json_extract(value, '$[1]'), char(10)) FROM json_each({}) "
+                 "WHERE json_extract(value, '$[0]') = 'text')")
+
+SCHEMA = f"""
+CREATE VIEW IF NOT EXISTS chapter_text AS
+    SELECT rowid AS id, title, {_CHAPTER_TEXT.format('blocks')} AS body FROM chapters;
+CREATE VIRTUAL TABLE IF NOT EXISTS chapter_fts USING fts5(
+    title, body, content='chapter_text', content_rowid='id', tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS review_fts USING fts5(
+    title, content, content='reviews', content_rowid='comment_id', tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS reply_fts USING fts5(
+    user_name, content, content='replies', tokenize='trigram');
+
+CREATE TRIGGER IF NOT EXISTS chapters_fts_insert AFTER INSERT ON chapters BEGIN
+    INSERT INTO chapter_fts (rowid, title, body)
+    VALUES (new.rowid, new.title, {_CHAPTER_TEXT.format('new.blocks')});
+END;
+CREATE TRIGGER IF NOT EXISTS chapters_fts_delete AFTER DELETE ON chapters BEGIN
+    INSERT INTO chapter_fts (chapter_fts, rowid, title, body)
+    VALUES ('delete', old.rowid, old.title, {_CHAPTER_TEXT.format('old.blocks')});
+END;
+CREATE TRIGGER IF NOT EXISTS chapters_fts_update AFTER UPDATE ON chapters BEGIN
+    INSERT INTO chapter_fts (chapter_fts, rowid, title, body)
+    VALUES ('delete', old.rowid, old.title, {_CHAPTER_TEXT.format('old.blocks')});
+    INSERT INTO chapter_fts (rowid, title, body)
+    VALUES (new.rowid, new.title, {_CHAPTER_TEXT.format('new.blocks')});
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews BEGIN
+    INSERT INTO review_fts (rowid, title, content) VALUES (new.comment_id, new.title, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews BEGIN
+    INSERT INTO review_fts (review_fts, rowid, title, content)
+    VALUES ('delete', old.comment_id, old.title, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_fts_update AFTER UPDATE ON reviews BEGIN
+    INSERT INTO review_fts (review_fts, rowid, title, content)
+    VALUES ('delete', old.comment_id, old.title, old.content);
+    INSERT INTO review_fts (rowid, title, content) VALUES (new.comment_id, new.title, new.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS replies_fts_insert AFTER INSERT ON replies BEGIN
+    INSERT INTO reply_fts (rowid, user_name, content) VALUES (new.rowid, new.user_name, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS replies_fts_delete AFTER DELETE ON replies BEGIN
+    INSERT INTO reply_fts (reply_fts, rowid, user_name, content)
+    VALUES ('delete', old.rowid, old.user_name, old.content);
+END;
+"""
+
+# bigram索引不保存内容（content=''），删除时用原文重新拆分出要删的词
+BIGRAM_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS chapter_bigram USING fts5(title, body, content='');
+CREATE VIRTUAL TABLE IF NOT EXISTS review_bigram USING fts5(title, content, content='');
+CREATE VIRTUAL TABLE IF NOT EXISTS reply_bigram USING fts5(user_name, content, content='');
+
+CREATE TRIGGER IF NOT EXISTS chapters_bigram_insert AFTER INSERT ON chapters BEGIN
+    INSERT INTO chapter_bigram (rowid, title, body)
+    VALUES (new.rowid, bigrams(new.title), bigrams({_CHAPTER_TEXT.format('new.blocks')}));
+END;
+CREATE TRIGGER IF NOT EXISTS chapters_bigram_delete AFTER DELETE ON chapters BEGIN
+    INSERT INTO chapter_bigram (chapter_bigram, rowid, title, body)
+    VALUES ('delete', old.rowid, bigrams(old.title), bigrams({_CHAPTER_TEXT.format('old.blocks')}));
+END;
+CREATE TRIGGER IF NOT EXISTS chapters_bigram_update AFTER UPDATE ON chapters BEGIN
+    INSERT INTO chapter_bigram (chapter_bigram, rowid, title, body)
+    VALUES ('delete', old.rowid, bigrams(old.title), bigrams({_CHAPTER_TEXT.format('old.blocks')}));
+    INSERT INTO chapter_bigram (rowid, title, body)
+    VALUES (new.rowid, bigrams(new.title), bigrams({_CHAPTER_TEXT.format('new.blocks')}));
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_bigram_insert AFTER INSERT ON reviews BEGIN
+    INSERT INTO review_bigram (rowid, title, content)
+    VALUES (new.comment_id, bigrams(new.title), bigrams(new.content));
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_bigram_delete AFTER DELETE ON reviews BEGIN
+    INSERT INTO review_bigram (review_bigram, rowid, title, content)
+    VALUES ('delete', old.comment_id, bigrams(old.title), bigrams(old.content));
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_bigram_update AFTER UPDATE ON reviews BEGIN
+    INSERT INTO review_bigram (review_bigram, rowid, title, content)
+    VALUES ('delete', old.comment_id, bigrams(old.title), bigrams(old.content));
+    INSERT INTO review_bigram (rowid, title, content)
+    VALUES (new.comment_id, bigrams(new.title), bigrams(new.content));
+END;
+
+CREATE TRIGGER IF NOT EXISTS replies_bigram_insert AFTER INSERT ON replies BEGIN
+    INSERT INTO reply_bigram (rowid, user_name, content)
+    VALUES (new.rowid, bigrams(new.user_name), bigrams(new.content));
+END;
+CREATE TRIGGER IF NOT EXISTS replies_bigram_delete AFTER DELETE ON replies BEGIN
+    INSERT INTO reply_bigram (reply_bigram, rowid, user_name, content)
+    VALUES ('delete', old.rowid, bigrams(old.user_name), bigrams(old.content));
+END;
+"""
+
+FTS_TABLES = ('chapter_fts', 'review_fts', 'reply_fts')
+BIGRAM_TABLES = ('chapter_bigram', 'review_bigram', 'reply_bigram')
+# 退化为逐行匹配时自己截取的摘要长度（字）
+SNIPPET_CHARS = 48
+
+# 每种结果的查询，{joins}处接上用到的索引表，{where}处填入检索条件，rank为bm25得分，越小越相关；
+# 最后一列是行号，没有trigram摘要时据此取原文自己截取摘要
+QUERIES = {
+    'chapter': """
+        SELECT 'chapter', chapters.nid, chapters.title, chapters.url, {snippet}, {rank}, chapters.rowid
+        FROM chapters {joins} WHERE {where}""",
+    'review': """
+        SELECT 'review', reviews.nid, reviews.title, 'https://m.sfacg.com/cmt/l/' || reviews.comment_id || '/',
+               {snippet}, {rank}, reviews.comment_id
+        FROM reviews {joins} WHERE {where}""",
+    'reply': """
+        SELECT 'reply', reviews.nid, replies.user_name || ' 回复 ' || reviews.title,
+               'https://m.sfacg.com/cmt/l/' || reviews.comment_id || '/', {snippet}, {rank}, replies.rowid
+        FROM replies JOIN reviews ON reviews.comment_id = replies.comment_id {joins} WHERE {where}""",
+}
+KINDS = tuple(QUERIES)
+# 各种结果在原表中的行号、可检索的两列（标题或用户名、正文）
+_ROWID = {'chapter': 'chapters.rowid', 'review': 'reviews.comment_id', 'reply': 'replies.rowid'}
+_COLUMNS = {
+    'chapter': ('chapters.title', _CHAPTER_TEXT.format('chapters.blocks')),
+    'review': ('reviews.title', 'reviews.content'),
+    'reply': ('replies.user_name', 'replies.content'),
+}
+_SOURCE = {'chapter': 'chapters', 'review': 'reviews', 'reply': 'replies'}
+_TABLES = dict(zip(KINDS, FTS_TABLES))
+_BIGRAM_TABLES = dict(zip(KINDS, BIGRAM_TABLES))
+_NID_COLUMN = {'chapter': 'chapters.nid', 'review': 'reviews.nid', 'reply': 'reviews.nid'}
+# unicode61分词把字母、数字和汉字当作词的一部分，下划线和标点都是分隔符
+_WORD = re.compile(r'[^\W_]+')
+
+
+@dataclass(slots=True)
+class Hit:
+    """一条检索结果"""
+    kind: str
+    nid: str
+    title: str
+    url: str
+    snippet: str
+    score: float
+
+
+def bigrams(text: str | None) -> str | None:
+    """把文字拆成以空格分隔的两字组，如 ``魔法少女`` -> ``魔法 法少 少女``"""
+    if text is None:
+        return None
+    return ' '.join(word[i:i + 2] for word in _WORD.findall(text.lower()) for i in range(len(word) - 1))
+
+
+def register(conn: sqlite3.Connection) -> None:
+    """注册索引触发器用到的SQL函数，写入章节、评论或回复的连接都要先调用"""
+    conn.create_function('bigrams', 1, bigrams, deterministic=True)
+
+
+def install(conn: sqlite3.Connection) -> None:
+    """在数据库中建立索引表和触发器，新建的索引会从已有数据重建一次"""
+    register(conn)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chapter_fts'").fetchone()
+    bigram_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chapter_bigram'").fetchone()
+    with conn:
+        conn.executescript(SCHEMA)
+        conn.executescript(BIGRAM_SCHEMA)
+        if not exists:
+            # 内容来自带子查询的视图时FTS5的rebuild会出错，章节逐行插入
+            conn.execute('INSERT INTO chapter_fts (rowid, title, body) SELECT id, title, body FROM chapter_text')
+            for table in ('review_fts', 'reply_fts'):
+                conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+            # 章节标题、评论标题比正文的同等命中更相关
+            conn.execute("INSERT INTO chapter_fts (chapter_fts, rank) VALUES ('rank', 'bm25(5.0, 1.0)')")
+            conn.execute("INSERT INTO review_fts (review_fts, rank) VALUES ('rank', 'bm25(5.0, 1.0)')")
+        if not bigram_exists:
+            # 较早建立的数据库只有trigram索引，补建bigram索引
+            conn.execute('INSERT INTO chapter_bigram (rowid, title, body) '
+                         'SELECT id, bigrams(title), bigrams(body) FROM chapter_text')
+            conn.execute('INSERT INTO review_bigram (rowid, title, content) '
+                         'SELECT comment_id, bigrams(title), bigrams(content) FROM reviews')
+            conn.execute('INSERT INTO reply_bigram (rowid, user_name, content) '
+                         'SELECT rowid, bigrams(user_name), bigrams(content) FROM replies')
+            conn.execute("INSERT INTO chapter_bigram (chapter_bigram, rank) VALUES ('rank', 'bm25(5.0, 1.0)')")
+            conn.execute("INSERT INTO review_bigram (review_bigram, rank) VALUES ('rank', 'bm25(5.0, 1.0)')")
+
+
+def _match_expr(terms: list[str]) -> str:
+    """把检索词转成FTS5的查询式，每个词作为一个短语，各词都须出现"""
+    return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _is_bigram(term: str) -> bool:
+    return len(term) == 2 and _WORD.fullmatch(term) is not None
+
+
+def _build(kind: str, terms: list[str], nid: str | None) -> tuple[str, list]:
+    """构造一种结果的查询，返回 (SQL, 参数)
+
+    3个字以上的词用trigram索引，两个字的词用bigram索引，其余的逐行匹配。
+    """
+    rowid = _ROWID[kind]
+    indexed = [term for term in terms if len(term) >= 3]
+    pairs = [term for term in terms if _is_bigram(term)]
+    short = [term for term in terms if len(term) < 3 and not _is_bigram(term)]
+    joins, where, params, ranks = [], [], [], []
+    for table, matched in ((_TABLES[kind], indexed), (_BIGRAM_TABLES[kind], pairs)):
+        if matched:
+            joins.append(f'JOIN {table} ON {table}.rowid = {rowid}')
+            where.append(f'{table} MATCH ?')
+            params.append(_match_expr(matched))
+            ranks.append(f'{table}.rank')
+    for term in short:
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where.append('(' + ' OR '.join(f"{column} LIKE ? ESCAPE '\\'" for column in _COLUMNS[kind]) + ')')
+        params.extend([f'%{escaped}%'] * len(_COLUMNS[kind]))
+    if nid is not None:
+        where.append(f'{_NID_COLUMN[kind]} = ?')
+        params.append(str(nid))
+    # bigram索引不保存内容，只有用到trigram索引时才能由FTS5生成摘要
+    snippet = f"snippet({_TABLES[kind]}, 1, '[', ']', '…', 24)" if indexed else 'NULL'
+    # 没有可用索引的词时无法计算bm25，按写入顺序从新到旧排列
+    rank = ' + '.join(ranks) or '0.0'
+    order = 'score' if ranks else f'{rowid} DESC'
+    sql = (QUERIES[kind].format(snippet=snippet, rank=f'{rank} AS score', joins=' '.join(joins),
+                                where=' AND '.join(where))
+           + f' ORDER BY {order} LIMIT ?')
+    return sql, params
+
+
+def _snippet(text: str, terms: list[str]) -> str:
+    """在原文中截取第一个检索词附近的 ``SNIPPET_CHARS`` 个字，检索词用[]标出"""
+    text = ' '.join((text or '').split())
+    lower = text.lower()
+    found = [(lower.find(term.lower()), term) for term in terms]
+    found = [(start, term) for start, term in found if start >= 0]
+    start = max(0, min(found)[0] - SNIPPET_CHARS // 3) if found else 0
+    end = min(len(text), start + SNIPPET_CHARS)
+    window = text[start:end]
+    for term in sorted(terms, key=len, reverse=True):
+        window = re.sub(re.escape(term), lambda m: f'[{m.group(0)}]', window, flags=re.IGNORECASE)
+    return ('…' if start > 0 else '') + window + ('…' if end < len(text) else '')
+
+
+class Index:
+    """数据库的全文检索
+
+    Args:
+        path: str ``db.Store`` 使用的数据库文件
+    """
+
+    def __init__(self, path: str = 'sfacg.db'):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        install(self._db)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(path="{self.path}")'
+
+    def search(self, query: str, kinds: tuple[str, ...] = KINDS, nid: str | None = None,
+               limit: int = 20) -> list[Hit]:
+        """检索章节、评论和回复，按相关度排序
+
+        Args:
+            query: str 检索词，以空格分隔的多个词须同时出现
+            kinds: tuple 检索的范围，``KINDS`` 中的若干项
+            nid: str 只检索这本小说
+            limit: int 最多返回的结果数
+
+        Returns:
+            list[Hit] 检索结果，score为bm25得分，越小越相关
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        hits = []
+        for kind in kinds:
+            sql, params = _build(kind, terms, nid)
+            for *fields, rowid in self._db.execute(sql, params + [limit]).fetchall():
+                hit = Hit(*fields)
+                if hit.snippet is None:
+                    hit.snippet = _snippet(self._text(kind, rowid), terms)
+                hits.append(hit)
+        hits.sort(key=lambda hit: hit.score)
+        return hits[:limit]
+
+    def _text(self, kind: str, rowid: int) -> str:
+        """一条结果的正文"""
+        row = self._db.execute(f'SELECT {_COLUMNS[kind][1]} FROM {_SOURCE[kind]} WHERE {_ROWID[kind]} = ?',
+                               (rowid,)).fetchone()
+        return row[0] if row else ''
+
+    def optimize(self) -> None:
+        """合并索引的分段，大量同步之后执行可加快检索"""
+        with self._db:
+            for table in FTS_TABLES + BIGRAM_TABLES:
+                self._db.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='sfacg-search', description='检索本地数据库中的章节、长评和回复')
+    parser.add_argument('db', help='数据库文件，由 cli.py --db 生成')
+    parser.add_argument('query', nargs='+', help='检索词，多个词须同时出现')
+    parser.add_argument('--kind', choices=KINDS, action='append', help='只检索章节、评论或回复，可重复指定')
+    parser.add_argument('--nid', help='只检索这本小说')
+    parser.add_argument('-n', '--limit', type=int, default=20, help='最多显示的结果数 (默认20)')
+    parser.add_argument('--optimize', action='store_true', help='检索前先合并索引')
+    args = parser.parse_args(argv)
+    index = Index(args.db)
+    try:
+        if args.optimize:
+            index.optimize()
+        hits = index.search(' '.join(args.query), tuple(args.kind or KINDS), args.nid, args.limit)
+    finally:
+        index.close()
+    for hit in hits:
+        print(f'[{hit.kind}] {hit.nid} {hit.title}  {hit.url}\n    {hit.snippet}')
+    if not hits:
+        print('没有结果')
+    return 0 if hits else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""本地状态文件的读写
+
+增量同步清单等状态以JSON保存在当前目录下的 ``STATE_DIR`` 中，写入时先写临时文件再替换，
+中途退出也不会留下写了一半的文件。
+"""
+import json
+import os
+
+STATE_DIR = '.sfacg'
+
+
+def path(*parts: str) -> str:
+    """状态文件路径，如 ``path('novels', '751089.json')``"""
+    return os.path.join(STATE_DIR, *parts)
+
+
+def load(file: str, default=None):
+    """读取状态文件，不存在时返回default"""
+    try:
+        with open(file, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def save(file: str, data) -> None:
+    """原子地写入状态文件"""
+    os.makedirs(os.path.dirname(file) or '.', exist_ok=True)
+    tmp = file + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, file)
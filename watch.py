@@ -0,0 +1,168 @@
+"""关注小说的更新检查
+
+长期运行，轮流请求每本小说的信息页 ``/b/{nid}``，比较其中的最近更新时间和字数，只有变化了的书
+才去请求目录和新章节。检查500本书只需要500个小请求，而不是500次完整的下载。每一轮的请求均匀分散在
+``interval`` 秒内，不会集中在同一时刻；上次看到的更新时间和字数保存在 ``state.STATE_DIR`` 中，重启后继续。
+
+    python watch.py 49038 -f novels.txt --interval 3600
+    python watch.py -f novels.txt --db sfacg.db --once
+"""
+import argparse
+import sys
+import threading
+import time
+from collections.abc import Callable
+
+from loguru import logger
+
+import client
+import metrics
+import state
+from book import Novel
+from cli import read_targets
+
+# 每轮检查全部小说所用的秒数
+INTERVAL = 60 * 60
+
+
+def _stamp(novel: Novel) -> list[str]:
+    return [novel.info.date, novel.info.clock, novel.info.word_num]
+
+
+class Watcher:
+    """轮流检查一组小说，有更新时调用 ``on_change``
+
+    Args:
+        nids: list[str] 关注的小说
+        on_change: 以 ``Novel`` 为参数，下载更新的函数，默认为 ``Novel.sync_novel``。
+            调用时小说信息已经取到，同步时不会再请求信息页。它抛出异常或 ``Novel.failures`` 不为空时
+            不记录新的更新时间，下一轮会再试
+        interval: float 每轮的秒数，各书的检查均匀分布在其中
+        sync_new: bool 为True时第一次见到的书也当作有更新，否则只记下当前的更新时间
+    """
+
+    def __init__(self, nids: list[str], on_change: Callable[[Novel], object] | None = None,
+                 interval: float = INTERVAL, sync_new: bool = True):
+        self.nids = list(nids)
+        self.on_change = on_change or Novel.sync_novel
+        self.interval = interval
+        self.sync_new = sync_new
+        self.state_file = state.path('watch', 'novels.json')
+        # nid -> {'title', 'stamp': [日期, 时间, 字数], 'checked_at', 'changed_at'}
+        self.seen: dict[str, dict] = state.load(self.state_file, {})
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(novels={len(self.nids)}, interval={self.interval})'
+
+    def check(self, nid: str) -> bool:
+        """检查一本书，有更新时下载，返回是否有更新
+
+        Raises:
+            requests.RequestException: 信息页请求失败
+            RuntimeError: 有章节下载失败，本次更新没有同步完整
+        """
+        # 信息页缓存一小时，检查时必须向网站确认；有更新时目录页同样不能用缓存
+        novel = Novel(nid, max_age=0)
+        novel.fetch_info()
+        metrics.count('watch_checks')
+        stamp = _stamp(novel)
+        old = self.seen.get(nid)
+        changed = old['stamp'] != stamp if old is not None else self.sync_new
+        if changed:
+            logger.info(f'{novel.title} 有更新 {" ".join(stamp)}')
+            metrics.count('watch_changes')
+            self.on_change(novel)
+            if novel.failures:
+                # 不记录新的更新时间，下一轮仍当作有更新，重新同步时补下失败的章节
+                raise RuntimeError(f'{novel.title} 有{len(novel.failures)}章下载失败')
+        now = time.time()
+        self.seen[nid] = {
+            'title': novel.title,
+            'stamp': stamp,
+            'checked_at': now,
+            'changed_at': now if changed or old is None else old.get('changed_at'),
+        }
+        state.save(self.state_file, self.seen)
+        return changed
+
+    def run_round(self) -> list[str]:
+        """检查一轮，各书的请求间隔 ``interval / 书数`` 秒，返回有更新的nid
+
+        单本书失败只记录日志，不影响其他书。
+        """
+        changed = []
+        slot = self.interval / max(len(self.nids), 1)
+        start = time.monotonic()
+        for i, nid in enumerate(self.nids):
+            if self._stop.wait(max(0.0, start + i * slot - time.monotonic())):
+                break
+            try:
+                if self.check(nid):
+                    changed.append(nid)
+            except Exception as e:
+                metrics.count('watch_errors')
+                logger.error(f'检查 {nid} 失败: {e!r}')
+        # 等到本轮的时间用完，保证每本书大约每 interval 秒检查一次
+        self._stop.wait(max(0.0, start + self.interval - time.monotonic()))
+        return changed
+
+    def run(self, rounds: int | None = None) -> None:
+        """循环检查，直到调用 ``stop`` 或跑完 ``rounds`` 轮"""
+        done = 0
+        while not self._stop.is_set() and (rounds is None or done < rounds):
+            changed = self.run_round()
+            done += 1
+            logger.info(f'第{done}轮检查完成，{len(self.nids)}本中{len(changed)}本有更新')
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='sfacg-watch', description='定时检查关注的小说，有更新时下载新章节')
+    parser.add_argument('targets', nargs='*', help='小说ID或链接')
+    parser.add_argument('-f', '--file', action='append', default=[],
+                        help='每行一个小说ID或链接的文件，#后为注释，可重复指定')
+    parser.add_argument('--interval', type=float, default=INTERVAL, help=f'每轮检查的秒数 (默认{INTERVAL})')
+    parser.add_argument('--once', action='store_true', help='只检查一轮，不等待本轮时间用完')
+    parser.add_argument('--no-initial-sync', action='store_true', help='第一次见到的书只记下更新时间，不下载')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='下载新章节的线程数 (默认8)')
+    parser.add_argument('--db', metavar='PATH', help='把更新同步到SQLite数据库，而不是增量更新markdown文件')
+    parser.add_argument('--rate', type=float, default=None, help=f'每秒请求数，0为不限速 (默认{client.RATE})')
+    args = parser.parse_args(argv)
+    try:
+        nids = read_targets(args.targets, args.file)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    if not nids:
+        parser.print_usage(sys.stderr)
+        return 2
+    client.configure(rate=args.rate)
+    if args.db:
+        from db import Store
+    store = Store(args.db) if args.db else None
+
+    def on_change(novel: Novel):
+        novel.workers = args.workers
+        if store is not None:
+            novel.sync_db(store)
+        else:
+            novel.sync_novel()
+
+    watcher = Watcher(nids, on_change, 0 if args.once else args.interval, not args.no_initial_sync)
+    logger.info(f'关注{len(nids)}本小说，每轮{watcher.interval:.0f}秒')
+    try:
+        watcher.run(1 if args.once else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if store is not None:
+            store.close()
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())